@@ -0,0 +1,287 @@
+"""
+The sqladmin panel. Nothing here is imported until the first request under
+/admin: building the Admin pulls in sqladmin, wtforms and jinja2, which the
+API workers do not otherwise need.
+"""
+import os
+
+from datetime import datetime
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import RedirectResponse
+from sqladmin import Admin, BaseView, ModelView, action, expose
+from sqladmin.authentication import AuthenticationBackend
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.orm import selectinload
+from sqlalchemy.sql import Select
+from starlette.applications import Starlette
+from wtforms import EmailField, PasswordField
+
+from . import profiling, tenancy
+from .admin_auth import ADMIN_PASSWORD, ADMIN_USERNAME, SESSION_KEY, SESSION_SECRET_KEY
+from .database import AsyncSessionLocal, TenantSessionmaker
+from .enums import DayKind, OutboxStatus, WeekDays
+from .models import CalendarException, NotificationOutbox, SchoolClass, Schedule, Tablet, Teacher
+from .timetable import Slot, timetable
+
+
+class AdminAuth(AuthenticationBackend):
+    async def login(self, request: Request) -> bool:
+        """Handles the POST request when a user submits the login form."""
+        form = await request.form()
+        username = form.get("username")
+        password = form.get("password")
+
+        if username == ADMIN_USERNAME and password == ADMIN_PASSWORD:
+            request.session.update({SESSION_KEY: "authenticated"}) 
+            return True
+        
+        # Login failed
+        return False
+
+    async def logout(self, request: Request) -> bool:
+        """Handles the logout action."""
+        # Clear the session data
+        request.session.clear()
+        return True
+
+    async def authenticate(self, request: Request) -> Optional[bool]:
+        """Checks if the user is authenticated on every request to the admin panel."""
+        token = request.session.get(SESSION_KEY)
+
+        # If the session key is present, the user is authenticated
+        if token == "authenticated":
+            return True
+        
+        # User is not authenticated, redirect them to the login page
+        return False
+
+
+# Admin list pages; sqladmin caps ?pageSize= at the largest option
+PAGE_SIZE = 50
+PAGE_SIZE_OPTIONS = [25, 50, 100, 200]
+
+
+class SchoolClassAdmin(ModelView, model=SchoolClass):
+    column_list = [SchoolClass.id, SchoolClass.name, SchoolClass.grade]
+    # Not `schedules`: the form and details page would load every slot of the class
+    column_details_list = [SchoolClass.id, SchoolClass.name, SchoolClass.grade]
+    form_columns = [SchoolClass.name, SchoolClass.grade]
+    column_searchable_list = [SchoolClass.name]
+    column_sortable_list = [SchoolClass.id, SchoolClass.name, SchoolClass.grade]
+    page_size = PAGE_SIZE
+    page_size_options = PAGE_SIZE_OPTIONS
+
+
+class TeacherAdmin(ModelView, model=Teacher):
+    column_list = [Teacher.id, Teacher.email_address, Teacher.full_name, Teacher.main_subject, Teacher.token]
+    # The picture is served by /profilePicture, schedules have their own view
+    column_details_exclude_list = [Teacher.token, Teacher.profile_picture_image, Teacher.schedules]
+    column_searchable_list = [Teacher.full_name, Teacher.email_address]
+    column_sortable_list = [Teacher.id, Teacher.full_name, Teacher.email_address]
+    page_size = PAGE_SIZE
+    page_size_options = PAGE_SIZE_OPTIONS
+    form_columns = [
+        Teacher.full_name,
+        Teacher.email_address,
+        Teacher.token,
+        Teacher.postfix,
+        Teacher.prefix,
+        Teacher.main_subject,
+    ]
+
+    form_overrides = {
+        'token': PasswordField,
+        'email_address': EmailField
+    }
+
+    form_args = {
+        'token': {
+            'label': 'Password'
+        }
+    }
+
+
+def _related_id(value, current: int | None) -> int | None:
+    # sqladmin hands over relationships as the selected pk string
+    if value is None or value == "":
+        return current if value is None else None
+    return int(getattr(value, "id", value))
+
+
+class ScheduleAdmin(ModelView, model=Schedule):
+    column_list = [Schedule.id, Schedule.subject, Schedule.school_class, Schedule.teacher, Schedule.weekday, Schedule.time_in, Schedule.time_out] # pyright: ignore
+    column_searchable_list = ["teacher.full_name", "school_class.name", Schedule.weekday, Schedule.id]
+    column_sortable_list = [Schedule.id, Schedule.weekday, Schedule.time_in]
+    page_size = PAGE_SIZE
+    page_size_options = PAGE_SIZE_OPTIONS
+
+    def list_query(self, request: Request) -> Select:
+        # Only what the teacher and class columns print, not whole rows
+        return select(Schedule).options(
+            selectinload(Schedule.teacher).load_only(Teacher.prefix, Teacher.full_name, Teacher.postfix),
+            selectinload(Schedule.school_class).load_only(SchoolClass.name),
+        )
+
+    def search_query(self, stmt: Select, term: str) -> Select:
+        """
+        Matches names in the small teacher and class tables, then filters
+        schedules by the indexed teacher_id/class_id/weekday, instead of
+        joining and LIKE-scanning every schedule row.
+        """
+        term = term.strip()
+
+        if term.isdigit():
+            number = int(term)
+            return stmt.where(or_(Schedule.id == number, Schedule.teacher_id == number, Schedule.class_id == number))
+
+        pattern = f"%{term}%"
+        conditions = [
+            Schedule.teacher_id.in_(select(Teacher.id).where(or_(Teacher.full_name.ilike(pattern), Teacher.email_address.ilike(pattern)))),
+            Schedule.class_id.in_(select(SchoolClass.id).where(SchoolClass.name.ilike(pattern))),
+        ]
+
+        weekday = WeekDays.__members__.get(term.capitalize())
+        if weekday is not None:
+            conditions.append(Schedule.weekday == weekday)
+
+        return stmt.where(or_(*conditions))
+
+    async def on_model_change(self, data: dict, model: Schedule, is_created: bool, request: Request) -> None:
+        weekday = data.get("weekday", model.weekday)
+        if isinstance(weekday, str):
+            weekday = WeekDays[weekday]
+
+        slot = Slot(
+            id=None if is_created else model.id,
+            teacher_id=_related_id(data.get("teacher"), model.teacher_id),  # type: ignore
+            class_id=_related_id(data.get("school_class"), model.class_id),
+            subject=data.get("subject", model.subject),
+            weekday=weekday,
+            time_in=data.get("time_in", model.time_in),
+            time_out=data.get("time_out", model.time_out),
+            is_break=bool(data.get("is_break", model.is_break)),
+        )
+
+        if slot.teacher_id is None or slot.time_in is None or slot.time_out is None:
+            return
+
+        if slot.time_out <= slot.time_in:
+            raise ValueError("time_out must be after time_in")
+
+        async with AsyncSessionLocal() as db:
+            await timetable.ensure_loaded(db)
+
+        conflicts = timetable.conflicts(slot)
+        if conflicts:
+            raise ValueError("Overlaps schedule " + ", ".join(f"#{c.id} ({c.time_in}-{c.time_out})" for c in conflicts))
+
+
+class CalendarExceptionAdmin(ModelView, model=CalendarException):
+    name = "Calendar Exception"
+    name_plural = "Calendar"
+    column_list = [CalendarException.id, CalendarException.name, CalendarException.kind, CalendarException.start_date, CalendarException.end_date, CalendarException.follows]
+    column_default_sort = [(CalendarException.start_date, True)]
+
+    async def on_model_change(self, data: dict, model: CalendarException, is_created: bool, request: Request) -> None:
+        kind = data.get("kind", model.kind)
+        if isinstance(kind, str):
+            kind = DayKind[kind]
+
+        start = data.get("start_date", model.start_date)
+        end = data.get("end_date", model.end_date)
+
+        if start and end and end < start:
+            raise ValueError("end_date must not be before start_date")
+
+        if kind == DayKind.Alternate and not data.get("follows", model.follows):
+            raise ValueError("Alternate days must name the weekday they follow")
+
+
+class TabletAdmin(ModelView, model=Tablet):
+    can_create = False
+    can_edit = False
+    column_list = [Tablet.id, Tablet.label, Tablet.location, Tablet.last_seen, Tablet.created_at]
+
+
+class NotificationDeadLetterAdmin(ModelView, model=NotificationOutbox):
+    name = "Dead Letter"
+    name_plural = "Dead Letters"
+    can_create = False
+    can_edit = False
+    column_list = [
+        NotificationOutbox.id,
+        NotificationOutbox.idempotency_key,
+        NotificationOutbox.teacher_id,
+        NotificationOutbox.title,
+        NotificationOutbox.attempts,
+        NotificationOutbox.last_error,
+        NotificationOutbox.created_at,
+    ]
+    column_default_sort = [(NotificationOutbox.id, True)]
+
+    def list_query(self, request: Request) -> Select:
+        return select(NotificationOutbox).where(NotificationOutbox.status == OutboxStatus.Dead)
+
+    def count_query(self, request: Request) -> Select:
+        return select(func.count(NotificationOutbox.id)).where(NotificationOutbox.status == OutboxStatus.Dead)
+
+    @action(name="retry", label="Retry", confirmation_message="Queue the selected notifications again?")
+    async def retry(self, request: Request):
+        pks = [int(pk) for pk in request.query_params.get("pks", "").split(",") if pk]
+
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id.in_(pks), NotificationOutbox.status == OutboxStatus.Dead)
+                .values(status=OutboxStatus.Pending, attempts=0, next_attempt_at=datetime.now(), last_error=None)
+            )
+            await session.commit()
+
+        return RedirectResponse(request.url_for("admin:list", identity=self.identity), status_code=302)
+
+
+class SlowRequestsAdmin(BaseView):
+    name = "Slow Requests"
+    icon = "fa-solid fa-gauge-high"
+
+    @expose("/slow-requests", methods=["GET"])
+    async def slow_requests(self, request: Request):
+        tenant = tenancy.current()
+        # Newest first; the buffer is this worker's and holds every school's requests
+        entries = [entry for entry in reversed(profiling.SLOW_REQUESTS) if entry.tenant == tenant.name]
+
+        return await self.templates.TemplateResponse(request, "slow_requests.html", {
+            "title": "Slow Requests",
+            "subtitle": f"Slower than {profiling.SLOW_REQUEST_MS:g} ms, last {profiling.SLOW_BUFFER_SIZE} on this worker",
+            "entries": entries,
+        })
+
+
+VIEWS = (
+    SchoolClassAdmin,
+    ScheduleAdmin,
+    TeacherAdmin,
+    CalendarExceptionAdmin,
+    TabletAdmin,
+    NotificationDeadLetterAdmin,
+    SlowRequestsAdmin,
+)
+
+
+def build_admin() -> Starlette:
+    """The admin's own Starlette app, ready to be mounted at /admin."""
+    # Admin mounts itself on the app it is given; the host here is only a carrier
+    # Its own sessionmaker: sqladmin reconfigures it (autoflush off), which must not reach the API's sessions
+    admin = Admin(
+        Starlette(),
+        session_maker=TenantSessionmaker(),
+        authentication_backend=AdminAuth(secret_key=SESSION_SECRET_KEY),
+        templates_dir=os.path.join(os.path.dirname(__file__), "templates"),
+    )
+
+    for view in VIEWS:
+        admin.add_view(view)
+
+    return admin.admin
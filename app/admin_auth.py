@@ -1,39 +1,17 @@
 from hashlib import sha256
-from fastapi.requests import Request
-from sqladmin.authentication import AuthenticationBackend
-from typing import Optional
+from fastapi import HTTPException, Header, status
+from typing import Annotated
 
 ADMIN_USERNAME = "admin"
 ADMIN_PASSWORD = "TN5GR0UP"
 SESSION_KEY = sha256((ADMIN_USERNAME + ADMIN_PASSWORD).encode('utf-8')).hexdigest()
+SESSION_SECRET_KEY = sha256(b'secret_key').hexdigest()
 
-class AdminAuth(AuthenticationBackend):
-    async def login(self, request: Request) -> bool:
-        """Handles the POST request when a user submits the login form."""
-        form = await request.form()
-        username = form.get("username")
-        password = form.get("password")
+async def require_admin(token: Annotated[str, Header(alias='Authorization')]):
+    """Dependency for admin-only API routes; the token is the admin session key."""
+    if token != SESSION_KEY:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
-        if username == ADMIN_USERNAME and password == ADMIN_PASSWORD:
-            request.session.update({SESSION_KEY: "authenticated"}) 
-            return True
-        
-        # Login failed
-        return False
-
-    async def logout(self, request: Request) -> bool:
-        """Handles the logout action."""
-        # Clear the session data
-        request.session.clear()
-        return True
-
-    async def authenticate(self, request: Request) -> Optional[bool]:
-        """Checks if the user is authenticated on every request to the admin panel."""
-        token = request.session.get(SESSION_KEY)
-
-        # If the session key is present, the user is authenticated
-        if token == "authenticated":
-            return True
-        
-        # User is not authenticated, redirect them to the login page
-        return False
+async def optional_admin(token: Annotated[str | None, Header(alias='Authorization')] = None) -> bool:
+    """Dependency for routes open to everyone that do more for the admin."""
+    return token == SESSION_KEY
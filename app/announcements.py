@@ -0,0 +1,223 @@
+import asyncio
+import secrets
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas, sse
+from .changes import ORIGIN
+from .database import AsyncSessionLocal
+from .push import get_messaging
+from .utils import build_alert_multicast, spawn
+
+# FCM's limit for a single send_each_for_multicast call
+FCM_BATCH_SIZE = 500
+
+# Finished jobs kept in the database for status polling
+MAX_JOBS = 100
+
+
+@dataclass
+class AnnouncementJob:
+    id: str
+    title: str
+    body: str
+    status: str = "queued"
+    total: int = 0
+    processed: int = 0
+    results: Dict[int, Dict[str, str | bool | None]] = field(default_factory=dict)
+    created_at: datetime = field(default_factory=datetime.now)
+    finished_at: datetime | None = None
+
+    def as_response(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "sse_delivered": sum(1 for r in self.results.values() if r["sse"]),
+            "push_sent": sum(1 for r in self.results.values() if r["push"] == "sent"),
+            "push_failed": sum(1 for r in self.results.values() if r["push"] == "failed"),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "results": [
+                {"teacher_id": teacher_id, **result}
+                for teacher_id, result in self.results.items()
+            ],
+        }
+
+
+async def resolve_recipients(db: AsyncSession, data: schemas.AnnouncementCreate) -> List[Tuple[int, str | None]]:
+    stmt = select(models.Teacher.id, models.Teacher.firebase_token)
+
+    if data.teacher_ids:
+        stmt = stmt.where(models.Teacher.id.in_(data.teacher_ids))
+
+    if data.availability:
+        stmt = stmt.where(models.Teacher.availability.in_(data.availability))
+
+    if data.subject:
+        stmt = stmt.where(models.Teacher.main_subject == data.subject)
+
+    return [(row.id, row.firebase_token) for row in await db.execute(stmt)]
+
+
+async def start(db: AsyncSession, data: schemas.AnnouncementCreate) -> AnnouncementJob:
+    recipients = await resolve_recipients(db, data)
+
+    job = AnnouncementJob(id=secrets.token_hex(8), title=data.title, body=data.body, total=len(recipients))
+    job.results = {
+        teacher_id: {"sse": False, "push": None, "error": None}
+        for teacher_id, _ in recipients
+    }
+
+    # Written before the id is handed out, so a poll on any worker finds it
+    db.add(models.Announcement(
+        id=job.id, title=job.title, body=job.body, status=job.status, total=job.total, processed=0,
+        origin=ORIGIN, created_at=job.created_at,
+    ))
+    await db.flush()
+
+    if recipients:
+        await db.execute(insert(models.AnnouncementRecipient), [
+            {"announcement_id": job.id, "teacher_id": teacher_id, **result}
+            for teacher_id, result in job.results.items()
+        ])
+
+    await db.commit()
+
+    spawn(_run(job, recipients))
+    return job
+
+
+async def load(db: AsyncSession, job_id: str) -> AnnouncementJob | None:
+    row = await db.get(models.Announcement, job_id)
+
+    if row is None:
+        return None
+
+    recipients = await db.scalars(
+        select(models.AnnouncementRecipient)
+        .where(models.AnnouncementRecipient.announcement_id == job_id)
+        .order_by(models.AnnouncementRecipient.teacher_id)
+    )
+
+    return AnnouncementJob(
+        id=row.id,
+        title=row.title,
+        body=row.body,
+        status=row.status,
+        total=row.total,
+        processed=row.processed,
+        results={r.teacher_id: {"sse": r.sse, "push": r.push, "error": r.error} for r in recipients},
+        created_at=row.created_at,
+        finished_at=row.finished_at,
+    )
+
+
+async def _save(job: AnnouncementJob, teacher_ids: Iterable[int] = ()):
+    """Writes the job's progress and the given recipients' results."""
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(models.Announcement)
+            .where(models.Announcement.id == job.id)
+            .values(status=job.status, processed=job.processed, finished_at=job.finished_at)
+        )
+
+        rows = [{"announcement_id": job.id, "teacher_id": teacher_id, **job.results[teacher_id]} for teacher_id in teacher_ids]
+        if rows:
+            # Bulk UPDATE by primary key
+            await db.execute(update(models.AnnouncementRecipient), rows)
+
+        await db.commit()
+
+
+async def _run(job: AnnouncementJob, recipients: List[Tuple[int, str | None]]):
+    job.status = "running"
+
+    payload = {
+        "event": "announcement",
+        "job_id": job.id,
+        "title": job.title,
+        "body": job.body,
+    }
+
+    try:
+        delivered = sse.publish_teachers(job.results.keys(), payload)
+        for teacher_id in delivered:
+            job.results[teacher_id]["sse"] = True
+
+        with_token = [(teacher_id, token) for teacher_id, token in recipients if token]
+        job.processed = len(recipients) - len(with_token)
+        await _save(job, delivered)
+
+        data = {"event": "announcement", "job_id": job.id}
+
+        for offset in range(0, len(with_token), FCM_BATCH_SIZE):
+            batch = with_token[offset:offset + FCM_BATCH_SIZE]
+            message = build_alert_multicast(job.title, job.body, [token for _, token in batch], data)
+
+            try:
+                response = await asyncio.to_thread(get_messaging().send_each_for_multicast, message)
+
+                for (teacher_id, _), result in zip(batch, response.responses):
+                    job.results[teacher_id]["push"] = "sent" if result.success else "failed"
+                    job.results[teacher_id]["error"] = None if result.success else str(result.exception)
+            except Exception as e:
+                print(f"FCM Error: {e}")
+
+                for teacher_id, _ in batch:
+                    job.results[teacher_id]["push"] = "failed"
+                    job.results[teacher_id]["error"] = str(e)
+
+            job.processed += len(batch)
+            await _save(job, [teacher_id for teacher_id, _ in batch])
+
+        job.status = "done"
+    except Exception as e:
+        print(f"Announcement {job.id} failed: {e}")
+        job.status = "failed"
+    finally:
+        job.finished_at = datetime.now()
+
+        try:
+            await _save(job)
+        except Exception as e:
+            print(f"Saving announcement {job.id} failed: {e}")
+
+
+async def interrupt():
+    """Marks this worker's unfinished jobs as interrupted, on shutdown."""
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(models.Announcement)
+            .where(models.Announcement.origin == ORIGIN, models.Announcement.finished_at.is_(None))
+            .values(status="interrupted", finished_at=datetime.now())
+        )
+        await db.commit()
+
+
+async def prune():
+    """Keeps the newest MAX_JOBS finished jobs."""
+    async with AsyncSessionLocal() as db:
+        cutoff = (await db.scalars(
+            select(models.Announcement.created_at)
+            .where(models.Announcement.finished_at.is_not(None))
+            .order_by(models.Announcement.created_at.desc())
+            .offset(MAX_JOBS)
+            .limit(1)
+        )).first()
+
+        if cutoff is None:
+            return
+
+        old = select(models.Announcement.id).where(
+            models.Announcement.finished_at.is_not(None), models.Announcement.created_at <= cutoff
+        )
+        # SQLite leaves foreign keys unenforced unless asked, so no cascade
+        await db.execute(delete(models.AnnouncementRecipient).where(models.AnnouncementRecipient.announcement_id.in_(old)))
+        await db.execute(delete(models.Announcement).where(models.Announcement.id.in_(old)))
+        await db.commit()
@@ -1,21 +1,25 @@
 import asyncio
+import os
 
-import json
-
+from datetime import date, datetime
 from hashlib import sha256
 from typing import Annotated, List
-from firebase_admin import messaging
 
-from fastapi.responses import StreamingResponse
 from sqlalchemy import select
-from sqlalchemy.orm import selectinload
 
-from app.enums import Availability
+from app.enums import Availability, WeekDays
 from app.utils import verify_fcm_token
-from . import schemas, models, globals
-from .database import get_async_session
-
-from fastapi import APIRouter, Depends, File, HTTPException, Header, Request, Response, UploadFile, status
+from . import announcements, backup, blobs, bulk, database, drain, events, history, presence, profiling, readpath, schemas, snapshots, models, globals, sse, tablets, tenancy
+from .roundtrip import round_trips
+from .schoolcalendar import school_calendar, school_moment, school_now
+from .timetable import TEACHER_NOW, Slot, timetable
+from .admin_auth import optional_admin, require_admin
+from .bootstrap import bootstrap
+from .database import AsyncSessionLocal, get_async_session
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi import APIRouter, Depends, File, HTTPException, Header, Request, Response, UploadFile, WebSocket, WebSocketDisconnect, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
@@ -94,14 +98,22 @@ async def create_schedule(
     if not teacher:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
-    schedule = models.Schedule(
-        **data.model_dump(),
-        teacher_id = teacher.id
-    )
+    async with timetable.lock:
+        await timetable.ensure_loaded(db)
+        timetable.check(Slot(id=None, teacher_id=teacher.id, **data.model_dump()))
 
-    db.add(schedule)
-    await db.commit()
-    await db.refresh(schedule)
+        schedule = models.Schedule(
+            **data.model_dump(),
+            teacher_id = teacher.id
+        )
+
+        db.add(schedule)
+        # The lock only covers this worker, the flush takes the database's
+        await db.flush()
+        await timetable.check_stored(db, Slot(id=schedule.id, teacher_id=teacher.id, **data.model_dump()))
+        # Patches the timetable on commit (app.changes), still under the lock
+        await db.commit()
+        await db.refresh(schedule)
 
     return {'id': schedule.id}
 
@@ -123,20 +135,7 @@ async def force_availability(
     if not teacher:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
-    teacher._regenerate_token = False
-    teacher.availability = Availability(availability)
-
-    await db.commit()
-    await db.refresh(teacher)
-
-    payload = {
-        "event": "reload",
-        "teacher_id": teacher.id,
-    }
-
-    for t in globals.SSE_TABLET_CONNECTIONS.values():
-        print(t)
-        await t.put(payload)
+    await events.force_availability(db, teacher, Availability(availability))
 
 
 # Tested
@@ -164,17 +163,34 @@ async def edit_schedule(
     if schedule.teacher_id != teacher.id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
-    if not data.is_break: schedule.class_id = data.class_id
-    schedule.subject  = data.subject 
-    schedule.weekday  = data.weekday 
-    schedule.time_in  = data.time_in 
-    schedule.time_out = data.time_out
-    schedule.is_break = data.is_break
-    print("\t\t" + str(schedule.is_break))
-    
+    slot = Slot(
+        id=schedule.id,
+        teacher_id=schedule.teacher_id,
+        class_id=schedule.class_id if data.is_break else data.class_id,
+        subject=data.subject,
+        weekday=data.weekday,
+        time_in=data.time_in,
+        time_out=data.time_out,
+        is_break=data.is_break,
+    )
 
-    await db.commit()
-    await db.refresh(schedule)
+    async with timetable.lock:
+        await timetable.ensure_loaded(db)
+        timetable.check(slot)
+
+        if not data.is_break: schedule.class_id = data.class_id
+        schedule.subject  = data.subject 
+        schedule.weekday  = data.weekday 
+        schedule.time_in  = data.time_in 
+        schedule.time_out = data.time_out
+        schedule.is_break = data.is_break
+
+        # As in create_schedule, re-checked with the database's write lock held
+        await db.flush()
+        await timetable.check_stored(db, slot)
+
+        await db.commit()
+        await db.refresh(schedule)
 
     return {'id': schedule.id}
 
@@ -220,18 +236,12 @@ async def get_teacher_schedules(
     teacher_id: int,
     db: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-    teacher = await db.get(models.Teacher, teacher_id)
+    teacher = await db.scalar(select(models.Teacher.id).where(models.Teacher.id == teacher_id))
 
     if not teacher:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-    stmt = select(models.Schedule).where(models.Schedule.teacher_id == teacher_id)
-    schedules = (await db.scalars(stmt)).all()
-
-    if not schedules:
-        return []
-
-    return schedules
+    return readpath.JSONBytesResponse(await readpath.schedule_list_json(db, teacher_id))
 
 @router.get(
     '/allSchedules',
@@ -239,12 +249,79 @@ async def get_teacher_schedules(
     response_model=List[schemas.ScheduleResponse]
 )
 async def get_all_schedules(
+    request: Request,
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+    query: Annotated[readpath.ListQuery, Depends()],
+    weekday: int | None = None,
+    teacher_id: int | None = None,
+    class_id: int | None = None,
+):
+    if query == readpath.ListQuery() and weekday is None and teacher_id is None and class_id is None:
+        return await snapshots.schedules.respond(request, db)
+
+    return await readpath.SCHEDULES.respond(db, query, {
+        models.Schedule.weekday: readpath.enum_filter(WeekDays, weekday),
+        models.Schedule.teacher_id: teacher_id,
+        models.Schedule.class_id: class_id,
+    })
+
+@router.post(
+    '/importSchedules',
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require_admin)]
+)
+async def import_schedules(
+    request: Request,
     db: Annotated[AsyncSession, Depends(get_async_session)],
+    replace: bool = False,
+    dry_run: bool = False,
 ):
-    result = await db.execute(select(models.Schedule))
-    schedules = result.scalars()
+    try:
+        raw = bulk.parse((await request.body()).decode('utf-8'), request.headers.get('content-type'))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    result = await bulk.import_schedules(db, raw, replace=replace, dry_run=dry_run)
+
+    if result.errors:
+        return JSONResponse(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, content=jsonable_encoder(result.as_response()))
+
+    if result.conflicts:
+        return JSONResponse(status_code=status.HTTP_409_CONFLICT, content=result.as_response())
+
+    return result.as_response()
+
+
+@router.get(
+    '/conflicts',
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require_admin)]
+)
+async def get_conflicts(
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+):
+    await timetable.ensure_loaded(db)
+
+    return timetable.report()
+
+
+@router.get(
+    '/exportSchedules',
+    status_code=status.HTTP_200_OK,
+)
+async def export_schedules(
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+    format: str = "csv",
+):
+    if format == "csv":
+        return StreamingResponse(
+            bulk.export_csv(),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="schedules.csv"'}
+        )
+
+    return await readpath.SCHEDULES.respond(db, readpath.ListQuery(format=format), {})
 
-    return schedules.all()
 
 # Tested
 @router.get(
@@ -311,6 +388,81 @@ async def get_teacher(
     return teacher
 
 
+@router.get(
+    '/teacher/{teacher_id}/now',
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.TeacherNowRow,
+)
+async def get_teacher_now(
+    teacher_id: int,
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+    at: datetime | None = None,
+):
+    await timetable.ensure_loaded(db)
+    await school_calendar.ensure_loaded(db)
+
+    # Whole seconds, as /teachers/now reports them
+    now = timetable.resolve(teacher_id, school_moment(at).replace(microsecond=0), school_calendar.weekday_for)
+
+    # Nothing scheduled: a teacher with a free week, or no such teacher
+    if now["current"] is None and now["next"] is None:
+        if not await db.scalar(select(models.Teacher.id).where(models.Teacher.id == teacher_id)):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    return readpath.JSONBytesResponse(TEACHER_NOW.dump_json(now))
+
+
+@router.get(
+    '/teachers/now',
+    status_code=status.HTTP_200_OK,
+    response_model=List[schemas.TeacherNowRow],
+)
+async def get_teachers_now(
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+    at: datetime | None = None,
+):
+    await timetable.ensure_loaded(db)
+    await school_calendar.ensure_loaded(db)
+
+    return readpath.JSONBytesResponse(timetable.resolve_all_json(school_moment(at), school_calendar.weekday_for))
+
+
+@router.get(
+    '/reports/teachers',
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require_admin)]
+)
+async def get_teacher_report(
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+    start: date | None = None,
+    end: date | None = None,
+    teacher_id: int | None = None,
+):
+    """Availability changes and kiosk response times per teacher; defaults to this month."""
+    today = school_now().date()
+    start = start or today.replace(day=1)
+    end = end or today
+
+    return await history.report(db, start, end, teacher_id)
+
+
+@router.get(
+    '/calendar',
+    status_code=status.HTTP_200_OK,
+)
+async def get_calendar(
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+    start: date | None = None,
+    days: int = 14,
+):
+    await school_calendar.ensure_loaded(db)
+
+    start = start or school_now().date()
+    days = min(max(days, 1), 366)
+
+    return [info.as_response() for info in school_calendar.days(start, days)]
+
+
 # Tested
 @router.get(
     '/teacherList', 
@@ -318,12 +470,17 @@ async def get_teacher(
     response_model=List[schemas.TeacherResponse]
 )
 async def get_teacher_list(
-    db: Annotated[AsyncSession, Depends(get_async_session)]
+    request: Request,
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+    query: Annotated[readpath.ListQuery, Depends()],
+    availability: int | None = None,
 ):
-    result = await db.execute(select(models.Teacher))
-    teachers = result.scalars()
+    if query == readpath.ListQuery() and availability is None:
+        return await snapshots.teachers.respond(request, db)
 
-    return teachers.all()
+    return await readpath.TEACHERS.respond(db, query, {
+        models.Teacher.availability: readpath.enum_filter(Availability, availability),
+    })
 
 
 @router.get(
@@ -332,12 +489,33 @@ async def get_teacher_list(
     response_model=List[schemas.SchoolClassBaseSchema]
 )
 async def get_classes_list(
+    request: Request,
     db: Annotated[AsyncSession, Depends(get_async_session)]
 ):
-    result = await db.execute(select(models.SchoolClass))
-    classes = result.scalars()
+    return await snapshots.school_classes.respond(request, db)
+
+
+@router.get(
+    '/bootstrap',
+    status_code=status.HTTP_200_OK,
+)
+async def get_bootstrap(request: Request):
+    """Everything a kiosk needs to start, in one versioned manifest; see app.bootstrap."""
+    bundle = await bootstrap.get()
+    return snapshots.respond(request, bundle.manifest)
+
 
-    return classes.all()
+@router.get(
+    '/bootstrap/avatars',
+    status_code=status.HTTP_200_OK,
+)
+async def get_bootstrap_avatars(request: Request, v: str | None = None):
+    bundle = await bootstrap.get()
+    avatars = bundle.avatars
+
+    # The manifest links the pack by version; that URL never changes content
+    cache_control = "public, max-age=31536000, immutable" if v and avatars.etag == f'W/"{v}"' else "no-cache"
+    return snapshots.respond(request, avatars, media_type="application/octet-stream", cache_control=cache_control)
 
 
 # Tested
@@ -375,15 +553,6 @@ async def update_profile(
     await db.commit()
     await db.refresh(teacher)
 
-    payload = {
-        "event": "reload",
-        "teacher_id": teacher.id,
-    }
-
-    for t in globals.SSE_TABLET_CONNECTIONS.values():
-        print(t)
-        await t.put(payload)
-
     # else:
     #     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
@@ -445,6 +614,9 @@ async def upload_profile_picture(
     if not teacher:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
+    content = await file.read()
+    digest = await blobs.store(content)
+
     image = (await db.scalars(
         select(models.ImageModel).where(models.ImageModel.teacher_id == teacher.id)
     )).first()
@@ -452,14 +624,16 @@ async def upload_profile_picture(
     if not image:
         image = models.ImageModel(
             teacher_id = teacher.id,
-            data = await file.read(),
+            sha256 = digest,
+            size = len(content),
             mimetype = file.content_type,
             filename = str(teacher.id)
         )
         db.add(image)
 
     else:
-        image.data = await file.read()
+        image.sha256 = digest
+        image.size = len(content)
         image.mimetype = file.content_type
         image.filename = str(teacher.id)
 
@@ -476,26 +650,38 @@ async def upload_profile_picture(
 )
 async def get_profile_picture(
     teacher_id: int,
+    request: Request,
     db: Annotated[AsyncSession, Depends(get_async_session)]
 ):
-    stmt = (
-        select(models.Teacher)
+    row = (await db.execute(
+        select(models.Teacher.id, models.ImageModel.sha256, models.ImageModel.mimetype)
+        .outerjoin(models.ImageModel, models.ImageModel.teacher_id == models.Teacher.id)
         .where(models.Teacher.id == teacher_id)
-        .options(selectinload(models.Teacher.profile_picture_image)) 
-    )
-
-    result = await db.execute(stmt)
-    teacher = result.scalars().first()
+    )).first()
 
-    if not teacher:
+    if not row:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-    if not teacher.profile_picture_image:
+    if not row.sha256:
         return None
 
-    return Response(
-        content = teacher.profile_picture_image.data,
-        media_type = teacher.profile_picture_image.mimetype
+    path = blobs.path(row.sha256)
+
+    # Pruned, or not copied over with a restored snapshot
+    if not os.path.exists(path):
+        print(f"Missing blob {row.sha256} for teacher {teacher_id}")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    # The content hash is the ETag: a new picture is a new hash
+    etag = f'"{row.sha256}"'
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    return FileResponse(
+        path,
+        media_type = row.mimetype,
+        headers = {"ETag": etag, "Cache-Control": "no-cache"},
     )
 
 
@@ -509,76 +695,40 @@ async def notify_teacher(
     tablet_session: str,
     db: Annotated[AsyncSession, Depends(get_async_session)]
 ):
-    if not tablet_session in globals.SSE_TABLET_CONNECTIONS:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
-
-    teacher = await db.get(models.Teacher, teacher_id)
-
-    if not teacher:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return await events.notify_teacher(db, teacher_id, tablet_session)
 
-    payload = {
-        "event": "notify",
-        "tablet_session": tablet_session
-    }
 
-    success = False
+@router.post(
+    '/announce',
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=schemas.AnnouncementStatus,
+    dependencies=[Depends(require_admin)]
+)
+async def create_announcement(
+    data: schemas.AnnouncementCreate,
+    db: Annotated[AsyncSession, Depends(get_async_session)]
+):
+    job = await announcements.start(db, data)
 
-    print(globals.SSE_TABLET_CONNECTIONS)
-    print(globals.SSE_TEACHER_CONNECTIONS)
+    return job.as_response()
 
-    if teacher.id in globals.SSE_TEACHER_CONNECTIONS:
-        await globals.SSE_TEACHER_CONNECTIONS[teacher.id].put(payload)
-        success = True
 
-    if teacher.firebase_token:
-        print("Firebase Token Validation: ", await verify_fcm_token(teacher.firebase_token))
-        try:
-            message = messaging.Message(
-                notification=messaging.Notification(
-                    title="Kiosk Notification",
-                    body="Someone is looking for you",
-                ),
-                data={
-                    "event": "notify",
-                    "tablet_session": tablet_session,
-                },
-                token=teacher.firebase_token,
-                android=messaging.AndroidConfig(
-                    priority="high",
-                    notification=messaging.AndroidNotification(
-                        title="Kiosk Notification",
-                        body="Someone is looking for you",
-                        channel_id="critical_alerts",
-                            sound="alert_sound",
-                        ),
-                ),
-                apns=messaging.APNSConfig(
-                    payload=messaging.APNSPayload(
-                        aps=messaging.Aps(
-                            sound=messaging.CriticalSound(
-                                name="alert_sound.caf", 
-                                critical=True, 
-                                volume=1.0
-                            ),
-                            category="RESPOND_CATEGORY", 
-                        ),
-                    ),
-                ),
-            )
-            response = await asyncio.to_thread(messaging.send, message)
-            print(response)
-        except Exception as e:
-            print(f"FCM Error: {e}")
-            print(f"Token: {teacher.firebase_token}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
-                detail="Failed to send FCM notification"
-            )
+@router.get(
+    '/announce/{job_id}',
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.AnnouncementStatus,
+    dependencies=[Depends(require_admin)]
+)
+async def get_announcement(
+    job_id: str,
+    db: Annotated[AsyncSession, Depends(get_async_session)]
+):
+    job = await announcements.load(db, job_id)
 
-    if success: return {"status": "success"}
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-    return {"status": "failed", "reason": "No active connection or FCM token found"}
+    return job.as_response()
 
 
 # Tested
@@ -589,7 +739,8 @@ async def teacher_send_response(
     message: str,
     tablet_session: str,
     token: Annotated[str, Header(alias='Authorization')],
-    db: Annotated[AsyncSession, Depends(get_async_session)]
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+    request_id: str | None = None,
 ):
     teacher = (await db.scalars(
         select(models.Teacher).where(models.Teacher.token == token)
@@ -598,18 +749,160 @@ async def teacher_send_response(
     if not teacher:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
-    payload = {
-        "event": "response",
-        "message": message,
-        "teacher_id": teacher.id,
+    return events.teacher_response(teacher.id, tablet_session, message, request_id)
+
+
+@router.get(
+    '/metrics/roundtrip',
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require_admin)]
+)
+async def get_roundtrip_metrics():
+    """This worker's notify/respond latencies, split by how the teacher was reached."""
+    return round_trips.metrics()
+
+
+@router.get(
+    '/metrics/tenant',
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require_admin)]
+)
+async def get_tenant_metrics():
+    """This worker's load for the school the request is routed to."""
+    tenant = tenancy.current()
+
+    return {
+        "tenant": tenant.name,
+        **tenant.metrics.as_response(),
+        "tablet_streams": len(globals.SSE_TABLET_CONNECTIONS),
+        "teacher_devices": sum(len(devices) for devices in globals.SSE_TEACHER_CONNECTIONS.values()),
+        "pending_requests": len(globals.PENDING_REQUESTS),
+        "database_open": database.is_open(tenant),
+    }
+
+
+def _profile_response(profile: profiling.Profile) -> PlainTextResponse:
+    return PlainTextResponse(profile.collapsed(), headers={
+        "X-Profile-Samples": str(profile.samples),
+        "X-Profile-Completed": str(profile.completed),
+    })
+
+
+@router.post(
+    '/profile/requests',
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require_admin)]
+)
+async def profile_requests(
+    route: str,
+    count: int = 1,
+    timeout: float = profiling.PROFILE_TIMEOUT,
+    interval_ms: float = profiling.SAMPLE_INTERVAL_MS,
+):
+    """
+    Samples this worker's next `count` requests to `route` (e.g. `/api/notify`)
+    and returns collapsed stacks for a flamegraph. Returns what it has after
+    `timeout` seconds.
+    """
+    if not 1 <= count <= profiling.MAX_PROFILE_REQUESTS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"count must be between 1 and {profiling.MAX_PROFILE_REQUESTS}")
+
+    if not 0 < timeout <= 10 * profiling.PROFILE_TIMEOUT or interval_ms < 1:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid timeout or interval")
+
+    return _profile_response(await profiling.profile_requests(route, count, timeout, interval_ms))
+
+
+@router.post(
+    '/profile/job',
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require_admin)]
+)
+async def profile_job(
+    name: str,
+    timeout: float = 2 * profiling.PROFILE_TIMEOUT,
+    interval_ms: float = profiling.SAMPLE_INTERVAL_MS,
+):
+    """Samples the next run of a scheduler job on this worker (e.g. `schedule_job`), as collapsed stacks."""
+    if not 0 < timeout <= 10 * profiling.PROFILE_TIMEOUT or interval_ms < 1:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid timeout or interval")
+
+    return _profile_response(await profiling.profile_job(name, timeout, interval_ms))
+
+
+@router.post(
+    '/backup',
+    status_code=status.HTTP_202_ACCEPTED,
+    dependencies=[Depends(require_admin)]
+)
+async def start_backup():
+    """Starts an online backup of this school's database; poll GET /backup for progress."""
+    return backup.backups.start("admin").as_response()
+
+
+@router.get(
+    '/backup',
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require_admin)]
+)
+async def get_backup():
+    """Progress of this worker's latest backup, and the backups on disk."""
+    files = backup.backup_files(tenancy.current().backup_dir)
+
+    return {
+        **backup.backups.progress.as_response(),
+        "backups": [os.path.basename(path) for path in reversed(files)],
     }
 
-    if tablet_session in globals.SSE_TABLET_CONNECTIONS:
-        await globals.SSE_TABLET_CONNECTIONS[tablet_session].put(payload)
-        return {"status": "success", "method": "SSE"}
 
+@router.post(
+    '/registerTablet',
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.TabletResponse
+)
+async def register_tablet(
+    data: schemas.TabletRegister,
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+    admin: Annotated[bool, Depends(optional_admin)],
+):
+    if data.tablet_session:
+        entry = await tablets.resume(db, data.tablet_session)
+
+        if not entry:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+        # Knowing a session id is not enough to relabel that kiosk; resending its own labels is fine
+        changed = (data.label and data.label != entry.label) or (data.location and data.location != entry.location)
+        if changed and not admin:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only an admin can relabel a tablet")
+
+        if changed:
+            await tablets.update_metadata(db, entry, data.label, data.location)
+    elif admin:
+        entry = await tablets.register(db, data.label, data.location)
     else:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+        # Anyone can call this; only the admin's registrations get a Tablet row
+        entry = tablets.register_ephemeral(data.label, data.location)
+
+    return entry.as_response()
+
+
+@router.get(
+    '/tabletList',
+    status_code=status.HTTP_200_OK,
+    response_model=List[schemas.TabletResponse],
+    # The session ids are the kiosks' only credential
+    dependencies=[Depends(require_admin)]
+)
+async def get_tablet_list(
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+):
+    result = await db.execute(select(models.Tablet))
+
+    return [
+        (globals.TABLET_SESSIONS.get(t.session) or tablets.TabletSession.from_model(t)).as_response()
+        for t in result.scalars().all()
+    ]
 
 
 # Tested
@@ -617,48 +910,45 @@ async def teacher_send_response(
     "/eventsTablet"
 )
 async def tablet_events(
-    request: Request
+    tablet_session: str | None = None,
 ):
-    assert request.client
+    drain.refuse_if_draining()
+
+    if tablet_session:
+        # Not a dependency: the session must not stay checked out for the life of the stream
+        async with AsyncSessionLocal() as db:
+            entry = await tablets.resume(db, tablet_session)
+    else:
+        # Legacy kiosks connect without registering first
+        entry = tablets.register_ephemeral()
 
-    if request.client.host in globals.SSE_TABLET_CONNECTIONS:
+    if not entry:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
-    tablet_session = "TABSESS_" + sha256(request.client.host.encode('utf-8')).hexdigest()
+    tablet_session = entry.session
+    tablets.touch(tablet_session)
 
-    queue = asyncio.Queue()
-    globals.SSE_TABLET_CONNECTIONS[
-        tablet_session
-    ] = queue
+    queue: asyncio.Queue[bytes] = asyncio.Queue()
+    globals.SSE_TABLET_CONNECTIONS[tablet_session] = queue
 
     async def event_generator():
-        assert request.client
-
         try:
-            token_sse = json.dumps({
+            yield sse.encode_event({
                 'token': tablet_session
             })
-            yield f"data: {token_sse}\n\n"
             while True:
-                try:
-                    message_data = await asyncio.wait_for(queue.get(), timeout=20)
-
-                    sse_message = f"data: {json.dumps(message_data)}\n\n"
-                    yield sse_message
-                except asyncio.TimeoutError:
-                    yield ": heartbeat\n\n"
-
-                if await request.is_disconnected():
-                    break
-        except asyncio.CancelledError:
-            pass
+                frame = await queue.get()
+
+                if frame is sse.CLOSE:
+                    return
+
+                yield frame
         finally:
-            if tablet_session in globals.SSE_TABLET_CONNECTIONS:
-                del globals.SSE_TABLET_CONNECTIONS[tablet_session];
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream"
-    )
+            if globals.SSE_TABLET_CONNECTIONS.get(tablet_session) is queue:
+                del globals.SSE_TABLET_CONNECTIONS[tablet_session]
+                tablets.release(tablet_session)
+
+    return sse.EventStreamResponse(event_generator())
 
 
 # Tested
@@ -668,7 +958,8 @@ async def tablet_events(
 async def teacher_events(
     request: Request,
     token: str,
-    db: Annotated[AsyncSession, Depends(get_async_session)]
+    db: Annotated[AsyncSession, Depends(get_async_session)],
+    device_id: str | None = None,
 ):
     teacher = (await db.scalars(
         select(models.Teacher).where(models.Teacher.token == token)
@@ -677,33 +968,175 @@ async def teacher_events(
     if not teacher:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
-    queue = asyncio.Queue()
-    globals.SSE_TEACHER_CONNECTIONS[teacher.id] = queue
+    drain.refuse_if_draining()
 
-    teacher_id = teacher.id
+    device = presence.connect(teacher.id, device_id, "sse")
     teacher_name = teacher.full_name
 
     async def event_generator():
         try:
             while True:
-                try:
-                    message_data = await asyncio.wait_for(queue.get(), timeout=20)
-
-                    sse_message = f"data: {json.dumps(message_data)}\n\n"
-                    print(sse_message)
-                    yield sse_message
-                except asyncio.TimeoutError:
-                    yield ": heartbeat\n\n"
-
-                if await request.is_disconnected():
-                    break
-        except asyncio.CancelledError:
-            pass
+                frame = await device.queue.get()
+
+                if frame is sse.CLOSE:
+                    return
+
+                yield frame
         finally:
-            if teacher_id in globals.SSE_TEACHER_CONNECTIONS:
-                del globals.SSE_TEACHER_CONNECTIONS[teacher_id]
-                print(f"\n\n\n\n\nUser {teacher_name} disconnected. Active connections: {len(globals.SSE_TEACHER_CONNECTIONS)}\n\n\n\n\n")
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream"
-    )
+            presence.disconnect(device)
+            print(f"User {teacher_name} disconnected device {device.device_id}. Active teachers: {len(globals.SSE_TEACHER_CONNECTIONS)}")
+
+    return sse.EventStreamResponse(event_generator())
+
+
+async def _forward_frames(websocket: WebSocket, queue: asyncio.Queue[bytes]):
+    """Single writer for a socket: registry events and replies both go through the queue."""
+    while True:
+        frame = await queue.get()
+
+        if frame is sse.HEARTBEAT:
+            continue
+
+        if frame is sse.CLOSE:
+            await websocket.close(code=status.WS_1012_SERVICE_RESTART)
+            return
+
+        await websocket.send_text(sse.frame_data(frame))
+
+
+async def _socket_events(websocket: WebSocket, queue: asyncio.Queue[bytes], handler):
+    while True:
+        try:
+            frame = await websocket.receive_json()
+        except ValueError:
+            queue.put_nowait(sse.encode_event({
+                "event": "error",
+                "status": status.HTTP_400_BAD_REQUEST,
+                "detail": "Frames must be JSON objects",
+            }))
+            continue
+
+        event = frame.get("event") if isinstance(frame, dict) else None
+
+        try:
+            result = await handler(event, frame)
+            reply = {"event": "ack", "request": event, **(result or {})}
+        except (KeyError, TypeError, ValueError):
+            reply = {"event": "error", "request": event, "status": status.HTTP_400_BAD_REQUEST, "detail": "Malformed frame"}
+        except HTTPException as e:
+            reply = {"event": "error", "request": event, "status": e.status_code, "detail": e.detail}
+
+        queue.put_nowait(sse.encode_event(reply))
+
+
+@router.websocket(
+    "/wsTablet"
+)
+async def tablet_socket(
+    websocket: WebSocket,
+    tablet_session: str | None = None,
+):
+    if drain.draining():
+        await websocket.close(code=status.WS_1012_SERVICE_RESTART)
+        return
+
+    if tablet_session:
+        async with AsyncSessionLocal() as db:
+            entry = await tablets.resume(db, tablet_session)
+
+        if not entry:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+    else:
+        entry = tablets.register_ephemeral()
+
+    await websocket.accept()
+
+    tablet_session = entry.session
+    tablets.touch(tablet_session)
+
+    queue: asyncio.Queue[bytes] = asyncio.Queue()
+    globals.SSE_TABLET_CONNECTIONS[tablet_session] = queue
+    queue.put_nowait(sse.encode_event({
+        'token': tablet_session
+    }))
+
+    async def handler(event, frame):
+        if event == "notify":
+            async with AsyncSessionLocal() as db:
+                return await events.notify_teacher(db, int(frame["teacher_id"]), tablet_session)
+
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown event: {event}")
+
+    sender = asyncio.create_task(_forward_frames(websocket, queue))
+
+    try:
+        await _socket_events(websocket, queue, handler)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+
+        if globals.SSE_TABLET_CONNECTIONS.get(tablet_session) is queue:
+            del globals.SSE_TABLET_CONNECTIONS[tablet_session]
+            tablets.release(tablet_session)
+
+
+@router.websocket(
+    "/wsTeacher"
+)
+async def teacher_socket(
+    websocket: WebSocket,
+    token: str,
+    device_id: str | None = None,
+):
+    async with AsyncSessionLocal() as db:
+        teacher = (await db.scalars(
+            select(models.Teacher).where(models.Teacher.token == token)
+        )).first()
+
+    if not teacher:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    if drain.draining():
+        await websocket.close(code=status.WS_1012_SERVICE_RESTART)
+        return
+
+    await websocket.accept()
+
+    teacher_id = teacher.id
+
+    device = presence.connect(teacher_id, device_id, "ws")
+    queue = device.queue
+
+    async def handler(event, frame):
+        if event == "respond":
+            return events.teacher_response(
+                teacher_id,
+                str(frame["tablet_session"]),
+                str(frame["message"]),
+                frame.get("request_id"),
+            )
+
+        if event == "forceAvailability":
+            async with AsyncSessionLocal() as db:
+                current = await db.get(models.Teacher, teacher_id)
+
+                if not current:
+                    raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+                await events.force_availability(db, current, Availability(int(frame["availability"])))
+                return {"availability": current.availability.value}
+
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown event: {event}")
+
+    sender = asyncio.create_task(_forward_frames(websocket, queue))
+
+    try:
+        await _socket_events(websocket, queue, handler)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        presence.disconnect(device)
@@ -0,0 +1,328 @@
+"""
+Online backups and snapshot export of the SQLite database.
+
+A backup copies the live database with SQLite's backup API, BACKUP_PAGES
+pages per step on a worker thread, pausing between steps. Each step holds
+only a read lock for a few milliseconds, so requests and the scheduler
+keep writing while it runs. A commit from another connection makes SQLite
+restart the copy; after MAX_RESTARTS the backup gives up rather than chase
+a busy database.
+
+The copy is checked with `PRAGMA quick_check`, gzipped and moved into the
+tenant's backup directory as `<tenant>-<UTC timestamp>.sqlite3.gz`; the
+newest BACKUP_KEEP are kept. Profile pictures are not included, they are
+files in the blob directory and can be copied as they are.
+
+`scheduled_backup` runs every few minutes and takes a backup once the
+newest one is BACKUP_INTERVAL old, but not within BOUNDARY_MARGIN of a
+minute where `schedule_job` changes availabilities or sends reminders,
+and it gives up BOUNDARY_MARGIN before the next such minute if it is
+still running then; the next check retries it.
+Admins can start one with `POST /api/backup` and follow it with
+`GET /api/backup`. Every worker runs the job, a lock file in the backup
+directory lets one of them through.
+
+`python -m app.cli export-snapshot` and `import-snapshot` write and
+restore the same gzipped files.
+"""
+import asyncio
+import fcntl
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import List
+
+from . import tenancy
+from .database import AsyncSessionLocal
+from .schoolcalendar import school_calendar, school_now
+from .tenancy import TenantLocal
+
+BACKUP_PAGES = 64
+# Between steps, so queued writers get the lock
+STEP_PAUSE = 0.005
+MAX_RESTARTS = 5
+
+BACKUP_INTERVAL = timedelta(hours=float(os.environ.get("BACKUP_INTERVAL_HOURS", "24")))
+BACKUP_KEEP = int(os.environ.get("BACKUP_KEEP", "7"))
+CHECK_INTERVAL_MINUTES = 5
+
+BOUNDARY_MARGIN = timedelta(minutes=2)
+# schedule_job's class reminders go out this long before a slot starts
+REMINDER_LEAD = timedelta(minutes=5)
+
+SUFFIX = ".sqlite3.gz"
+
+
+class BackupAborted(Exception):
+    pass
+
+
+@dataclass
+class BackupProgress:
+    # idle, running, done, skipped or failed
+    state: str = "idle"
+    reason: str | None = None
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    pages_total: int = 0
+    pages_done: int = 0
+    restarts: int = 0
+    path: str | None = None
+    size: int | None = None
+    error: str | None = None
+    # Set from the event loop, checked by the copying thread between steps
+    cancelled: bool = False
+
+    def as_response(self) -> dict:
+        return {
+            "state": self.state,
+            "reason": self.reason,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "pages_total": self.pages_total,
+            "pages_done": self.pages_done,
+            "percent": round(100 * self.pages_done / self.pages_total, 1) if self.pages_total else None,
+            "restarts": self.restarts,
+            "path": self.path,
+            "size": self.size,
+            "error": self.error,
+        }
+
+
+def copy_database(source_path: str, target_path: str, progress: BackupProgress | None = None, deadline: float | None = None):
+    """
+    Copies a live database in small steps. Blocking, call from a thread.
+    Gives up at `deadline`, a time.monotonic() value, if it is not done by then.
+    """
+    progress = progress or BackupProgress()
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+
+    def step(status, remaining, total):
+        if progress.cancelled:
+            raise BackupAborted("Cancelled")
+
+        done = total - remaining
+
+        # The source changed under us and the copy started over
+        if done < progress.pages_done:
+            progress.restarts += 1
+            if progress.restarts > MAX_RESTARTS:
+                raise BackupAborted(f"Database kept changing, gave up after {MAX_RESTARTS} restarts")
+
+        progress.pages_total, progress.pages_done = total, done
+
+        if remaining:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise BackupAborted("Not finished before the next class boundary")
+
+            time.sleep(STEP_PAUSE)
+
+    try:
+        source.backup(target, pages=BACKUP_PAGES, progress=step)
+
+        result = target.execute("PRAGMA quick_check").fetchone()[0]
+        if result != "ok":
+            raise BackupAborted(f"Backup failed its integrity check: {result}")
+    finally:
+        target.close()
+        source.close()
+
+
+def compress(source_path: str, target_path: str):
+    with open(source_path, "rb") as source, gzip.open(target_path, "wb", compresslevel=6) as target:
+        shutil.copyfileobj(source, target, length=1 << 20)
+
+
+def decompress(source_path: str, target_path: str):
+    with gzip.open(source_path, "rb") as source, open(target_path, "wb") as target:
+        shutil.copyfileobj(source, target, length=1 << 20)
+
+
+def export_snapshot(database_path: str, target_path: str, progress: BackupProgress | None = None, deadline: float | None = None) -> int:
+    """Writes a gzipped copy of the database to `target_path`. Blocking."""
+    partial = target_path + ".partial"
+    raw = partial + ".sqlite3"
+
+    try:
+        copy_database(database_path, raw, progress, deadline)
+        compress(raw, partial)
+        os.replace(partial, target_path)
+    finally:
+        for leftover in (raw, partial):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    return os.path.getsize(target_path)
+
+
+def import_snapshot(snapshot_path: str, database_path: str):
+    """
+    Replaces the database's contents with a snapshot's. Blocking.
+
+    Goes through the backup API rather than swapping files, so connections
+    that are still open see the new contents instead of a deleted file.
+    """
+    raw = database_path + ".import"
+    os.makedirs(os.path.dirname(database_path) or ".", exist_ok=True)
+
+    try:
+        decompress(snapshot_path, raw)
+
+        check = sqlite3.connect(raw)
+        try:
+            result = check.execute("PRAGMA quick_check").fetchone()[0]
+        finally:
+            check.close()
+
+        if result != "ok":
+            raise BackupAborted(f"Snapshot failed its integrity check: {result}")
+
+        copy_database(raw, database_path)
+    finally:
+        if os.path.exists(raw):
+            os.remove(raw)
+
+
+def backup_files(directory: str) -> List[str]:
+    """Finished backups in `directory`, oldest first."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+
+    # The timestamp in the name sorts chronologically
+    return [os.path.join(directory, name) for name in sorted(names) if name.endswith(SUFFIX)]
+
+
+def _prune(directory: str):
+    for path in backup_files(directory)[:-BACKUP_KEEP]:
+        os.remove(path)
+
+
+def _run(tenant: tenancy.Tenant, progress: BackupProgress, if_due: bool, deadline: float | None) -> bool:
+    """Takes a backup unless another worker is taking one (or, with `if_due`, just took one). Blocking."""
+    os.makedirs(tenant.backup_dir, exist_ok=True)
+
+    with open(os.path.join(tenant.backup_dir, ".lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+
+        # Another worker may have finished one between our check and the lock
+        if if_due and not backup_due(tenant.backup_dir):
+            return False
+
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(tenant.backup_dir, f"{tenant.name}-{stamp}{SUFFIX}")
+
+        progress.size = export_snapshot(tenant.database_path, path, progress, deadline)
+        progress.path = path
+        _prune(tenant.backup_dir)
+
+    return True
+
+
+class Backups:
+    def __init__(self):
+        self.progress = BackupProgress()
+        self._task: asyncio.Task | None = None
+
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, reason: str, deadline: float | None = None) -> BackupProgress:
+        """Starts a backup in the background, or returns the one already running."""
+        if not self.running():
+            self.progress = BackupProgress("running", reason, started_at=datetime.now(timezone.utc))
+            # Not spawn(): a shutdown should not wait for a backup, it is retried on the next check
+            self._task = asyncio.create_task(self._backup(self.progress, deadline))
+
+        return self.progress
+
+    async def _backup(self, progress: BackupProgress, deadline: float | None):
+        tenant = tenancy.current()
+
+        try:
+            taken = await asyncio.to_thread(_run, tenant, progress, progress.reason == "scheduled", deadline)
+        except Exception as e:
+            progress.state, progress.error = "failed", str(e)
+            print(f"Backup of {tenant.name} failed: {e}")
+        else:
+            if taken:
+                progress.state = "done"
+                print(f"Backed up {tenant.name} to {progress.path} ({progress.size} bytes)")
+            else:
+                progress.state = "skipped"
+        finally:
+            progress.finished_at = datetime.now(timezone.utc)
+
+    async def stop(self):
+        """Cancels a running backup at its next step, for shutdown."""
+        if self.running():
+            self.progress.cancelled = True
+            await asyncio.wait({self._task})
+
+
+backups = TenantLocal(Backups)
+
+
+def class_boundaries(day: date) -> List[datetime]:
+    """The minutes `schedule_job` acts on during `day`."""
+    occurrences = school_calendar.occurrences(day)
+
+    if occurrences is None:
+        return []
+
+    starts = [datetime.combine(day, minute) for minute in occurrences.starts]
+    ends = [datetime.combine(day, minute) for minute in occurrences.ends]
+    reminders = [start - REMINDER_LEAD for start in starts]
+
+    return [*starts, *ends, *reminders]
+
+
+def near_class_boundary(now: datetime) -> bool:
+    """Whether `now` is within BOUNDARY_MARGIN of a minute `schedule_job` acts on."""
+    return any(abs(boundary - now) <= BOUNDARY_MARGIN for boundary in class_boundaries(now.date()))
+
+
+def backup_deadline(now: datetime) -> float | None:
+    """BOUNDARY_MARGIN before today's next class boundary, as a time.monotonic() value."""
+    upcoming = [boundary for boundary in class_boundaries(now.date()) if boundary > now]
+
+    if not upcoming:
+        return None
+
+    return time.monotonic() + (min(upcoming) - BOUNDARY_MARGIN - now).total_seconds()
+
+
+def backup_due(directory: str) -> bool:
+    files = backup_files(directory)
+    if not files:
+        return True
+
+    age = time.time() - os.path.getmtime(files[-1])
+    return age >= BACKUP_INTERVAL.total_seconds()
+
+
+async def scheduled_backup():
+    """Scheduler job: starts a backup when one is due and no class boundary is near."""
+    if backups.running() or not backup_due(tenancy.current().backup_dir):
+        return
+
+    async with AsyncSessionLocal() as session:
+        await school_calendar.ensure_loaded(session)
+
+    now = school_now()
+
+    if near_class_boundary(now):
+        return
+
+    # Stopped before the next boundary too, a large database may not be done in time
+    backups.start("scheduled", backup_deadline(now))
@@ -0,0 +1,138 @@
+"""
+Content-addressed blob store for profile pictures.
+
+Images used to live in `image_model.data`, in the same SQLite file as the
+teacher and schedule tables, so every upload went through the WAL and
+pushed the small hot pages the scheduler and kiosks read out of the page
+cache. Now each image is a file in the school's blob directory (BLOB_DIR,
+or TENANT_DIR/<name>/blobs with several schools) named by its sha256
+(`ab/cdef...`), and `image_model` only keeps the hash, size and mimetype.
+Identical uploads share a file, and `/profilePicture` serves it with
+FileResponse, which uses the server's zero-copy path where it has one.
+
+Files are written to a temporary name and renamed into place, so a
+reader never sees half an image. Files no row refers to any more are
+removed by `prune()`.
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from hashlib import sha256
+
+from sqlalchemy import select, text, update
+
+from . import models, tenancy
+from .database import AsyncSessionLocal
+
+# Unreferenced files younger than this may belong to an upload that has not committed yet
+PRUNE_GRACE = 60 * 60
+
+MIGRATE_BATCH = 50
+
+
+def blob_dir() -> str:
+    return tenancy.current().blob_dir
+
+
+def path(digest: str) -> str:
+    return os.path.join(blob_dir(), digest[:2], digest[2:])
+
+
+def put(data: bytes) -> str:
+    """Stores `data` and returns its sha256. Blocking, call from a thread."""
+    digest = sha256(data).hexdigest()
+    target = path(digest)
+
+    if os.path.exists(target):
+        return digest
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".tmp-")
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temporary, target)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+
+    return digest
+
+
+async def store(data: bytes) -> str:
+    return await asyncio.to_thread(put, data)
+
+
+async def migrate_images() -> int:
+    """
+    Moves images still held inline in `image_model.data` into the store.
+    Idempotent, and safe to run from several workers at once.
+    """
+    image = models.ImageModel
+    moved = 0
+
+    while True:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(image.id, image.data).where(image.sha256.is_(None)).limit(MIGRATE_BATCH)
+            )).all()
+
+            if not rows:
+                return moved
+
+            for row in rows:
+                digest = await store(row.data)
+                await db.execute(
+                    update(image)
+                    .where(image.id == row.id)
+                    .values(sha256=digest, size=len(row.data), data=b'')
+                )
+
+            await db.commit()
+            moved += len(rows)
+
+
+async def free_bytes() -> int:
+    """Space in the database file that no table uses, e.g. left behind by `migrate_images`."""
+    async with AsyncSessionLocal() as db:
+        pages = await db.scalar(text("PRAGMA freelist_count"))
+        page_size = await db.scalar(text("PRAGMA page_size"))
+
+    return (pages or 0) * (page_size or 0)
+
+
+def _unreferenced(referenced: set[str]) -> list[str]:
+    stale = []
+    cutoff = time.time() - PRUNE_GRACE
+
+    for directory, _, files in os.walk(blob_dir()):
+        for name in files:
+            digest = os.path.basename(directory) + name
+            full = os.path.join(directory, name)
+
+            if digest not in referenced and os.path.getmtime(full) < cutoff:
+                stale.append(full)
+
+    return stale
+
+
+async def prune() -> int:
+    """Deletes files no image row refers to (replaced or deleted pictures)."""
+    async with AsyncSessionLocal() as db:
+        referenced = set((await db.scalars(
+            select(models.ImageModel.sha256).where(models.ImageModel.sha256.is_not(None))
+        )).all())
+
+    stale = await asyncio.to_thread(_unreferenced, referenced)
+
+    for full in stale:
+        os.unlink(full)
+
+    return len(stale)
@@ -0,0 +1,185 @@
+"""
+Bootstrap bundle for kiosks starting cold.
+
+A kiosk used to start with the list calls plus one `/profilePicture` per
+teacher, and after a school-wide power cut every kiosk does it at the same
+moment. `/bootstrap` returns everything in one manifest:
+
+    {"version", "day", "teachers", "classes", "schedule", "avatars"}
+
+`schedule` holds the slots of the timetable today follows (none on days
+off). `avatars` points to `/bootstrap/avatars`, a single file with every
+profile picture back to back, and gives each teacher's offset, length and
+mimetype in it.
+
+Both are rebuilt in the background when `app.changes` reports a change,
+and when the school day rolls over. They are served from memory with
+ETags, so a kiosk that already has the current bundle gets 304s. The
+avatar pack is only rebuilt when a picture changes. Its URL carries its
+version, so a client can cache it for good.
+"""
+import asyncio
+import json
+
+from dataclasses import dataclass
+from datetime import date
+from hashlib import blake2b
+from typing import Dict, List, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import blobs, models, readpath, snapshots
+from .database import AsyncSessionLocal
+from .schoolcalendar import school_calendar, school_now
+from .tenancy import TenantLocal
+from .utils import spawn
+
+AVATARS_PATH = "/api/bootstrap/avatars"
+
+REBUILD_DELAY = 1
+
+
+@dataclass
+class AvatarEntry:
+    teacher_id: int
+    sha256: str
+    mimetype: str
+
+
+@dataclass
+class Bundle:
+    # Bootstrap.generation it was built for
+    generation: int
+    day: date
+    manifest: snapshots.Snapshot
+    avatars: snapshots.Snapshot
+    # teacher_id -> offset, length and mimetype in the pack
+    avatar_entries: Dict[str, dict]
+    # What the pack was built from, so an unchanged set of pictures is not re-read
+    avatar_index: List[AvatarEntry]
+
+
+async def _avatar_index(db: AsyncSession) -> List[AvatarEntry]:
+    image = models.ImageModel
+    rows = (await db.execute(
+        select(image.teacher_id, image.sha256, image.mimetype)
+        .where(image.sha256.is_not(None))
+        .order_by(image.teacher_id)
+    )).all()
+
+    return [AvatarEntry(row.teacher_id, row.sha256, row.mimetype) for row in rows]
+
+
+def _pack(index: List[AvatarEntry]) -> Tuple[bytes, Dict[str, dict]]:
+    """Concatenates the pictures and indexes them. Blocking, call from a thread."""
+    parts = []
+    entries = {}
+    offset = 0
+
+    for entry in index:
+        try:
+            with open(blobs.path(entry.sha256), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            print(f"Missing blob {entry.sha256} for teacher {entry.teacher_id}")
+            continue
+
+        parts.append(data)
+        entries[str(entry.teacher_id)] = {"offset": offset, "length": len(data), "mimetype": entry.mimetype}
+        offset += len(data)
+
+    return b"".join(parts), entries
+
+
+class Bootstrap:
+    def __init__(self):
+        self.generation = 0
+        self.bundle: Bundle | None = None
+        self._task: asyncio.Task | None = None
+
+    def invalidate(self):
+        self.generation += 1
+
+        # Nothing to keep warm until a kiosk has asked for it once
+        if self.bundle is not None:
+            self._schedule(delay=REBUILD_DELAY)
+
+    def _fresh(self) -> bool:
+        bundle = self.bundle
+        return bundle is not None and bundle.generation == self.generation and bundle.day == school_now().date()
+
+    def _schedule(self, delay: float = 0) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = spawn(self._rebuild(delay))
+
+        return self._task
+
+    async def _rebuild(self, delay: float):
+        # Lets a burst of commits (an import, the scheduler's class change) settle first
+        await asyncio.sleep(delay)
+
+        try:
+            # Changes that land while building are picked up by the next round
+            while not self._fresh():
+                self.bundle = await self._build(self.generation)
+        except Exception as e:
+            print(f"Bootstrap bundle build failed: {e}")
+
+    async def _build(self, generation: int) -> Bundle:
+        today = school_now().date()
+        previous = self.bundle
+
+        async with AsyncSessionLocal() as db:
+            await school_calendar.ensure_loaded(db)
+            weekday = school_calendar.weekday_for(today)
+
+            teachers = await readpath.fetch_rows(db, readpath.teachers_query())
+            classes = await readpath.fetch_rows(db, readpath.school_classes_query())
+            schedule = [] if weekday is None else await readpath.fetch_rows(
+                db, readpath.schedules_query().where(models.Schedule.weekday == weekday)
+            )
+            index = await _avatar_index(db)
+
+        if previous is not None and previous.avatar_index == index:
+            avatars, entries = previous.avatars, previous.avatar_entries
+        else:
+            pack, entries = await asyncio.to_thread(_pack, index)
+            # Pictures are already compressed, only the ETag is needed
+            avatars = await snapshots.encode(pack, compress=False)
+
+        avatar_version = avatars.etag[len('W/"'):-1]
+        sections = {
+            "day": json.dumps(school_calendar.day_info(today).as_response()).encode("utf-8"),
+            "teachers": readpath.TEACHER_LIST.dump_json(teachers),
+            "classes": readpath.SCHOOL_CLASS_LIST.dump_json(classes),
+            "schedule": readpath.SCHEDULE_LIST.dump_json(schedule),
+            "avatars": json.dumps({
+                "version": avatar_version,
+                "url": f"{AVATARS_PATH}?v={avatar_version}",
+                "entries": entries,
+            }).encode("utf-8"),
+        }
+        # From the content, so rebuilding unchanged data keeps the version kiosks have
+        manifest_version = blake2b(b"\0".join(sections.values()), digest_size=16).hexdigest()
+
+        body = b'{"version":"' + manifest_version.encode("utf-8") + b'",' + b",".join(
+            b'"' + name.encode("utf-8") + b'":' + value for name, value in sections.items()
+        ) + b"}"
+
+        return Bundle(generation, today, await snapshots.encode(body), avatars, entries, index)
+
+    async def get(self) -> Bundle:
+        if not self._fresh():
+            # Shielded: a kiosk giving up must not cancel the build the others wait for
+            await asyncio.shield(self._schedule())
+
+        # A failed rebuild leaves the previous bundle, which beats none
+        if self.bundle is None:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Bootstrap bundle unavailable")
+
+        return self.bundle
+
+
+bootstrap = TenantLocal(Bootstrap)
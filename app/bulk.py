@@ -0,0 +1,216 @@
+"""
+Bulk timetable import and export, shared by the API and `python -m app.cli`.
+"""
+import csv
+import io
+import json
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterable, List, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import delete, insert, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import changes, models, readpath, schemas
+from .database import AsyncSessionLocal
+from .enums import WeekDays
+from .intervals import Interval, find_conflicts
+
+CSV_COLUMNS = ["teacher_id", "class_id", "subject", "weekday", "time_in", "time_out", "is_break"]
+
+
+@dataclass
+class ImportResult:
+    inserted: int = 0
+    replaced: int = 0
+    errors: List[Dict[str, Any]] = field(default_factory=list)
+    conflicts: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors and not self.conflicts
+
+    def as_response(self) -> dict:
+        return {
+            "inserted": self.inserted,
+            "replaced": self.replaced,
+            "errors": self.errors,
+            "conflicts": self.conflicts,
+        }
+
+
+def _csv_weekday(value: str) -> int | str:
+    value = value.strip()
+
+    if value.isdigit():
+        return int(value)
+
+    try:
+        return WeekDays[value.title()].value
+    except KeyError:
+        return value
+
+
+def parse_csv(text: str) -> List[Dict[str, Any]]:
+    rows = []
+
+    for row in csv.DictReader(io.StringIO(text)):
+        # Blank cells fall back to the schema defaults
+        cleaned: Dict[str, Any] = {k.strip(): v.strip() for k, v in row.items() if k and v is not None and v.strip()}
+
+        if "weekday" in cleaned:
+            cleaned["weekday"] = _csv_weekday(cleaned["weekday"])
+
+        rows.append(cleaned)
+
+    return rows
+
+
+def parse_json(text: str) -> List[Dict[str, Any]]:
+    data = json.loads(text)
+
+    if not isinstance(data, list):
+        raise ValueError("Expected a JSON array of schedules")
+
+    return data
+
+
+def parse(text: str, content_type: str | None) -> List[Dict[str, Any]]:
+    if content_type and "csv" in content_type:
+        return parse_csv(text)
+
+    return parse_json(text)
+
+
+def validate(raw: Iterable[Dict[str, Any]], result: ImportResult) -> List[Tuple[int, schemas.ScheduleImport]]:
+    """Validated rows paired with their 1-based line in the input."""
+    valid = []
+
+    for line, row in enumerate(raw, start=1):
+        try:
+            valid.append((line, schemas.ScheduleImport.model_validate(row)))
+        except ValidationError as e:
+            result.errors.append({"row": line, "errors": e.errors(include_url=False, include_context=False)})
+
+    return valid
+
+
+def _keyed(schedule, ident):
+    interval = Interval(schedule.time_in, schedule.time_out, ident)
+    yield ("teacher", schedule.teacher_id, schedule.weekday), interval
+
+    if schedule.class_id is not None and not schedule.is_break:
+        yield ("class", schedule.class_id, schedule.weekday), interval
+
+
+def _describe(ident) -> Dict[str, Any]:
+    kind, value = ident
+    return {kind: value}
+
+
+async def import_schedules(
+    db: AsyncSession,
+    raw: List[Dict[str, Any]],
+    replace: bool = False,
+    dry_run: bool = False,
+) -> ImportResult:
+    """
+    Validates every row, checks the batch (and, unless replacing, the rows
+    already stored for the same teachers and classes) for overlapping slots,
+    then inserts everything with one executemany in a single transaction.
+    Nothing is written if any row is invalid or conflicts.
+    """
+    result = ImportResult()
+    numbered = validate(raw, result)
+    rows = [row for _, row in numbered]
+
+    teacher_ids = {row.teacher_id for row in rows}
+    class_ids = {row.class_id for row in rows if row.class_id is not None}
+
+    known_teachers = set((await db.scalars(select(models.Teacher.id).where(models.Teacher.id.in_(teacher_ids)))).all())
+    known_classes = set((await db.scalars(select(models.SchoolClass.id).where(models.SchoolClass.id.in_(class_ids)))).all())
+
+    for line, row in numbered:
+        if row.teacher_id not in known_teachers:
+            result.errors.append({"row": line, "errors": [f"Unknown teacher_id {row.teacher_id}"]})
+        if row.class_id is not None and row.class_id not in known_classes:
+            result.errors.append({"row": line, "errors": [f"Unknown class_id {row.class_id}"]})
+
+    if result.errors:
+        return result
+
+    keyed = []
+
+    stmt = select(*readpath.SCHEDULE_COLUMNS)
+
+    if replace:
+        # The imported teachers' rows are about to go, other teachers' use of the same classes stays
+        stmt = stmt.where(
+            models.Schedule.class_id.in_(class_ids),
+            models.Schedule.teacher_id.not_in(teacher_ids),
+        )
+    else:
+        stmt = stmt.where(or_(
+            models.Schedule.teacher_id.in_(teacher_ids),
+            models.Schedule.class_id.in_(class_ids),
+        ))
+
+    for schedule in await db.execute(stmt):
+        keyed.extend(_keyed(schedule, ("schedule_id", schedule.id)))
+
+    for line, row in numbered:
+        keyed.extend(_keyed(row, ("row", line)))
+
+    for (kind, key_id, weekday), first, second in find_conflicts(keyed):
+        result.conflicts.append({
+            kind: key_id,
+            "weekday": weekday.value,
+            "first": {**_describe(first.ident), "time_in": str(first.start), "time_out": str(first.end)},
+            "second": {**_describe(second.ident), "time_in": str(second.start), "time_out": str(second.end)},
+        })
+
+    if result.conflicts or dry_run:
+        return result
+
+    if replace:
+        deleted = await db.execute(delete(models.Schedule).where(models.Schedule.teacher_id.in_(teacher_ids)))
+        result.replaced = deleted.rowcount
+
+    if rows:
+        await db.execute(insert(models.Schedule), [row.model_dump() for row in rows])
+
+    # Core statements skip the flush hooks; cheaper to reload the index once than to patch it row by row
+    await changes.capture(db, changes.ChangeSet(teachers=set(teacher_ids), reload_timetable=True))
+
+    await db.commit()
+    result.inserted = len(rows)
+
+    return result
+
+
+async def export_csv() -> AsyncIterator[bytes]:
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(readpath.schedules_query())
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_COLUMNS)
+
+        async for chunk in result.partitions(readpath.NDJSON_CHUNK):
+            for row in chunk:
+                writer.writerow([
+                    row.teacher_id,
+                    "" if row.class_id is None else row.class_id,
+                    row.subject,
+                    row.weekday.value,
+                    row.time_in.isoformat(),
+                    row.time_out.isoformat(),
+                    "true" if row.is_break else "false",
+                ])
+
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')
@@ -0,0 +1,331 @@
+"""
+Commit-time change capture for teachers, schedules, classes and the
+calendar.
+
+Whichever path writes them (the API, the admin, the scheduler), the
+`after_flush` hook notes what changed in the session, and `after_commit`
+applies the whole transaction once: the timetable index is patched, the
+calendar reloaded, stale list snapshots dropped, each affected teacher's
+kiosk card is reloaded once and teachers whose availability changed are
+told so. Nothing is
+published for a transaction that rolls back, and kiosks never reload
+before the data they re-fetch is committed.
+
+Every flush is also written to `change_log` in the same transaction, and
+the other workers apply it from `poll_loop()`, since their caches and SSE
+clients are their own.
+"""
+import asyncio
+import json
+import os
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Set
+
+from sqlalchemy import delete, event, func, inspect, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models, snapshots, sse
+from .bootstrap import bootstrap
+from .database import AsyncSessionLocal
+from .schoolcalendar import school_calendar
+from .timetable import Slot, slot_from_model, timetable
+
+POLL_INTERVAL = 2
+RETENTION = timedelta(hours=1)
+
+# Past this many rows another worker reloads the timetable instead of re-reading each one
+REFRESH_LIMIT = 50
+
+# Teacher columns the kiosk does not show
+KIOSK_IGNORED = {"firebase_token", "token"}
+
+_SESSION_KEY = "change_set"
+
+ORIGIN = os.getpid()
+
+
+@dataclass
+class ChangeSet:
+    # Teachers whose kiosk card has to be reloaded
+    teachers: Set[int] = field(default_factory=set)
+    availability: Dict[int, int] = field(default_factory=dict)
+    schedules: Set[int] = field(default_factory=set)
+    # New state of the changed schedules, None once deleted; only known to the committing worker
+    slots: Dict[int, Slot | None] = field(default_factory=dict)
+    # Written around the ORM (bulk import), the whole timetable is reloaded
+    reload_timetable: bool = False
+    calendar: bool = False
+    # A class was added, renamed or removed
+    classes: bool = False
+
+    def __bool__(self) -> bool:
+        return bool(
+            self.teachers or self.availability or self.schedules
+            or self.reload_timetable or self.calendar or self.classes
+        )
+
+    def merge(self, other: "ChangeSet"):
+        self.teachers |= other.teachers
+        self.availability.update(other.availability)
+        self.schedules |= other.schedules
+        self.slots.update(other.slots)
+        self.reload_timetable = self.reload_timetable or other.reload_timetable
+        self.calendar = self.calendar or other.calendar
+        self.classes = self.classes or other.classes
+
+    def as_json(self) -> str:
+        return json.dumps({
+            "teachers": sorted(self.teachers),
+            "availability": self.availability,
+            "schedules": sorted(self.schedules),
+            "reload_timetable": self.reload_timetable,
+            "calendar": self.calendar,
+            "classes": self.classes,
+        })
+
+    @classmethod
+    def from_json(cls, data: str) -> "ChangeSet":
+        raw = json.loads(data)
+        return cls(
+            teachers=set(raw["teachers"]),
+            availability={int(teacher_id): value for teacher_id, value in raw["availability"].items()},
+            schedules=set(raw["schedules"]),
+            reload_timetable=raw["reload_timetable"],
+            calendar=raw["calendar"],
+            # Absent from rows logged before classes were tracked
+            classes=raw.get("classes", False),
+        )
+
+
+def _changed_columns(target) -> Set[str]:
+    return {attr.key for attr in inspect(target).attrs if attr.history.has_changes()}
+
+
+def _capture_schedule(changes: ChangeSet, schedule: models.Schedule, deleted: bool):
+    changes.schedules.add(schedule.id)
+
+    previous = timetable.slots.get(schedule.id)
+    if previous is not None:
+        changes.teachers.add(previous.teacher_id)
+
+    if deleted:
+        changes.slots[schedule.id] = None
+        return
+
+    slot = slot_from_model(schedule)
+    changes.teachers.add(slot.teacher_id)
+
+    if None in (slot.teacher_id, slot.weekday, slot.time_in, slot.time_out):
+        changes.reload_timetable = True
+    else:
+        changes.slots[schedule.id] = slot
+
+
+def _collect(session: Session) -> ChangeSet:
+    changes = ChangeSet()
+
+    for target in session.new:
+        if isinstance(target, models.Teacher):
+            changes.teachers.add(target.id)
+        elif isinstance(target, models.Schedule):
+            _capture_schedule(changes, target, deleted=False)
+        elif isinstance(target, models.SchoolClass):
+            changes.classes = True
+        elif isinstance(target, models.ImageModel) and target.teacher_id is not None:
+            changes.teachers.add(target.teacher_id)
+        elif isinstance(target, models.CalendarException):
+            changes.calendar = True
+
+    for target in session.dirty:
+        if not session.is_modified(target, include_collections=False):
+            continue
+
+        if isinstance(target, models.Teacher):
+            columns = _changed_columns(target)
+
+            if "availability" in columns:
+                changes.availability[target.id] = target.availability.value
+            if columns - KIOSK_IGNORED:
+                changes.teachers.add(target.id)
+        elif isinstance(target, models.Schedule):
+            _capture_schedule(changes, target, deleted=False)
+        elif isinstance(target, models.SchoolClass):
+            changes.classes = True
+            # The class name is on every card that shows one of its slots
+            changes.teachers.update(slot.teacher_id for slot in timetable.slots.values() if slot.class_id == target.id)
+        elif isinstance(target, models.ImageModel) and target.teacher_id is not None:
+            changes.teachers.add(target.teacher_id)
+        elif isinstance(target, models.CalendarException):
+            changes.calendar = True
+
+    for target in session.deleted:
+        if isinstance(target, models.Teacher):
+            changes.teachers.add(target.id)
+        elif isinstance(target, models.Schedule):
+            _capture_schedule(changes, target, deleted=True)
+        elif isinstance(target, models.SchoolClass):
+            changes.classes = True
+        elif isinstance(target, models.ImageModel) and target.teacher_id is not None:
+            changes.teachers.add(target.teacher_id)
+        elif isinstance(target, models.CalendarException):
+            changes.calendar = True
+
+    return changes
+
+
+def _log(changes: ChangeSet):
+    return insert(models.ChangeLog).values(origin=ORIGIN, data=changes.as_json())
+
+
+def _pending(session: Session) -> ChangeSet:
+    return session.info.setdefault(_SESSION_KEY, ChangeSet())
+
+
+@event.listens_for(Session, "after_flush")
+def _capture_flush(session: Session, flush_context):
+    changes = _collect(session)
+
+    if changes:
+        # Same transaction as the change, so it reaches the other workers only if it commits
+        session.connection().execute(_log(changes))
+        _pending(session).merge(changes)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_committed(session: Session):
+    changes = session.info.pop(_SESSION_KEY, None)
+
+    if not changes:
+        return
+
+    # The write is committed either way; the caller must not see it fail
+    try:
+        apply(changes)
+    except Exception as e:
+        timetable.invalidate()
+        snapshots.invalidate_all()
+        print(f"Applying committed changes failed: {e}")
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_rolled_back(session: Session, previous_transaction):
+    session.info.pop(_SESSION_KEY, None)
+
+
+async def capture(db: AsyncSession, changes: ChangeSet):
+    """For writers that go around the unit of work (Core insert/update/delete); call before commit."""
+    await db.execute(_log(changes))
+    _pending(db.sync_session).merge(changes)
+
+
+def publish(changes: ChangeSet):
+    """Tells this worker's SSE clients, once per teacher."""
+    for teacher_id, availability in changes.availability.items():
+        sse.publish_teacher(teacher_id, {
+            "event": "switchAvailability",
+            "self.availability": availability,
+            "availability": availability,
+        })
+
+    for teacher_id in sorted(changes.teachers):
+        sse.publish_tablets({
+            "event": "reload",
+            "teacher_id": teacher_id,
+        })
+
+
+def invalidate_snapshots(changes: ChangeSet):
+    if changes.teachers or changes.availability:
+        snapshots.teachers.invalidate()
+
+    if changes.schedules or changes.reload_timetable:
+        snapshots.schedules.invalidate()
+
+    if changes.classes:
+        snapshots.school_classes.invalidate()
+
+    # Holds a bit of everything, calendar included
+    bootstrap.invalidate()
+
+
+def apply(changes: ChangeSet):
+    """Applies a change set committed by this worker."""
+    invalidate_snapshots(changes)
+
+    if changes.reload_timetable:
+        timetable.invalidate()
+    else:
+        for schedule_id, slot in changes.slots.items():
+            if slot is None:
+                timetable.remove(schedule_id)
+            else:
+                timetable.upsert(slot)
+
+    if changes.calendar:
+        school_calendar.invalidate()
+
+    publish(changes)
+
+
+async def apply_remote(db: AsyncSession, changes: ChangeSet):
+    """Applies a change set committed by another worker, re-reading the rows it names."""
+    invalidate_snapshots(changes)
+
+    if changes.reload_timetable or len(changes.schedules) > REFRESH_LIMIT:
+        timetable.invalidate()
+    else:
+        for schedule_id in sorted(changes.schedules):
+            await timetable.refresh(db, schedule_id)
+
+    if changes.calendar:
+        school_calendar.invalidate()
+
+    publish(changes)
+
+
+async def latest_id(db: AsyncSession) -> int:
+    return await db.scalar(select(func.max(models.ChangeLog.id))) or 0
+
+
+async def catch_up(since: int) -> int:
+    """Applies other workers' changes logged after `since`; returns the last id seen."""
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(models.ChangeLog.id, models.ChangeLog.origin, models.ChangeLog.data)
+            .where(models.ChangeLog.id > since)
+            .order_by(models.ChangeLog.id)
+        )).all()
+
+        if not rows:
+            return since
+
+        changes = ChangeSet()
+
+        for row in rows:
+            if row.origin != ORIGIN:
+                changes.merge(ChangeSet.from_json(row.data))
+
+        if changes:
+            async with timetable.lock:
+                await apply_remote(db, changes)
+
+    return rows[-1].id
+
+
+async def poll_loop(since: int, interval: float = POLL_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+
+        try:
+            since = await catch_up(since)
+        except Exception as e:
+            print(f"Change log poll failed: {e}")
+
+
+async def prune():
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(models.ChangeLog).where(models.ChangeLog.created_at < datetime.now() - RETENTION))
+        await db.commit()
@@ -0,0 +1,155 @@
+"""
+Maintenance commands that run against the same database as the server.
+
+    uv run python -m app.cli import-schedules timetable.csv [--replace] [--dry-run]
+    uv run python -m app.cli export-schedules [-o schedules.csv]
+    uv run python -m app.cli migrate-images [--vacuum]
+    uv run python -m app.cli export-snapshot [-o snapshot.sqlite3.gz]
+    uv run python -m app.cli import-snapshot snapshot.sqlite3.gz --replace
+
+export-snapshot is safe while the server runs. Stop the server before
+import-snapshot, its caches would keep serving the old data.
+
+With several schools (TENANTS), pass --tenant <name> before the command.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+from . import backup, blobs, bulk, tenancy
+from .database import AsyncSessionLocal, dispose_engines, engine, init_db
+
+
+async def import_schedules(args) -> int:
+    with open(args.file, encoding='utf-8') as f:
+        text = f.read()
+
+    content_type = "text/csv" if args.file.lower().endswith(".csv") else "application/json"
+    raw = bulk.parse(text, content_type)
+
+    await init_db()
+    async with AsyncSessionLocal() as db:
+        result = await bulk.import_schedules(db, raw, replace=args.replace, dry_run=args.dry_run)
+
+    print(json.dumps(result.as_response(), indent=2, default=str))
+
+    if not result.ok:
+        return 1
+
+    if args.dry_run:
+        print(f"Dry run: {len(raw)} rows would be imported")
+
+    return 0
+
+
+async def export_schedules(args) -> int:
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+
+    try:
+        async for chunk in bulk.export_csv():
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+
+    return 0
+
+
+async def migrate_images(args) -> int:
+    await init_db()
+    moved = await blobs.migrate_images()
+    print(f"Moved {moved} images to {blobs.blob_dir()}")
+
+    if args.vacuum:
+        # Gives the pages the images occupied back to the filesystem
+        async with engine.connect() as conn:
+            await conn.execute(text("VACUUM"))
+
+    return 0
+
+
+async def export_snapshot(args) -> int:
+    tenant = tenancy.current()
+    output = args.output or f"{tenant.name}-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}{backup.SUFFIX}"
+
+    progress = backup.BackupProgress()
+    size = await asyncio.to_thread(backup.export_snapshot, tenant.database_path, output, progress)
+    print(f"Wrote {output} ({size} bytes, {progress.pages_total} pages, {progress.restarts} restarts)")
+
+    return 0
+
+
+async def import_snapshot(args) -> int:
+    tenant = tenancy.current()
+
+    if os.path.exists(tenant.database_path) and not args.replace:
+        print(f"{tenant.database_path} exists, pass --replace to overwrite it")
+        return 1
+
+    await asyncio.to_thread(backup.import_snapshot, args.file, tenant.database_path)
+    print(f"Restored {args.file} into {tenant.database_path}")
+
+    return 0
+
+
+COMMANDS = {
+    "import-schedules": import_schedules,
+    "export-schedules": export_schedules,
+    "migrate-images": migrate_images,
+    "export-snapshot": export_snapshot,
+    "import-snapshot": import_snapshot,
+}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    parser.add_argument("--tenant", help="School to run against, required when TENANTS is set")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    imp = commands.add_parser("import-schedules", help="Bulk import a CSV or JSON timetable")
+    imp.add_argument("file")
+    imp.add_argument("--replace", action="store_true", help="Replace the imported teachers' existing schedules")
+    imp.add_argument("--dry-run", action="store_true", help="Validate and check for conflicts without writing")
+
+    exp = commands.add_parser("export-schedules", help="Export every schedule as CSV")
+    exp.add_argument("-o", "--output")
+
+    mig = commands.add_parser("migrate-images", help="Move profile pictures out of the database into the blob store")
+    mig.add_argument("--vacuum", action="store_true", help="VACUUM afterwards to shrink db.sqlite3")
+
+    snap = commands.add_parser("export-snapshot", help="Write a gzipped copy of the live database")
+    snap.add_argument("-o", "--output", help="Defaults to <tenant>-<UTC timestamp>.sqlite3.gz")
+
+    restore = commands.add_parser("import-snapshot", help="Restore a snapshot; stop the server first")
+    restore.add_argument("file")
+    restore.add_argument("--replace", action="store_true", help="Overwrite the existing database")
+
+    args = parser.parse_args(argv)
+
+    if args.tenant:
+        tenant = tenancy.get(args.tenant)
+        if tenant is None:
+            parser.error(f"unknown tenant {args.tenant!r}")
+    elif tenancy.MULTI_TENANT:
+        parser.error("--tenant is required when TENANTS is set")
+    else:
+        tenant = tenancy.current()
+
+    async def run():
+        with tenancy.use(tenant):
+            try:
+                return await COMMANDS[args.command](args)
+            finally:
+                await dispose_engines()
+
+    return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Response compression.
+
+The snapshot endpoints (`app.snapshots`) are compressed once per data
+version and pick their encoding with `negotiate()`. Everything else goes
+through `CompressionMiddleware`, which gzips on the fly; it leaves alone
+responses that already carry a Content-Encoding, event streams, and the
+profile pictures and the bootstrap avatar pack, which are already
+compressed images.
+
+Brotli is offered when the `brotli` package is importable; without it
+clients get gzip.
+"""
+import gzip
+
+from functools import cache
+from typing import Dict, Set
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+
+# Snapshots are compressed once per version, so they can afford the slow settings
+SNAPSHOT_GZIP_LEVEL = 9
+SNAPSHOT_BROTLI_QUALITY = 9
+
+DYNAMIC_GZIP_LEVEL = 6
+MINIMUM_SIZE = 1000
+
+UNCOMPRESSED_PREFIXES = ("/api/profilePicture/", "/api/bootstrap/avatars")
+
+# Preferred first
+ENCODINGS = ("br", "gzip")
+
+
+@cache
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+
+    return brotli
+
+
+def accepted_encodings(header: str) -> Set[str]:
+    """Codings an Accept-Encoding header allows, ignoring the ones with q=0."""
+    accepted = set()
+
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+
+        if not coding:
+            continue
+
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+
+        accepted.add(coding)
+
+    if "*" in accepted:
+        accepted.update(ENCODINGS)
+
+    return accepted
+
+
+def negotiate(header: str | None, available: Dict[str, bytes]) -> str | None:
+    if not header:
+        return None
+
+    accepted = accepted_encodings(header)
+
+    for coding in ENCODINGS:
+        if coding in accepted and coding in available:
+            return coding
+
+    return None
+
+
+def encode_all(body: bytes) -> Dict[str, bytes]:
+    """Every encoding of `body` this server can offer. CPU bound, call from a thread."""
+    encoded = {"gzip": gzip.compress(body, compresslevel=SNAPSHOT_GZIP_LEVEL, mtime=0)}
+
+    brotli = _brotli()
+    if brotli is not None:
+        encoded["br"] = brotli.compress(body, quality=SNAPSHOT_BROTLI_QUALITY)
+
+    return encoded
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE, compresslevel: int = DYNAMIC_GZIP_LEVEL):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=compresslevel)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(UNCOMPRESSED_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        # GZipMiddleware only looks for "gzip" in the header, so it would ignore "gzip;q=0"
+        if "gzip" not in accepted_encodings(Headers(scope=scope).get("accept-encoding", "")):
+            await self.app(scope, receive, send)
+            return
+
+        await self.gzip(scope, receive, send)
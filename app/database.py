@@ -1,25 +1,93 @@
-from typing import AsyncGenerator
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+import os
+from collections import OrderedDict
+from typing import AsyncGenerator, Dict, Tuple
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 from fastapi import Depends
 
-DATABASE_URL = "sqlite+aiosqlite:///./db.sqlite3"
-# ADMIN_DATABASE_URL = "sqlite+aiosqlite:///./db.sqlite3"
+from . import tenancy
+from .utils import spawn
 
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=False,
-    # connect_args={"check_same_thread": False} # Not needed for async aiosqlite
-)
+# Every open engine holds a pool of aiosqlite connections, each with its own
+# thread; past this many the least recently used tenant's engine is disposed
+# and reopened on its next query. Every tenant's background loops query it
+# every few seconds, so a cap below the number of tenants only churns
+# engines; by default there is one per tenant.
+MAX_OPEN_ENGINES = int(os.environ.get("MAX_OPEN_ENGINES") or len(tenancy.all_tenants()))
+
+_engines: "OrderedDict[str, AsyncEngine]" = OrderedDict()
+
+def tenant_engine(tenant: tenancy.Tenant | None = None) -> AsyncEngine:
+    """The tenant's engine (the current tenant's by default), created on first use."""
+    tenant = tenant or tenancy.current()
+    engine = _engines.get(tenant.name)
+
+    if engine is not None:
+        _engines.move_to_end(tenant.name)
+        return engine
+
+    os.makedirs(os.path.dirname(tenant.database_path) or ".", exist_ok=True)
+    engine = _engines[tenant.name] = create_async_engine(tenant.database_url, echo=False)
+
+    while len(_engines) > MAX_OPEN_ENGINES:
+        _, evicted = _engines.popitem(last=False)
+        # Sessions still using it finish normally, their connections close when returned
+        spawn(evicted.dispose())
+
+    return engine
+
+def check_engine_cap():
+    tenants = len(tenancy.all_tenants())
+
+    if tenants > MAX_OPEN_ENGINES:
+        print(
+            f"Warning: {tenants} tenants but MAX_OPEN_ENGINES={MAX_OPEN_ENGINES}; their background loops "
+            "will keep evicting and reopening engines. Raise MAX_OPEN_ENGINES to at least the number of tenants."
+        )
+
+def is_open(tenant: tenancy.Tenant) -> bool:
+    return tenant.name in _engines
+
+async def dispose_engines():
+    while _engines:
+        _, engine = _engines.popitem()
+        await engine.dispose()
+
+class _TenantEngine:
+    """Stands in for the engine of the current tenant."""
+    def __getattr__(self, name):
+        return getattr(tenant_engine(), name)
+
+engine = _TenantEngine()
 
 class Base(DeclarativeBase):
     pass
 
-AsyncSessionLocal = async_sessionmaker(
-    bind=engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
-)
+class TenantSessionmaker:
+    """async_sessionmaker that binds each session to the current tenant's engine."""
+    class_ = AsyncSession
+
+    def __init__(self, **options):
+        self.options = {"class_": AsyncSession, **options}
+        self._makers: Dict[str, Tuple[AsyncEngine, async_sessionmaker]] = {}
+
+    def configure(self, **options):
+        self.options.update(options)
+        self._makers.clear()
+
+    def __call__(self, **local) -> AsyncSession:
+        tenant = tenancy.current()
+        bind = tenant_engine(tenant)
+        cached = self._makers.get(tenant.name)
+
+        # Rebuilt when the engine was evicted and reopened
+        if cached is None or cached[0] is not bind:
+            cached = self._makers[tenant.name] = (bind, async_sessionmaker(bind=bind, **self.options))
+
+        return cached[1](**local)
+
+AsyncSessionLocal = TenantSessionmaker(expire_on_commit=False)
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with AsyncSessionLocal() as session:
@@ -31,6 +99,26 @@ async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
         finally:
             await session.close()
 
+def _create_missing_indexes(conn):
+    # create_all only creates indexes together with their table, so indexes
+    # added to existing tables later have to be created explicitly
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+def _add_missing_columns(conn):
+    # Same for nullable columns added to existing tables
+    inspector = inspect(conn)
+
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(conn.dialect)}'))
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_create_missing_indexes)
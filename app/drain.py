@@ -0,0 +1,137 @@
+"""
+Graceful drain for restarts.
+
+uvicorn only runs the lifespan shutdown once every connection has closed,
+and SSE streams never close on their own, so without this a restart hangs
+until the graceful timeout cuts the streams off, and every kiosk
+reconnects at the same moment to whichever worker is up first.
+
+On SIGTERM or SIGINT (uvicorn's own handler still runs after ours)
+`begin()` puts the worker in drain mode:
+
+- new streams are refused with 503 and a Retry-After,
+- every open stream is sent a last `drain` event carrying a `retry:` hint
+  picked at random in [RETRY_MIN, RETRY_SPREAD] ms, then closed, so the
+  clients come back spread over that window.
+
+The lifespan shutdown then calls `finish()`, which waits up to
+FINISH_DEADLINE for spawned notify and announcement tasks and sends what is
+due in the push outbox before the background loops are cancelled.
+
+`kill -HUP` on the uvicorn supervisor restarts the workers one at a time,
+so with this a rolling restart moves clients over without a reconnect storm.
+"""
+import asyncio
+import random
+import signal
+
+from fastapi import HTTPException, status
+
+from . import globals, outbox, sse, tenancy
+
+RETRY_MIN = 1_000
+RETRY_SPREAD = 30_000
+
+FINISH_DEADLINE = 10
+
+_draining = False
+
+
+def draining() -> bool:
+    return _draining
+
+
+def install():
+    """Chains onto the signal handlers uvicorn has installed; call from the lifespan."""
+    loop = asyncio.get_running_loop()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        previous = signal.getsignal(sig)
+
+        if not callable(previous):
+            continue
+
+        def handler(signum, frame, previous=previous):
+            loop.call_soon_threadsafe(begin)
+            previous(signum, frame)
+
+        try:
+            signal.signal(sig, handler)
+        except ValueError:
+            # Not the main thread (embedded or test servers), there is nothing to chain onto
+            return
+
+
+def retry_ms() -> int:
+    return random.randint(RETRY_MIN, RETRY_SPREAD)
+
+
+def _close(queue: asyncio.Queue[bytes]):
+    delay = retry_ms()
+    queue.put_nowait(sse.encode_event({"event": "drain", "retry_ms": delay}, retry_ms=delay))
+    queue.put_nowait(sse.CLOSE)
+
+
+def begin():
+    """Refuses new streams and closes the open ones. Idempotent."""
+    global _draining
+
+    if _draining:
+        return
+
+    _draining = True
+    streams = 0
+
+    # Runs from the signal handler, outside any request, so every school is walked
+    for tenant in tenancy.all_tenants():
+        with tenancy.use(tenant):
+            for queue in list(globals.SSE_TABLET_CONNECTIONS.values()):
+                _close(queue)
+                streams += 1
+
+            for devices in list(globals.SSE_TEACHER_CONNECTIONS.values()):
+                for device in list(devices.values()):
+                    _close(device.queue)
+                    streams += 1
+
+    if streams:
+        print(f"Draining: closed {streams} streams")
+
+
+def refuse_if_draining():
+    if _draining:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is restarting",
+            headers={"Retry-After": str(retry_ms() // 1000)},
+        )
+
+
+async def _flush_outbox():
+    for tenant in tenancy.all_tenants():
+        with tenancy.use(tenant):
+            while await outbox.drain_once():
+                pass
+
+
+async def finish(deadline: float = FINISH_DEADLINE):
+    """Waits for in-flight notify and push work, `deadline` seconds at most."""
+    # Shutdown without a signal (e.g. the lifespan exiting on its own)
+    begin()
+
+    loop = asyncio.get_running_loop()
+    until = loop.time() + deadline
+
+    if globals.BACKGROUND_TASKS:
+        _, pending = await asyncio.wait(set(globals.BACKGROUND_TASKS), timeout=deadline)
+
+        if pending:
+            print(f"Drain deadline passed with {len(pending)} background tasks still running")
+
+    try:
+        # Rows claimed by an interrupted pass go back to pending after outbox.CLAIM_TIMEOUT
+        await asyncio.wait_for(_flush_outbox(), timeout=max(until - loop.time(), 0))
+    except asyncio.TimeoutError:
+        print("Drain deadline passed before the outbox was flushed")
+    except Exception as e:
+        print(f"Outbox flush on shutdown failed: {e}")
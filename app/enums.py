@@ -12,3 +12,19 @@ class WeekDays(enum.Enum):
     Wednesday=2
     Thursday=3 
     Friday=4
+
+class OutboxStatus(enum.Enum):
+    Pending=0
+    Sending=1
+    Sent=2
+    Dead=3
+
+class DayKind(enum.Enum):
+    Holiday=0
+    Suspension=1
+    Alternate=2
+
+class TeacherEventKind(enum.Enum):
+    Availability=0
+    Notify=1
+    Response=2
@@ -0,0 +1,120 @@
+"""
+Kiosk/teacher interactions shared by the HTTP endpoints and the WebSocket
+channels. Errors are raised as HTTPException; the socket handlers turn them
+into `error` frames.
+"""
+import time
+
+from fastapi import HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.enums import Availability
+from . import globals, history, models, outbox, sse
+from .roundtrip import round_trips
+from .ratelimit import COALESCE_SECONDS, notify_limiter
+
+
+async def notify_teacher(db: AsyncSession, teacher_id: int, tablet_session: str):
+    if not tablet_session in globals.SSE_TABLET_CONNECTIONS:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+    teacher = await db.get(models.Teacher, teacher_id)
+
+    if not teacher:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    decision = notify_limiter.check(tablet_session, teacher.id)
+
+    if decision.reason == "coalesced":
+        pending = round_trips.current(tablet_session, teacher.id)
+        return {
+            "status": "coalesced",
+            "retry_after": round(decision.retry_after, 1),
+            "request_id": pending.request_id if pending else None,
+        }
+
+    if not decision.allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=decision.reason,
+            headers={"Retry-After": decision.retry_after_header},
+        )
+
+    request = round_trips.open(tablet_session, teacher.id)
+
+    payload = {
+        "event": "notify",
+        "tablet_session": tablet_session,
+        "request_id": request.request_id,
+    }
+
+    success = False
+
+    try:
+        if sse.publish_teacher(teacher.id, payload):
+            request.via_sse = True
+            success = True
+
+        if teacher.firebase_token:
+            # One key per coalescing window, so a repeat tap that lands on another worker is not pushed twice
+            window = int(time.time() // COALESCE_SECONDS)
+
+            await outbox.enqueue(
+                db,
+                idempotency_key=f"notify:{tablet_session}:{teacher.id}:{window}",
+                token=teacher.firebase_token,
+                title="Kiosk Notification",
+                body="Someone is looking for you",
+                data={
+                    "event": "notify",
+                    "tablet_session": tablet_session,
+                    "request_id": request.request_id,
+                },
+                teacher_id=teacher.id,
+            )
+            await db.commit()
+            outbox.wake()
+            request.via_fcm = True
+            success = True
+    finally:
+        if not success:
+            # Nothing went out: a retry must not be coalesced into this attempt
+            round_trips.discard(request)
+            notify_limiter.forget(tablet_session, teacher.id)
+
+    if success:
+        history.record_notify(teacher.id)
+        return {"status": "success", "request_id": request.request_id}
+
+    return {"status": "failed", "reason": "No active connection or FCM token found"}
+
+
+def teacher_response(teacher_id: int, tablet_session: str, message: str, request_id: str | None = None):
+    """`request_id` is echoed from the notify; older clients omit it and answer the latest one."""
+    request = round_trips.current(tablet_session, teacher_id) if request_id is None else None
+
+    payload = {
+        "event": "response",
+        "message": message,
+        "teacher_id": teacher_id,
+        "request_id": request_id or (request.request_id if request else None),
+    }
+
+    if sse.publish_tablet(tablet_session, payload):
+        answered = round_trips.answer(tablet_session, teacher_id, payload["request_id"])
+        return {
+            "status": "success",
+            "method": "SSE",
+            "latency_ms": round(answered.answered_ms) if answered and answered.answered_ms is not None else None,
+        }
+
+    else:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+async def force_availability(db: AsyncSession, teacher: models.Teacher, availability: Availability):
+    teacher._regenerate_token = False
+    teacher.availability = availability
+
+    await db.commit()
+    await db.refresh(teacher)
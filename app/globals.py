@@ -1,5 +1,25 @@
 import asyncio
-from typing import Dict
+from typing import TYPE_CHECKING, Dict, MutableMapping, MutableSequence, MutableSet, Set
 
-SSE_TABLET_CONNECTIONS: Dict[str, asyncio.Queue] = {}
-SSE_TEACHER_CONNECTIONS: Dict[int, asyncio.Queue] = {}
+from .tenancy import TenantDict, TenantList, TenantSet
+
+if TYPE_CHECKING:
+    from .presence import TeacherDevice
+    from .roundtrip import PendingRequest
+    from .tablets import TabletSession
+
+# Per school: each tenant sees its own (app.tenancy)
+SSE_TABLET_CONNECTIONS: MutableMapping[str, asyncio.Queue[bytes]] = TenantDict()
+# teacher_id -> device_id -> stream, a teacher can be signed in on several devices
+SSE_TEACHER_CONNECTIONS: MutableMapping[int, Dict[str, "TeacherDevice"]] = TenantDict()
+
+TABLET_SESSIONS: MutableMapping[str, "TabletSession"] = TenantDict()
+TABLET_TOUCHED: MutableSet[str] = TenantSet()
+
+# Shared by every tenant, shutdown waits for all of them
+BACKGROUND_TASKS: Set[asyncio.Task] = set()
+
+# Committed teacher events waiting for the next history flush
+TEACHER_EVENTS: MutableSequence[Dict[str, int]] = TenantList()
+# request_id -> kiosk notify waiting for the teacher's response
+PENDING_REQUESTS: MutableMapping[str, "PendingRequest"] = TenantDict()
@@ -0,0 +1,175 @@
+"""
+Teacher availability and kiosk request history.
+
+Availability changes are captured from the ORM when they commit, whichever
+path made them (scheduler, forceAvailability, admin). Notify/respond events
+are recorded by `events`. Nothing is written on the request path: events
+wait in `globals.TEACHER_EVENTS` until `flush()` inserts them in one batch
+and folds them into `teacher_daily_rollup` with an upsert, so reports read
+one row per teacher per day instead of scanning raw events.
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Tuple
+
+from sqlalchemy import delete, event, func, insert, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import globals, models
+from .database import AsyncSessionLocal
+from .enums import Availability, TeacherEventKind
+from .schoolcalendar import SCHOOL_TZ
+
+FLUSH_INTERVAL = 5
+RETENTION_DAYS = 400
+
+_SESSION_KEY = "teacher_events"
+
+AVAILABILITY_COLUMNS = {
+    Availability.Available.value: "available",
+    Availability.DoNotDisturb.value: "do_not_disturb",
+    Availability.InClass.value: "in_class",
+    Availability.Absent.value: "absent",
+}
+
+ROLLUP_COUNTERS = ("available", "do_not_disturb", "in_class", "absent", "notified", "responded", "response_ms_total")
+
+
+def _event(teacher_id: int, kind: TeacherEventKind, value: int = 0) -> Dict[str, int]:
+    now = datetime.now(SCHOOL_TZ)
+    return {
+        "day": now.date().toordinal(),
+        "at": int(now.timestamp()),
+        "teacher_id": teacher_id,
+        "kind": kind.value,
+        "value": value,
+    }
+
+
+def record(teacher_id: int, kind: TeacherEventKind, value: int = 0):
+    globals.TEACHER_EVENTS.append(_event(teacher_id, kind, value))
+
+
+def record_notify(teacher_id: int):
+    record(teacher_id, TeacherEventKind.Notify)
+
+
+def record_response(teacher_id: int, waited_ms: int):
+    record(teacher_id, TeacherEventKind.Response, waited_ms)
+
+
+@event.listens_for(models.Teacher, "after_update")
+def _capture_availability(mapper, connection, target: models.Teacher):
+    added = inspect(target).attrs.availability.history.added
+
+    if not added or added[0] is None:
+        return
+
+    session = inspect(target).session
+    if session is not None:
+        session.info.setdefault(_SESSION_KEY, []).append(
+            _event(target.id, TeacherEventKind.Availability, added[0].value)
+        )
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session: Session):
+    captured = session.info.pop(_SESSION_KEY, None)
+
+    if captured:
+        globals.TEACHER_EVENTS.extend(captured)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_rolled_back(session: Session, previous_transaction):
+    session.info.pop(_SESSION_KEY, None)
+
+
+def _rollup(events: List[Dict[str, int]]) -> List[Dict[str, int]]:
+    totals: Dict[Tuple[int, int], Dict[str, int]] = defaultdict(lambda: dict.fromkeys((*ROLLUP_COUNTERS, "response_ms_max"), 0))
+
+    for row in events:
+        counters = totals[(row["day"], row["teacher_id"])]
+        kind = TeacherEventKind(row["kind"])
+
+        if kind == TeacherEventKind.Availability:
+            counters[AVAILABILITY_COLUMNS[row["value"]]] += 1
+        elif kind == TeacherEventKind.Notify:
+            counters["notified"] += 1
+        elif kind == TeacherEventKind.Response:
+            counters["responded"] += 1
+            counters["response_ms_total"] += row["value"]
+            counters["response_ms_max"] = max(counters["response_ms_max"], row["value"])
+
+    return [{"day": day, "teacher_id": teacher_id, **counters} for (day, teacher_id), counters in totals.items()]
+
+
+async def flush():
+    """Writes buffered events and their rollup increments in one transaction."""
+    if not globals.TEACHER_EVENTS:
+        return
+
+    events = globals.TEACHER_EVENTS[:]
+    globals.TEACHER_EVENTS.clear()
+
+    rollup = models.TeacherDailyRollup
+    stmt = sqlite_insert(rollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[rollup.day, rollup.teacher_id],
+        set_={
+            **{name: getattr(rollup, name) + getattr(stmt.excluded, name) for name in ROLLUP_COUNTERS},
+            "response_ms_max": func.max(rollup.response_ms_max, stmt.excluded.response_ms_max),
+        },
+    )
+
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(models.TeacherEvent), events)
+            await db.execute(stmt, _rollup(events))
+            await db.commit()
+    except Exception as e:
+        # Retried on the next flush
+        globals.TEACHER_EVENTS[:0] = events
+        print(f"History flush failed: {e}")
+
+
+async def prune():
+    """Drops raw events past retention; the rollups are kept."""
+    oldest = (datetime.now(SCHOOL_TZ).date() - timedelta(days=RETENTION_DAYS)).toordinal()
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(models.TeacherEvent).where(models.TeacherEvent.day < oldest))
+        await db.commit()
+
+
+async def report(db: AsyncSession, start: date, end: date, teacher_id: int | None = None) -> List[dict]:
+    """Totals per teacher over [start, end], read from the daily rollups."""
+    rollup = models.TeacherDailyRollup
+
+    stmt = (
+        select(
+            rollup.teacher_id,
+            *(func.sum(getattr(rollup, name)).label(name) for name in ROLLUP_COUNTERS),
+            func.max(rollup.response_ms_max).label("response_ms_max"),
+        )
+        .where(rollup.day >= start.toordinal(), rollup.day <= end.toordinal())
+        .group_by(rollup.teacher_id)
+        .order_by(rollup.teacher_id)
+    )
+
+    if teacher_id is not None:
+        stmt = stmt.where(rollup.teacher_id == teacher_id)
+
+    rows = []
+
+    for row in await db.execute(stmt):
+        totals = row._asdict()
+        responded = totals["responded"]
+        total_ms = totals.pop("response_ms_total")
+        totals["response_ms_avg"] = total_ms // responded if responded else None
+        totals["unanswered"] = max(totals["notified"] - responded, 0)
+        rows.append(totals)
+
+    return rows
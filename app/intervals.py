@@ -0,0 +1,99 @@
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+
+def duration(start: time, end: time) -> timedelta:
+    return datetime.combine(date.min, end) - datetime.combine(date.min, start)
+
+
+@dataclass(frozen=True)
+class Interval:
+    start: time
+    end: time
+    ident: Hashable = None
+
+
+def _start(interval: Interval) -> time:
+    return interval.start
+
+
+class IntervalIndex:
+    """
+    Half-open [start, end) intervals for one key (a teacher's or a class's
+    weekday), kept sorted by start. Back-to-back slots do not overlap.
+
+    Any interval overlapping [start, end) begins before `end` and no earlier
+    than `start - longest`, so a lookup is one bisect plus a walk over that
+    window instead of a scan.
+    """
+    def __init__(self, intervals: Iterable[Interval] = ()):
+        self.items: List[Interval] = sorted(intervals, key=_start)
+        self.longest = max((duration(i.start, i.end) for i in self.items), default=timedelta(0))
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def overlapping(self, start: time, end: time, ignore: Hashable = None) -> List[Interval]:
+        hits = []
+        upper = bisect_left(self.items, end, key=_start)
+
+        for index in range(upper - 1, -1, -1):
+            item = self.items[index]
+
+            if duration(item.start, start) > self.longest:
+                break
+
+            if item.end > start and (ignore is None or item.ident != ignore):
+                hits.append(item)
+
+        return hits
+
+    def containing(self, moment: time) -> List[Interval]:
+        hits = []
+        upper = bisect_right(self.items, moment, key=_start)
+
+        for index in range(upper - 1, -1, -1):
+            item = self.items[index]
+
+            if duration(item.start, moment) > self.longest:
+                break
+
+            if item.end > moment:
+                hits.append(item)
+
+        return hits
+
+    def first_after(self, moment: time | None = None) -> Interval | None:
+        """The earliest interval starting strictly after `moment`, or the first of the day."""
+        index = 0 if moment is None else bisect_right(self.items, moment, key=_start)
+        return self.items[index] if index < len(self.items) else None
+
+    def add(self, interval: Interval):
+        insort(self.items, interval, key=_start)
+        self.longest = max(self.longest, duration(interval.start, interval.end))
+
+    def remove(self, ident: Hashable) -> bool:
+        for index, item in enumerate(self.items):
+            if item.ident == ident:
+                del self.items[index]
+                return True
+
+        return False
+
+
+def find_conflicts(keyed: Iterable[Tuple[Hashable, Interval]]) -> List[Tuple[Hashable, Interval, Interval]]:
+    """Every overlapping pair among (key, interval) entries, checked key by key."""
+    indexes: Dict[Hashable, IntervalIndex] = {}
+    conflicts = []
+
+    for key, interval in keyed:
+        index = indexes.setdefault(key, IntervalIndex())
+
+        for other in index.overlapping(interval.start, interval.end):
+            conflicts.append((key, other, interval))
+
+        index.add(interval)
+
+    return conflicts
@@ -1,64 +1,44 @@
 import asyncio
 from datetime import datetime, timedelta
-from firebase_admin import messaging
+from typing import Dict, List
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from fastapi.middleware.cors import CORSMiddleware
 
 from contextlib import asynccontextmanager
-from hashlib import sha256
 from fastapi import FastAPI, HTTPException, status
-from sqladmin import Admin
 from sqlalchemy import select
 
-from app.enums import Availability, WeekDays
-from app.utils import verify_fcm_token
+from app.enums import Availability
 
-from .admin_auth import AdminAuth
+from . import announcements, api, backup, blobs, changes, drain, history, models, outbox, presence, profiling, roundtrip, schemas, tablets, tenancy
+from .database import AsyncSessionLocal, check_engine_cap, dispose_engines, get_async_session, init_db
 
-from . import api, models, schemas
-from .database import AsyncSessionLocal, get_async_session, init_db, engine
-
-from . import globals
-
-import firebase_admin
-from firebase_admin import credentials
+from . import sse
+from .compression import CompressionMiddleware
+from .profiling import ProfilingMiddleware
+from .tenancy import TenantMiddleware
+from .schoolcalendar import school_calendar, school_now
+from .timetable import timetable
 
 scheduler = AsyncIOScheduler(timezone='UTC')
 
-cred = credentials.Certificate(".firebaseServiceKey.json")
-firebase_admin.initialize_app(cred)
-
-SESSION_SECRET_KEY = sha256(b'secret_key').hexdigest()
-
 async def schedule_job():
     async with AsyncSessionLocal() as session:
-        now = datetime.now()
-
-        str_week_map = {
-            "SUNDAY": -1,
-            "MONDAY": WeekDays.Monday,
-            "TUESDAY": WeekDays.Tuesday,
-            "WEDNESDAY": WeekDays.Wednesday,
-            "THURSDAY": WeekDays.Thursday,
-            "FRIDAY": WeekDays.Friday,
-            "SATURDAY": -1 
-        }
-
-        current_weekday = now.strftime('%A').upper() 
-        current_time = now.time().replace(second=0, microsecond=0)
-        five_mins_from_now = (datetime.combine(now, current_time) + timedelta(minutes=5)).time()
+        await timetable.ensure_loaded(session)
+        await school_calendar.ensure_loaded(session)
 
-        if current_weekday == "SATURDAY" or current_weekday == "SUNDAY":
-            return
+        now = school_now()
+        today = school_calendar.occurrences(now.date())
 
-        query_now = await session.execute(select(models.Schedule).where(models.Schedule.time_in == current_time, models.Schedule.weekday == str_week_map[current_weekday]))
-        query_5mfn = await session.execute(select(models.Schedule).where(models.Schedule.time_in == five_mins_from_now, models.Schedule.weekday == str_week_map[current_weekday]))
-        query_endclass = await session.execute(select(models.Schedule).where(models.Schedule.time_out == current_time, models.Schedule.weekday == str_week_map[current_weekday]))
+        # Weekend, holiday or suspension
+        if today is None:
+            return
 
-        print(f"\n\n\n\n\n{current_time}\n\n\n\n\n")
+        current_time = now.time().replace(second=0, microsecond=0)
+        five_mins_from_now = (datetime.combine(now, current_time) + timedelta(minutes=5)).time()
 
-        for s in query_endclass.scalars().all():
+        for s in today.ends.get(current_time, ()):
             teacher = await session.get(models.Teacher, s.teacher_id)
             assert teacher
 
@@ -66,26 +46,9 @@ async def schedule_job():
 
             if teacher.availability == Availability.InClass:
                 teacher.availability = Availability.Available
-                await session.refresh(teacher)
-
-                payloadTeacher = {
-                    "event": "switchAvailability",
-                    "self.availability": Availability.Available.value,
-                    "availability": Availability.Available.value
-                }
-
-                payloadKiosk = {
-                    "event": "reload",
-                    "teacher_id": teacher.id,
-                }
-
-                for t in globals.SSE_TABLET_CONNECTIONS.values():
-                    await t.put(payloadKiosk)
+                await session.flush()
 
-                if teacher.id in globals.SSE_TEACHER_CONNECTIONS:
-                    await globals.SSE_TEACHER_CONNECTIONS[teacher.id].put(payloadTeacher)
-
-        for s in query_now.scalars().all():
+        for s in today.starts.get(current_time, ()):
             teacher = await session.get(models.Teacher, s.teacher_id)
             assert teacher
 
@@ -93,26 +56,12 @@ async def schedule_job():
 
             if teacher.availability != Availability.Absent:
                 teacher.availability = Availability.DoNotDisturb if s.is_break else Availability.InClass
-                await session.refresh(teacher)
-
-                payloadTeacher = {
-                    "event": "switchAvailability",
-                    "self.availability": teacher.availability.value,
-                    "availability": teacher.availability.value
-                }
-
-                payloadKiosk = {
-                    "event": "reload",
-                    "teacher_id": teacher.id,
-                }
-
-                for t in globals.SSE_TABLET_CONNECTIONS.values():
-                    await t.put(payloadKiosk)
+                await session.flush()
 
-                if teacher.id in globals.SSE_TEACHER_CONNECTIONS:
-                    await globals.SSE_TEACHER_CONNECTIONS[teacher.id].put(payloadTeacher)
+        for s in today.starts.get(five_mins_from_now, ()):
+            if s.class_id is None:
+                continue
 
-        for s in query_5mfn.scalars().all():
             teacher = await session.get(models.Teacher, s.teacher_id)
             class_ = await session.get(models.SchoolClass, s.class_id)
             assert teacher
@@ -121,61 +70,141 @@ async def schedule_job():
                 continue
 
             if teacher.firebase_token and teacher.availability != Availability.Absent:
-                print("Firebase Token Validation: ", await verify_fcm_token(teacher.firebase_token))
-                try:
-                    message = messaging.Message(
-                        notification=messaging.Notification(
-                            title="Class in 5 minutes!",
-                            body=f"You have a subject ({s.subject}) in {class_.name}. You have 5 minutes to prepare.",
-                        ),
-                        token=teacher.firebase_token,
-                        android=messaging.AndroidConfig(
-                            priority="high",
-                            notification=messaging.AndroidNotification(
-                                title="Class in 5 minutes!",
-                                body=f"You have a subject ({s.subject}) in {class_.name}. You have 5 minutes to prepare.",
-                                channel_id="critical_alerts",
-                                sound="alert_sound",
-                            ),
-                        ),
-                        apns=messaging.APNSConfig(
-                            payload=messaging.APNSPayload(
-                                aps=messaging.Aps(
-                                    sound=messaging.CriticalSound(
-                                        name="alert_sound.caf", 
-                                        critical=True, 
-                                        volume=1.0
-                                    ),
-                                    category="RESPOND_CATEGORY", 
-                                ),
-                            ),
-                        ),
-                    )
-                    
-                    response = await asyncio.to_thread(messaging.send, message)
-                    print(response)
-                except Exception as e:
-                    print(f"FCM Error: {e}")
-                    print(f"Token: {teacher.firebase_token}")
-
+                await outbox.enqueue(
+                    session,
+                    idempotency_key=f"class-reminder:{s.id}:{now.date().isoformat()}",
+                    token=teacher.firebase_token,
+                    title="Class in 5 minutes!",
+                    body=f"You have a subject ({s.subject}) in {class_.name}. You have 5 minutes to prepare.",
+                    teacher_id=teacher.id,
+                )
+
+        # Teachers and kiosks hear about the availability changes from app.changes
         await session.commit()
+        outbox.wake()
+
+async def start_tenant() -> List[asyncio.Task]:
+    """Prepares the current tenant's database and caches and starts its loops."""
+    await init_db()
+
+    moved = await blobs.migrate_images()
+    if moved:
+        print(f"Moved {moved} images to {blobs.blob_dir()}")
+
+        # Not vacuumed here: it locks the whole database while the other workers start
+        tenant = tenancy.current()
+        option = f"--tenant {tenant.name} " if tenancy.MULTI_TENANT else ""
+        print(
+            f"{await blobs.free_bytes() / 2**20:.1f} MB of {tenant.database_path} is now unused. "
+            f"Run `python -m app.cli {option}migrate-images --vacuum` at a quiet time to give it back."
+        )
+
+    async with AsyncSessionLocal() as session:
+        # Taken before loading, so nothing committed in between is missed
+        changes_since = await changes.latest_id(session)
+        await timetable.ensure_loaded(session)
+        await school_calendar.ensure_loaded(session)
+
+    # Tasks keep the tenant they are created under
+    return [
+        asyncio.create_task(sse.heartbeat_loop()),
+        asyncio.create_task(outbox.drain_loop()),
+        asyncio.create_task(roundtrip.expire_loop()),
+        asyncio.create_task(changes.poll_loop(changes_since)),
+        asyncio.create_task(presence.flush_loop()),
+    ]
+
+async def stop_tenant(tasks: List[asyncio.Task]):
+    for task in tasks:
+        task.cancel()
+
+    await backup.backups.stop()
+    await announcements.interrupt()
+    await presence.clear()
+    await history.flush()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await init_db()
+    tenant_tasks: Dict[tenancy.Tenant, List[asyncio.Task]] = {}
+
+    check_engine_cap()
+
+    for tenant in tenancy.all_tenants():
+        with tenancy.use(tenant):
+            tenant_tasks[tenant] = await start_tenant()
+
+    drain.install()
 
     scheduler.start()
     scheduler.add_job(
-        func=schedule_job, 
+        func=profiling.job(tenancy.each(schedule_job)),
         trigger=IntervalTrigger(minutes=1, start_date=datetime.now()),
         id="main_sync_task",
         replace_existing=True
     )
+    scheduler.add_job(
+        func=profiling.job(tenancy.each(outbox.prune_sent)),
+        trigger=IntervalTrigger(hours=6),
+        id="outbox_prune",
+        replace_existing=True
+    )
+    scheduler.add_job(
+        func=profiling.job(tenancy.each(history.flush)),
+        trigger=IntervalTrigger(seconds=history.FLUSH_INTERVAL),
+        id="history_flush",
+        replace_existing=True
+    )
+    scheduler.add_job(
+        func=profiling.job(tenancy.each(announcements.prune)),
+        trigger=IntervalTrigger(hours=6),
+        id="announcement_prune",
+        replace_existing=True
+    )
+    scheduler.add_job(
+        func=profiling.job(tenancy.each(history.prune)),
+        trigger=IntervalTrigger(days=1),
+        id="history_prune",
+        replace_existing=True
+    )
+    scheduler.add_job(
+        func=profiling.job(tenancy.each(tablets.flush_last_seen)),
+        trigger=IntervalTrigger(minutes=1),
+        id="tablet_last_seen",
+        replace_existing=True
+    )
+    scheduler.add_job(
+        func=profiling.job(tenancy.each(changes.prune)),
+        trigger=IntervalTrigger(hours=1),
+        id="change_log_prune",
+        replace_existing=True
+    )
+    scheduler.add_job(
+        func=profiling.job(tenancy.each(blobs.prune)),
+        trigger=IntervalTrigger(days=1),
+        id="blob_prune",
+        replace_existing=True
+    )
+
+    scheduler.add_job(
+        func=profiling.job(tenancy.each(backup.scheduled_backup)),
+        trigger=IntervalTrigger(minutes=backup.CHECK_INTERVAL_MINUTES),
+        id="database_backup",
+        replace_existing=True
+    )
 
     yield
-    
+
+    # Streams are closed by now (drain.begin runs on the signal); let in-flight pushes go out
+    await drain.finish()
+
     scheduler.shutdown()
 
+    for tenant, tasks in tenant_tasks.items():
+        with tenancy.use(tenant):
+            await stop_tenant(tasks)
+
+    await dispose_engines()
+
 app = FastAPI(
     title = "TNS API",
     version = "0.1.0",
@@ -190,10 +219,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-admin = Admin(app, engine, authentication_backend=AdminAuth(secret_key=SESSION_SECRET_KEY))
-admin.add_view(models.SchoolClassAdmin)
-admin.add_view(models.ScheduleAdmin)
-admin.add_view(models.TeacherAdmin)
+app.add_middleware(CompressionMiddleware)
+
+# Times the response uncompressed, and runs with the tenant selected
+app.add_middleware(ProfilingMiddleware)
+
+# Outermost, everything below runs with the request's tenant selected
+app.add_middleware(TenantMiddleware)
+
+class LazyAdmin:
+    """
+    Mounted at /admin. The sqladmin app is built on the first request (or
+    the first `url_for('admin:...')`), so workers that only serve the API
+    never import it.
+    """
+    def __init__(self):
+        self._app = None
+
+    @property
+    def app(self):
+        if self._app is None:
+            from .admin import build_admin
+            self._app = build_admin()
+
+        return self._app
+
+    @property
+    def routes(self):
+        return self.app.routes
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+
+
+app.mount("/admin", LazyAdmin(), name="admin")
 
 app.include_router(api.router, tags=['API'], prefix='/api')
 
@@ -1,13 +1,10 @@
 from hashlib import sha256
 from typing import List
-from sqlalchemy.orm import Mapped, mapped_column, object_session, relationship
-from wtforms import EmailField, PasswordField
+from sqlalchemy.orm import Mapped, column_property, mapped_column, object_session, relationship
 from .database import Base
-from sqladmin import ModelView
-from datetime import time
-from sqlalchemy import Boolean, Enum, ForeignKey, Integer, LargeBinary, String, Time, event, select
-from .enums import WeekDays, Availability
-from . import globals as globs
+from datetime import date, datetime, time
+from sqlalchemy import Boolean, Date, DateTime, Enum, ForeignKey, Index, Integer, LargeBinary, SmallInteger, String, Text, Time, bindparam, event, exists
+from .enums import DayKind, OutboxStatus, WeekDays, Availability
 
 
 class ImageModel(Base):
@@ -26,7 +23,12 @@ class ImageModel(Base):
         uselist=False
     )
 
-    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    # The image itself is in the blob store (app.blobs) under this hash
+    sha256: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    size: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+    # Legacy inline copy, emptied by blobs.migrate_images; NOT NULL in databases created before the blob store
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False, default=b'', deferred=True)
     mimetype: Mapped[str] = mapped_column(String(50), nullable=False)
     filename: Mapped[str] = mapped_column(String(255), nullable=False)
 
@@ -57,7 +59,7 @@ class Teacher(Base):
     prefix: Mapped[str] = mapped_column(String(5), default='', nullable=True)
     postfix: Mapped[str] = mapped_column(String(5), default='', nullable=True)
 
-    availability: Mapped[Availability] = mapped_column(Enum(Availability), default=Availability.Absent, nullable=False)
+    availability: Mapped[Availability] = mapped_column(Enum(Availability), default=Availability.Absent, nullable=False, index=True)
 
     main_subject: Mapped[str] = mapped_column(String(128), nullable=True)
 
@@ -82,14 +84,7 @@ class Teacher(Base):
 def hash_password_and_generate_token(mapper, connection, target: Teacher):
     cleartext_password = target.token
 
-    payload = {
-        "event": "reload",
-        "teacher_id": target.id,
-    }
-
-    # for t in globs.SSE_TABLET_CONNECTIONS.values():
-    #     t.put(payload)
-    
+    # Kiosks are told about the change by app.changes once it commits
     if cleartext_password and target._regenerate_token:
         source_string = f"{target.email_address}{cleartext_password}".encode('utf-8')
         target.token = sha256(source_string).hexdigest()
@@ -99,47 +94,186 @@ class Schedule(Base):
     __tablename__ = 'teacher_schedule'
     id: Mapped[int] = mapped_column(primary_key=True)
 
-    class_id: Mapped[int | None] = mapped_column(ForeignKey('school_class.id'), nullable=True)
-    teacher_id: Mapped[int] = mapped_column(ForeignKey('teacher.id'))
+    class_id: Mapped[int | None] = mapped_column(ForeignKey('school_class.id'), nullable=True, index=True)
+    teacher_id: Mapped[int] = mapped_column(ForeignKey('teacher.id'), index=True)
     subject: Mapped[str] = mapped_column(String(32))
  
     school_class = relationship("SchoolClass", back_populates="schedules")
     teacher = relationship("Teacher", back_populates="schedules")
 
-    weekday: Mapped[WeekDays] = mapped_column(Enum(WeekDays))
+    weekday: Mapped[WeekDays] = mapped_column(Enum(WeekDays), index=True)
     time_in: Mapped[time] = mapped_column(Time)
     time_out: Mapped[time] = mapped_column(Time)
 
     is_break: Mapped[bool] = mapped_column(Boolean)
 
 
-class SchoolClassAdmin(ModelView, model=SchoolClass):
-    column_list = [SchoolClass.id, SchoolClass.name, SchoolClass.grade]
+class CalendarException(Base):
+    """A date range that is off (holiday, suspension) or follows another weekday's timetable."""
+    __tablename__ = 'calendar_exception'
+    id: Mapped[int] = mapped_column(primary_key=True)
 
+    name: Mapped[str] = mapped_column(String(64))
+    kind: Mapped[DayKind] = mapped_column(Enum(DayKind))
 
-class TeacherAdmin(ModelView, model=Teacher):
-    column_list = [Teacher.id, Teacher.email_address, Teacher.full_name, Teacher.main_subject, Teacher.token]
-    form_columns = [
-        Teacher.full_name,
-        Teacher.email_address,
-        Teacher.token,
-        Teacher.postfix,
-        Teacher.prefix,
-        Teacher.main_subject,
-    ]
+    start_date: Mapped[date] = mapped_column(Date, index=True)
+    end_date: Mapped[date] = mapped_column(Date)
 
-    form_overrides = {
-        'token': PasswordField,
-        'email_address': EmailField
-    }
+    # Only for DayKind.Alternate
+    follows: Mapped[WeekDays | None] = mapped_column(Enum(WeekDays), nullable=True)
+
+    def __str__(self):
+        return self.name
 
-    form_args = {
-        'token': {
-            'label': 'Password'
-        }
-    }
+
+class TeacherEvent(Base):
+    """
+    Append-only teacher history, integer-coded to stay small. `day` is the
+    school-local date ordinal; queries and pruning go by whole days.
+    """
+    __tablename__ = 'teacher_event'
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    day: Mapped[int] = mapped_column(Integer)
+    at: Mapped[int] = mapped_column(Integer)
+    teacher_id: Mapped[int] = mapped_column(Integer)
+
+    # TeacherEventKind value
+    kind: Mapped[int] = mapped_column(SmallInteger)
+    # Availability value, or response latency in ms
+    value: Mapped[int] = mapped_column(Integer, default=0)
+
+    __table_args__ = (
+        Index('ix_teacher_event_day_teacher', 'day', 'teacher_id'),
+    )
 
 
-class ScheduleAdmin(ModelView, model=Schedule):
-    column_list = [Schedule.id, Schedule.subject, Schedule.school_class, Schedule.teacher, Schedule.weekday, Schedule.time_in, Schedule.time_out] # pyright: ignore
+class TeacherDailyRollup(Base):
+    """Per teacher per day totals, updated by every history flush."""
+    __tablename__ = 'teacher_daily_rollup'
+    day: Mapped[int] = mapped_column(Integer, primary_key=True)
+    teacher_id: Mapped[int] = mapped_column(Integer, primary_key=True)
 
+    # Times the teacher entered each state
+    available: Mapped[int] = mapped_column(Integer, default=0)
+    do_not_disturb: Mapped[int] = mapped_column(Integer, default=0)
+    in_class: Mapped[int] = mapped_column(Integer, default=0)
+    absent: Mapped[int] = mapped_column(Integer, default=0)
+
+    notified: Mapped[int] = mapped_column(Integer, default=0)
+    responded: Mapped[int] = mapped_column(Integer, default=0)
+    response_ms_total: Mapped[int] = mapped_column(Integer, default=0)
+    response_ms_max: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class Tablet(Base):
+    __tablename__ = 'tablet'
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    session: Mapped[str] = mapped_column(String(64), unique=True, index=True)
+
+    label: Mapped[str] = mapped_column(String(64), nullable=True)
+    location: Mapped[str] = mapped_column(String(128), nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    last_seen: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+    def __str__(self):
+        return self.label or self.session
+
+
+class NotificationOutbox(Base):
+    """
+    Push notifications written in the same transaction as the change that
+    caused them, and delivered by `app.outbox.drain_loop`.
+    """
+    __tablename__ = 'notification_outbox'
+    __table_args__ = (
+        Index('ix_notification_outbox_due', 'status', 'next_attempt_at'),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    idempotency_key: Mapped[str] = mapped_column(String(128), unique=True)
+    teacher_id: Mapped[int | None] = mapped_column(ForeignKey('teacher.id', ondelete='SET NULL'), nullable=True)
+
+    token: Mapped[str] = mapped_column(String(256))
+    title: Mapped[str] = mapped_column(String(128))
+    body: Mapped[str] = mapped_column(String(512))
+    data: Mapped[str] = mapped_column(Text, nullable=True)
+
+    status: Mapped[OutboxStatus] = mapped_column(Enum(OutboxStatus), default=OutboxStatus.Pending)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    sent_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+
+class Announcement(Base):
+    """
+    An announcement job and its progress, so any worker can answer
+    `/announce/{job_id}` and the results survive a restart.
+    """
+    __tablename__ = 'announcement'
+    id: Mapped[str] = mapped_column(String(16), primary_key=True)
+
+    title: Mapped[str] = mapped_column(Text)
+    body: Mapped[str] = mapped_column(Text)
+
+    status: Mapped[str] = mapped_column(String(16), default="queued")
+    total: Mapped[int] = mapped_column(Integer, default=0)
+    processed: Mapped[int] = mapped_column(Integer, default=0)
+    # pid of the worker sending it
+    origin: Mapped[int] = mapped_column(Integer)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, index=True)
+    finished_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+
+class AnnouncementRecipient(Base):
+    __tablename__ = 'announcement_recipient'
+    announcement_id: Mapped[str] = mapped_column(ForeignKey('announcement.id', ondelete='CASCADE'), primary_key=True)
+    # Not a foreign key: the result outlives a deleted teacher
+    teacher_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    sse: Mapped[bool] = mapped_column(Boolean, default=False)
+    push: Mapped[str] = mapped_column(String(16), nullable=True)
+    error: Mapped[str] = mapped_column(Text, nullable=True)
+
+
+class ChangeLog(Base):
+    """
+    Teacher, schedule, class and calendar changes, one row per flush, so
+    every worker can update its caches and its own SSE clients.
+    """
+    __tablename__ = 'change_log'
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    # pid of the worker that committed it, which has already applied it
+    origin: Mapped[int] = mapped_column(Integer)
+    data: Mapped[str] = mapped_column(Text)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, index=True)
+
+
+class TeacherPresence(Base):
+    """
+    Teachers with an open SSE/WebSocket stream, one row per worker holding
+    them, refreshed by `app.presence`. A row whose worker died expires.
+    """
+    __tablename__ = 'teacher_presence'
+    teacher_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    origin: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    devices: Mapped[int] = mapped_column(Integer, default=0)
+    expires_at: Mapped[int] = mapped_column(Integer)
+
+
+# "now" is bound per query, it is not frozen into the cached statement
+Teacher.online = column_property(
+    exists().where(
+        TeacherPresence.teacher_id == Teacher.id,
+        TeacherPresence.expires_at > bindparam("presence_now", callable_=lambda: int(datetime.now().timestamp())),
+    )
+)
@@ -0,0 +1,206 @@
+"""
+Transactional outbox for FCM pushes.
+
+Callers `enqueue` a row inside the same session that commits the state
+change, then `wake()` the drainer. Rows are claimed atomically, so every
+worker can run a drainer, and the unique idempotency key means a reminder
+that every worker's scheduler generates is only sent once.
+"""
+import asyncio
+import json
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from sqlalchemy import bindparam, delete, or_, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, push
+from .database import AsyncSessionLocal
+from .enums import OutboxStatus
+from .roundtrip import round_trips
+from .tenancy import TenantLocal
+from .utils import build_alert_message
+
+# send_each accepts at most 500 messages
+BATCH_SIZE = 500
+POLL_INTERVAL = 5
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 2
+BACKOFF_MAX = 15 * 60
+# A claimed row whose worker died is retried after this long
+CLAIM_TIMEOUT = 60
+SENT_RETENTION = timedelta(days=7)
+
+_wakeup = TenantLocal(asyncio.Event)
+
+
+def permanent_errors(messaging) -> tuple:
+    """Errors that retrying cannot fix."""
+    return (messaging.UnregisteredError, messaging.SenderIdMismatchError, ValueError)
+
+
+async def enqueue(
+    db: AsyncSession,
+    idempotency_key: str,
+    token: str,
+    title: str,
+    body: str,
+    data: Dict[str, str] | None = None,
+    teacher_id: int | None = None,
+):
+    """Adds a push to the caller's transaction; duplicates of an existing key are ignored."""
+    stmt = insert(models.NotificationOutbox).values(
+        idempotency_key=idempotency_key,
+        teacher_id=teacher_id,
+        token=token,
+        title=title,
+        body=body,
+        data=json.dumps(data) if data else None,
+        status=OutboxStatus.Pending,
+        attempts=0,
+        next_attempt_at=datetime.now(),
+        created_at=datetime.now(),
+    ).on_conflict_do_nothing(index_elements=['idempotency_key'])
+
+    await db.execute(stmt)
+
+
+def wake():
+    _wakeup.set()
+
+
+def backoff(attempts: int) -> timedelta:
+    delay = min(BACKOFF_MAX, BACKOFF_BASE ** attempts)
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+async def _claim(db: AsyncSession) -> list:
+    now = datetime.now()
+    outbox = models.NotificationOutbox
+
+    due = (
+        select(outbox.id)
+        .where(
+            or_(outbox.status == OutboxStatus.Pending, outbox.status == OutboxStatus.Sending),
+            outbox.next_attempt_at <= now,
+        )
+        .order_by(outbox.next_attempt_at)
+        .limit(BATCH_SIZE)
+    )
+
+    result = await db.execute(
+        update(outbox)
+        .where(outbox.id.in_(due.scalar_subquery()), outbox.next_attempt_at <= now)
+        .values(
+            status=OutboxStatus.Sending,
+            attempts=outbox.attempts + 1,
+            next_attempt_at=now + timedelta(seconds=CLAIM_TIMEOUT),
+        )
+        .returning(outbox.id, outbox.token, outbox.title, outbox.body, outbox.data, outbox.attempts)
+        .execution_options(synchronize_session=False)
+    )
+    rows = result.all()
+    await db.commit()
+
+    return rows
+
+
+async def drain_once() -> int:
+    """Sends one batch of due notifications; returns how many were claimed."""
+    try:
+        messaging = push.get_messaging()
+    except push.PushUnavailable:
+        # Left pending for a worker that can send them
+        return 0
+
+    async with AsyncSessionLocal() as db:
+        rows = await _claim(db)
+
+        if not rows:
+            return 0
+
+        data = [json.loads(row.data) if row.data else None for row in rows]
+        messages = [
+            build_alert_message(row.title, row.body, row.token, payload)
+            for row, payload in zip(rows, data)
+        ]
+
+        try:
+            response = await asyncio.to_thread(messaging.send_each, messages)
+            results = [(r.success, r.exception) for r in response.responses]
+        except Exception as e:
+            print(f"FCM Error: {e}")
+            results = [(False, e)] * len(rows)
+
+        now = datetime.now()
+        sent: List[Dict[str, Any]] = []
+        failed: List[Dict[str, Any]] = []
+
+        for row, payload, (success, exception) in zip(rows, data, results):
+            if success:
+                sent.append({"b_id": row.id})
+
+                if payload and "request_id" in payload:
+                    round_trips.mark_pushed(payload["request_id"])
+                continue
+
+            dead = isinstance(exception, permanent_errors(messaging)) or row.attempts >= MAX_ATTEMPTS
+            failed.append({
+                "b_id": row.id,
+                "b_status": OutboxStatus.Dead if dead else OutboxStatus.Pending,
+                "b_next": now + backoff(row.attempts),
+                "b_error": str(exception),
+            })
+
+        table = models.NotificationOutbox.__table__
+        conn = await db.connection()
+
+        if sent:
+            await conn.execute(
+                update(table)
+                .where(table.c.id == bindparam("b_id"))
+                .values(status=OutboxStatus.Sent, sent_at=now, last_error=None),
+                sent,
+            )
+
+        if failed:
+            await conn.execute(
+                update(table)
+                .where(table.c.id == bindparam("b_id"))
+                .values(status=bindparam("b_status"), next_attempt_at=bindparam("b_next"), last_error=bindparam("b_error")),
+                failed,
+            )
+
+        await db.commit()
+
+    return len(rows)
+
+
+async def prune_sent():
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            delete(models.NotificationOutbox)
+            .where(
+                models.NotificationOutbox.status == OutboxStatus.Sent,
+                models.NotificationOutbox.sent_at < datetime.now() - SENT_RETENTION,
+            )
+        )
+        await db.commit()
+
+
+async def drain_loop():
+    while True:
+        _wakeup.clear()
+
+        try:
+            while await drain_once() == BATCH_SIZE:
+                pass
+        except Exception as e:
+            print(f"Outbox drain failed: {e}")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
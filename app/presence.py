@@ -0,0 +1,121 @@
+"""
+Teacher devices and presence.
+
+A teacher can have the app open on several devices at once, each with its
+own SSE or WebSocket stream. `globals.SSE_TEACHER_CONNECTIONS` maps a
+teacher to their devices by device id, so `sse.publish_teacher` reaches
+all of them and one device disconnecting leaves the others registered.
+
+Whether a teacher is reachable over a stream is shared with the other
+workers through `teacher_presence`: every worker keeps one row per teacher
+it holds streams for, rewritten when a teacher's first device connects or
+last one leaves and refreshed before it expires. `Teacher.online` reads it,
+so kiosks can tell from `/teacherList` whether a notify goes out live or
+only as a push.
+"""
+import asyncio
+import time
+
+from dataclasses import dataclass, field
+from secrets import token_hex
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import globals, models
+from .changes import ORIGIN
+from .database import AsyncSessionLocal
+from .tenancy import TenantLocal
+
+# A worker's rows count for this long after their last refresh
+PRESENCE_TTL = 60
+REFRESH_INTERVAL = 20
+
+_wakeup = TenantLocal(asyncio.Event)
+
+
+@dataclass(eq=False)
+class TeacherDevice:
+    teacher_id: int
+    device_id: str
+    transport: str
+    queue: asyncio.Queue[bytes] = field(default_factory=asyncio.Queue)
+    connected_at: float = field(default_factory=time.time)
+
+
+def connect(teacher_id: int, device_id: str | None, transport: str) -> TeacherDevice:
+    """Registers a stream; a device reconnecting with the same id replaces its old one."""
+    device = TeacherDevice(teacher_id, device_id or token_hex(8), transport)
+    devices = globals.SSE_TEACHER_CONNECTIONS.setdefault(teacher_id, {})
+
+    if not devices:
+        wake()
+
+    devices[device.device_id] = device
+    return device
+
+
+def disconnect(device: TeacherDevice):
+    devices = globals.SSE_TEACHER_CONNECTIONS.get(device.teacher_id)
+
+    if devices is None or devices.get(device.device_id) is not device:
+        return
+
+    del devices[device.device_id]
+
+    if not devices:
+        del globals.SSE_TEACHER_CONNECTIONS[device.teacher_id]
+        wake()
+
+
+def wake():
+    _wakeup.set()
+
+
+async def flush():
+    """Rewrites this worker's presence rows from the registry."""
+    expires_at = int(time.time()) + PRESENCE_TTL
+    rows = [
+        {"teacher_id": teacher_id, "origin": ORIGIN, "devices": len(devices), "expires_at": expires_at}
+        for teacher_id, devices in globals.SSE_TEACHER_CONNECTIONS.items()
+    ]
+
+    stmt = sqlite_insert(models.TeacherPresence)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.TeacherPresence.teacher_id, models.TeacherPresence.origin],
+        set_={"devices": stmt.excluded.devices, "expires_at": stmt.excluded.expires_at},
+    )
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            delete(models.TeacherPresence)
+            .where(models.TeacherPresence.origin == ORIGIN)
+            .where(models.TeacherPresence.teacher_id.not_in([row["teacher_id"] for row in rows]))
+        )
+
+        if rows:
+            await db.execute(stmt, rows)
+
+        await db.commit()
+
+
+async def flush_loop(interval: float = REFRESH_INTERVAL):
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+        _wakeup.clear()
+
+        try:
+            await flush()
+        except Exception as e:
+            print(f"Presence flush failed: {e}")
+
+
+async def clear():
+    """Drops this worker's rows on shutdown instead of letting them expire."""
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(models.TeacherPresence).where(models.TeacherPresence.origin == ORIGIN))
+        await db.commit()
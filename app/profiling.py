@@ -0,0 +1,380 @@
+"""
+On-demand profiling and slow request capture.
+
+An admin can profile the next requests to a route (`POST /api/profile/requests`)
+or the next run of a scheduler job (`POST /api/profile/job`). While a
+profile is armed, a thread samples the event loop every SAMPLE_INTERVAL_MS
+and records the stack of each profiled task:
+
+- the frames running on the loop when the task is the one running,
+- otherwise the chain of awaits it is suspended on, ending in an
+  `(await)` frame, so database and push waits show up too.
+
+Tasks a profiled task creates (spawned notifies, tenants gathered by
+`tenancy.each`) are profiled with it. The result is in collapsed-stack
+format, one `frame;frame;frame count` line per stack, which flamegraph.pl,
+inferno and speedscope read as is. Code run through asyncio.to_thread is
+not sampled.
+
+Every HTTP request also collects the SQL it runs. Requests slower than
+SLOW_REQUEST_MS are kept with their statements and timings, the last
+SLOW_BUFFER_SIZE of them, and are listed under "Slow Requests" in the
+admin. Parameters are not kept, they can hold tokens.
+
+Both are per worker: a profile only sees the traffic of the worker the
+admin call lands on, and the admin page shows that worker's slow requests.
+"""
+import asyncio
+import itertools
+import os
+import re
+import sys
+import threading
+import time
+
+from collections import Counter, deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Callable, Deque, List, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import tenancy
+
+SAMPLE_INTERVAL_MS = 5
+PROFILE_TIMEOUT = 60
+MAX_PROFILE_REQUESTS = 100
+
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "500"))
+SLOW_BUFFER_SIZE = 200
+# Per request; the count and total time still cover every statement
+MAX_STATEMENTS = 100
+
+# The profiling calls wait for their own profile, they are slow by design
+UNTRACKED_PREFIXES = ("/api/profile/",)
+
+
+def _label(frame) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}"
+
+
+def _running_stack(frame, root) -> List[str]:
+    """The loop thread's frames from the task's coroutine down, outermost first."""
+    stack = []
+
+    while frame is not None:
+        stack.append(_label(frame))
+
+        if frame is root:
+            break
+
+        frame = frame.f_back
+
+    stack.reverse()
+    return stack
+
+
+def _awaiting_stack(coro) -> List[str]:
+    """The awaits a suspended coroutine is waiting on, outermost first."""
+    stack = []
+    node = coro
+
+    while node is not None:
+        frame = getattr(node, "cr_frame", None) or getattr(node, "gi_frame", None) or getattr(node, "ag_frame", None)
+
+        if frame is None:
+            # A future (a query, a push, a sleep), or a coroutine that has finished
+            if stack:
+                stack.append("(await)")
+            break
+
+        stack.append(_label(frame))
+        node = getattr(node, "cr_await", None) or getattr(node, "gi_yieldfrom", None) or getattr(node, "ag_await", None)
+
+    return stack
+
+
+class Profile:
+    def __init__(self, interval_ms: float = SAMPLE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.tasks: Set[asyncio.Task] = set()
+        self.counts: Counter[str] = Counter()
+        self.samples = 0
+        self.completed = 0
+        self.done = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+
+    def track(self, task: asyncio.Task):
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def finished(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        self.completed += 1
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._loop_thread)
+            running = asyncio.current_task(self._loop)
+
+            # A tuple() of a set is taken under the GIL, the loop may add to it meanwhile
+            for task in tuple(self.tasks):
+                coro = task.get_coro()
+
+                if task is running and frame is not None:
+                    stack = _running_stack(frame, getattr(coro, "cr_frame", None))
+                else:
+                    stack = _awaiting_stack(coro)
+
+                if stack:
+                    self.counts[";".join(stack)] += 1
+
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+class RouteProfile(Profile):
+    def __init__(self, tenant: tenancy.Tenant, route: str, count: int, interval_ms: float = SAMPLE_INTERVAL_MS):
+        super().__init__(interval_ms)
+        self.tenant = tenant
+        self.count = count
+        # The route as in the OpenAPI schema, `{param}` matching one path segment
+        self.pattern = re.compile(
+            "^" + re.sub(r"\\\{[^/]*?\\\}", "[^/]+", re.escape(route.rstrip("/") or "/")) + "/?$"
+        )
+
+    def matches(self, path: str) -> bool:
+        return self.tenant is tenancy.current() and self.pattern.match(path) is not None
+
+    def finished(self, task: asyncio.Task):
+        super().finished(task)
+
+        if self.completed >= self.count:
+            self.done.set()
+
+
+class JobProfile(Profile):
+    def __init__(self, name: str, interval_ms: float = SAMPLE_INTERVAL_MS):
+        super().__init__(interval_ms)
+        self.name = name
+
+    def matches(self, job_name: str) -> bool:
+        return job_name == self.name or job_name.endswith("." + self.name)
+
+    def finished(self, task: asyncio.Task):
+        super().finished(task)
+        self.done.set()
+
+
+_profiles: List[Profile] = []
+_previous_factory: Callable | None = None
+
+
+def _task_factory(loop, coro, **kwargs):
+    if _previous_factory is not None:
+        task = _previous_factory(loop, coro, **kwargs)
+    else:
+        task = asyncio.Task(coro, loop=loop, **kwargs)
+
+    parent = asyncio.current_task(loop)
+
+    for profile in _profiles:
+        if parent in profile.tasks:
+            profile.track(task)
+
+    return task
+
+
+def _arm(profile: Profile):
+    global _previous_factory
+
+    loop = asyncio.get_running_loop()
+
+    # Only while profiling, so tasks are created the plain way otherwise
+    if not _profiles:
+        _previous_factory = loop.get_task_factory()
+        loop.set_task_factory(_task_factory)
+
+    _profiles.append(profile)
+    profile.start()
+
+
+def _disarm(profile: Profile):
+    profile.stop()
+    _profiles.remove(profile)
+
+    if not _profiles:
+        asyncio.get_running_loop().set_task_factory(_previous_factory)
+
+
+async def _run(profile: Profile, timeout: float) -> Profile:
+    _arm(profile)
+
+    try:
+        await asyncio.wait_for(profile.done.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        _disarm(profile)
+
+    return profile
+
+
+async def profile_requests(route: str, count: int, timeout: float = PROFILE_TIMEOUT, interval_ms: float = SAMPLE_INTERVAL_MS) -> Profile:
+    """Profiles the current tenant's next `count` requests to `route`, or what came within `timeout`."""
+    return await _run(RouteProfile(tenancy.current(), route, count, interval_ms), timeout)
+
+
+async def profile_job(name: str, timeout: float = PROFILE_TIMEOUT, interval_ms: float = SAMPLE_INTERVAL_MS) -> Profile:
+    """Profiles the next run of the scheduler job `name` (e.g. `schedule_job`), for every tenant."""
+    return await _run(JobProfile(name, interval_ms), timeout)
+
+
+def job(func: Callable) -> Callable:
+    """Wraps a scheduler job so `profile_job` can profile its next run."""
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @wraps(func)
+    async def run():
+        profiles = [profile for profile in _profiles if isinstance(profile, JobProfile) and profile.matches(name)]
+
+        if not profiles:
+            return await func()
+
+        task = asyncio.current_task()
+        assert task
+
+        for profile in profiles:
+            profile.track(task)
+
+        try:
+            return await func()
+        finally:
+            for profile in profiles:
+                profile.finished(task)
+
+    return run
+
+
+@dataclass
+class QueryLog:
+    statements: List[Tuple[str, float]] = field(default_factory=list)
+    count: int = 0
+    total_ms: float = 0
+
+    def add(self, statement: str, elapsed_ms: float):
+        self.count += 1
+        self.total_ms += elapsed_ms
+
+        if len(self.statements) < MAX_STATEMENTS:
+            self.statements.append((statement, elapsed_ms))
+
+
+@dataclass
+class SlowRequest:
+    id: int
+    at: datetime
+    tenant: str
+    method: str
+    path: str
+    status: int
+    duration_ms: float
+    queries: QueryLog
+
+
+_query_log: ContextVar[QueryLog | None] = ContextVar("query_log", default=None)
+_ids = itertools.count(1)
+
+SLOW_REQUESTS: Deque[SlowRequest] = deque(maxlen=SLOW_BUFFER_SIZE)
+
+
+# SQLAlchemy runs these in the calling task's context, the async engine included
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _query_log.get() is not None:
+        conn.info["query_started"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    log = _query_log.get()
+    started = conn.info.pop("query_started", None)
+
+    if log is not None and started is not None:
+        log.add(statement, (time.perf_counter() - started) * 1000)
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, slow_ms: float = SLOW_REQUEST_MS):
+        self.app = app
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(UNTRACKED_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        profiles = [
+            profile for profile in _profiles
+            if isinstance(profile, RouteProfile) and profile.matches(scope["path"])
+        ]
+        task = asyncio.current_task()
+        assert task
+
+        for profile in profiles:
+            profile.track(task)
+
+        log = QueryLog()
+        token = _query_log.set(log)
+        start = time.perf_counter()
+        status_code = 500
+        streaming = False
+
+        async def send_with_status(message):
+            nonlocal status_code, streaming
+
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                streaming = any(
+                    key == b"content-type" and value.startswith(b"text/event-stream")
+                    for key, value in message.get("headers", ())
+                )
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _query_log.reset(token)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+            for profile in profiles:
+                profile.finished(task)
+
+            # Event streams stay open for hours, that is not slowness
+            if elapsed_ms >= self.slow_ms and not streaming:
+                SLOW_REQUESTS.append(SlowRequest(
+                    next(_ids),
+                    datetime.now(timezone.utc),
+                    tenancy.current().name,
+                    scope["method"],
+                    scope["path"],
+                    status_code,
+                    elapsed_ms,
+                    log,
+                ))
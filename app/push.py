@@ -0,0 +1,50 @@
+"""
+Firebase Cloud Messaging, set up on first use.
+
+Importing firebase_admin.messaging (google-auth, the HTTP transport) and
+loading the service key used to happen when `app.main` was imported, in
+every worker. Now it happens the first time a push is actually sent, and a
+missing key file turns push off instead of stopping the server: pushes stay
+queued in the outbox until a worker with the key drains them.
+"""
+import os
+import threading
+
+from types import ModuleType
+
+FIREBASE_KEY_PATH = os.environ.get("FIREBASE_KEY_PATH", ".firebaseServiceKey.json")
+
+_lock = threading.Lock()
+_messaging: ModuleType | None = None
+
+
+class PushUnavailable(RuntimeError):
+    pass
+
+
+def enabled() -> bool:
+    return _messaging is not None or os.path.exists(FIREBASE_KEY_PATH)
+
+
+def get_messaging() -> ModuleType:
+    """`firebase_admin.messaging`, initializing the Firebase app on the first call."""
+    global _messaging
+
+    if _messaging is not None:
+        return _messaging
+
+    # Callers run in worker threads (asyncio.to_thread) as well as the loop
+    with _lock:
+        if _messaging is None:
+            if not os.path.exists(FIREBASE_KEY_PATH):
+                raise PushUnavailable(f"{FIREBASE_KEY_PATH} not found, push notifications are disabled")
+
+            import firebase_admin
+            from firebase_admin import credentials, messaging
+
+            if not firebase_admin._apps:
+                firebase_admin.initialize_app(credentials.Certificate(FIREBASE_KEY_PATH))
+
+            _messaging = messaging
+
+    return _messaging
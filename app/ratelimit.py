@@ -0,0 +1,134 @@
+"""
+In-memory limits for kiosk notifications.
+
+uvicorn workers do not share memory, and the kernel spreads requests across
+them, so each worker enforces 1/WORKERS of the configured budget. Together
+they approximate one shared limit without a round trip to a shared store.
+"""
+import math
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, Tuple
+
+from .tenancy import TenantLocal
+
+WORKERS = max(1, int(os.environ.get("WORKERS", "1")))
+
+# Repeated taps for the same teacher from the same kiosk within this window are folded into one
+COALESCE_SECONDS = 30.0
+
+# Burst size and sustained rate (tokens per second), across all workers
+TABLET_BURST = 6
+TABLET_RATE = 1 / 10
+TEACHER_BURST = 10
+TEACHER_RATE = 1 / 6
+
+PRUNE_EVERY = 1024
+
+
+@dataclass
+class TokenBucket:
+    capacity: float
+    rate: float
+    tokens: float = field(default=-1.0)
+    updated: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self):
+        if self.tokens < 0:
+            self.tokens = self.capacity
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def retry_after(self) -> float:
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+@dataclass
+class Decision:
+    allowed: bool
+    reason: str | None = None
+    retry_after: float = 0.0
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(math.ceil(self.retry_after))
+
+
+class NotifyLimiter:
+    def __init__(self, workers: int = WORKERS):
+        self.coalesce_seconds = COALESCE_SECONDS
+        self.tablet_burst = max(1.0, TABLET_BURST / workers)
+        self.tablet_rate = TABLET_RATE / workers
+        self.teacher_burst = max(1.0, TEACHER_BURST / workers)
+        self.teacher_rate = TEACHER_RATE / workers
+
+        self.last_sent: Dict[Tuple[str, int], float] = {}
+        self.tablets: Dict[str, TokenBucket] = {}
+        self.teachers: Dict[int, TokenBucket] = {}
+        self.checks = 0
+
+    def _bucket(self, buckets: Dict, key: Hashable, capacity: float, rate: float) -> TokenBucket:
+        bucket = buckets.get(key)
+
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(capacity, rate)
+
+        return bucket
+
+    def check(self, tablet_session: str, teacher_id: int) -> Decision:
+        now = time.monotonic()
+
+        self.checks += 1
+        if self.checks % PRUNE_EVERY == 0:
+            self.prune(now)
+
+        last = self.last_sent.get((tablet_session, teacher_id))
+        if last is not None and now - last < self.coalesce_seconds:
+            return Decision(False, "coalesced", self.coalesce_seconds - (now - last))
+
+        tablet = self._bucket(self.tablets, tablet_session, self.tablet_burst, self.tablet_rate)
+        teacher = self._bucket(self.teachers, teacher_id, self.teacher_burst, self.teacher_rate)
+        tablet.refill(now)
+        teacher.refill(now)
+
+        if tablet.tokens < 1:
+            return Decision(False, "tablet_rate_limited", tablet.retry_after())
+
+        if teacher.tokens < 1:
+            return Decision(False, "teacher_rate_limited", teacher.retry_after())
+
+        tablet.tokens -= 1
+        teacher.tokens -= 1
+        self.last_sent[(tablet_session, teacher_id)] = now
+
+        return Decision(True)
+
+    def forget(self, tablet_session: str, teacher_id: int):
+        """Undoes an allowed check whose notify reached nobody, so a retry goes through."""
+        self.last_sent.pop((tablet_session, teacher_id), None)
+
+        tablet = self.tablets.get(tablet_session)
+        if tablet is not None:
+            tablet.tokens = min(tablet.capacity, tablet.tokens + 1)
+
+        teacher = self.teachers.get(teacher_id)
+        if teacher is not None:
+            teacher.tokens = min(teacher.capacity, teacher.tokens + 1)
+
+    def prune(self, now: float):
+        """Drops state that no longer affects any decision, so memory tracks active kiosks only."""
+        self.last_sent = {
+            k: v for k, v in self.last_sent.items()
+            if now - v < self.coalesce_seconds
+        }
+        self.tablets = {k: b for k, b in self.tablets.items() if not b.full(now)}
+        self.teachers = {k: b for k, b in self.teachers.items() if not b.full(now)}
+
+
+notify_limiter = TenantLocal(NotifyLimiter)
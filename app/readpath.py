@@ -0,0 +1,182 @@
+"""
+ORM-free read path for the list endpoints.
+
+Selects plain column tuples and serializes them with TypeAdapters that are
+built once at import, straight to JSON bytes. No identity map, no model
+instances, and no response_model validation pass per row.
+"""
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Sequence
+
+from fastapi import HTTPException, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+from sqlalchemy import ColumnElement, Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas
+from .database import AsyncSessionLocal
+
+TEACHER_LIST = TypeAdapter(List[schemas.TeacherRow])
+SCHEDULE_LIST = TypeAdapter(List[schemas.ScheduleRow])
+SCHOOL_CLASS_LIST = TypeAdapter(List[schemas.SchoolClassRow])
+
+TEACHER_ROW = TypeAdapter(schemas.TeacherRow)
+SCHEDULE_ROW = TypeAdapter(schemas.ScheduleRow)
+
+MAX_PAGE_SIZE = 1000
+NDJSON_CHUNK = 500
+
+TEACHER_COLUMNS = (
+    models.Teacher.full_name,
+    models.Teacher.postfix,
+    models.Teacher.prefix,
+    models.Teacher.main_subject,
+    models.Teacher.availability,
+    models.Teacher.id,
+    models.Teacher.online,
+)
+
+SCHEDULE_COLUMNS = (
+    models.Schedule.class_id,
+    models.Schedule.teacher_id,
+    models.Schedule.subject,
+    models.Schedule.weekday,
+    models.Schedule.time_in,
+    models.Schedule.time_out,
+    models.Schedule.is_break,
+    models.Schedule.id,
+)
+
+SCHOOL_CLASS_COLUMNS = (
+    models.SchoolClass.id,
+    models.SchoolClass.name,
+    models.SchoolClass.grade,
+)
+
+
+class JSONBytesResponse(Response):
+    media_type = "application/json"
+
+
+@dataclass
+class ListQuery:
+    """Keyset pagination, projection and output format shared by the list endpoints."""
+    cursor: int | None = None
+    limit: int | None = None
+    fields: str | None = None
+    format: str = "json"
+
+
+@dataclass
+class ListSource:
+    columns: Sequence[Any]
+    id_column: Any
+    list_adapter: TypeAdapter
+    row_adapter: TypeAdapter
+
+    def project(self, fields: str | None) -> List[Any]:
+        if not fields:
+            return list(self.columns)
+
+        by_name = {column.key: column for column in self.columns}
+        wanted = {name.strip() for name in fields.split(",") if name.strip()}
+        unknown = wanted - by_name.keys()
+
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+            )
+
+        # id is always returned, it is the pagination cursor
+        wanted.add("id")
+        return [column for column in self.columns if column.key in wanted]
+
+    def statement(self, query: ListQuery, filters: Dict[ColumnElement, Any]) -> Select:
+        stmt = select(*self.project(query.fields)).order_by(self.id_column)
+
+        for column, value in filters.items():
+            if value is not None:
+                stmt = stmt.where(column == value)
+
+        if query.cursor is not None:
+            stmt = stmt.where(self.id_column > query.cursor)
+
+        if query.limit is not None:
+            stmt = stmt.limit(min(max(query.limit, 1), MAX_PAGE_SIZE))
+
+        return stmt
+
+    async def respond(self, db: AsyncSession, query: ListQuery, filters: Dict[ColumnElement, Any]) -> Response:
+        stmt = self.statement(query, filters)
+
+        if query.format == "ndjson":
+            return StreamingResponse(self._ndjson(stmt), media_type="application/x-ndjson")
+
+        if query.format != "json":
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="format must be json or ndjson")
+
+        rows = await fetch_rows(db, stmt)
+        headers = {}
+
+        if query.limit is not None and len(rows) == min(max(query.limit, 1), MAX_PAGE_SIZE):
+            headers["X-Next-Cursor"] = str(rows[-1]["id"])
+
+        return JSONBytesResponse(self.list_adapter.dump_json(rows), headers=headers)
+
+    async def _ndjson(self, stmt: Select) -> AsyncIterator[bytes]:
+        # Own session: the request's session is closed once the endpoint returns
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(stmt)
+
+            async for chunk in result.partitions(NDJSON_CHUNK):
+                yield b"".join(self.row_adapter.dump_json(row._asdict()) + b"\n" for row in chunk)
+
+
+def enum_filter(enum_cls, value: int | None):
+    if value is None:
+        return None
+
+    try:
+        return enum_cls(value)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid {enum_cls.__name__} value")
+
+
+async def fetch_rows(db: AsyncSession, stmt: Select) -> List[dict]:
+    result = await db.execute(stmt)
+    return [row._asdict() for row in result]
+
+
+TEACHERS = ListSource(TEACHER_COLUMNS, models.Teacher.id, TEACHER_LIST, TEACHER_ROW)
+SCHEDULES = ListSource(SCHEDULE_COLUMNS, models.Schedule.id, SCHEDULE_LIST, SCHEDULE_ROW)
+
+
+def teachers_query() -> Select:
+    return select(*TEACHER_COLUMNS).order_by(models.Teacher.id)
+
+
+def schedules_query() -> Select:
+    return select(*SCHEDULE_COLUMNS).order_by(models.Schedule.id)
+
+
+def school_classes_query() -> Select:
+    return select(*SCHOOL_CLASS_COLUMNS).order_by(models.SchoolClass.id)
+
+
+async def teacher_list_json(db: AsyncSession) -> bytes:
+    return TEACHER_LIST.dump_json(await fetch_rows(db, teachers_query()))
+
+
+async def schedule_list_json(db: AsyncSession, teacher_id: int | None = None) -> bytes:
+    stmt = schedules_query()
+
+    if teacher_id is not None:
+        stmt = stmt.where(models.Schedule.teacher_id == teacher_id)
+
+    return SCHEDULE_LIST.dump_json(await fetch_rows(db, stmt))
+
+
+async def school_class_list_json(db: AsyncSession) -> bytes:
+    return SCHOOL_CLASS_LIST.dump_json(await fetch_rows(db, school_classes_query()))
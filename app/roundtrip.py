@@ -0,0 +1,189 @@
+"""
+Kiosk notify -> teacher -> respond round trips.
+
+Every delivered notify opens a `PendingRequest` with a request_id that is
+carried in the SSE/WebSocket frame and the FCM data, and echoed back by
+`/respond`. Requests nobody answers within ANSWER_TIMEOUT are expired and
+the kiosk gets a `noAnswer` event. Latencies are kept per delivery path so
+the SSE and push paths can be compared from `/metrics/roundtrip`.
+
+Pending requests live in the worker that accepted the notify; a response
+that lands on another worker is still delivered, it just is not timed.
+"""
+import asyncio
+import time
+
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from secrets import token_hex
+from typing import Dict, List, Tuple
+
+from . import globals, history, sse
+from .tenancy import TenantLocal
+
+ANSWER_TIMEOUT = 120
+EXPIRE_INTERVAL = 5
+
+# Upper bounds in ms; the last bucket catches everything slower
+LATENCY_BUCKETS = (250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000)
+
+
+def new_request_id() -> str:
+    return "NREQ_" + token_hex(8)
+
+
+@dataclass
+class LatencyStats:
+    count: int = 0
+    total_ms: float = 0
+    max_ms: float = 0
+    buckets: List[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+
+    def add(self, ms: float):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.buckets[bisect_left(LATENCY_BUCKETS, ms)] += 1
+
+    def percentile(self, fraction: float) -> int | None:
+        """Upper bound of the bucket holding the given fraction of samples."""
+        if not self.count:
+            return None
+
+        wanted = fraction * self.count
+        seen = 0
+
+        for bound, hits in zip((*LATENCY_BUCKETS, None), self.buckets):
+            seen += hits
+            if seen >= wanted:
+                return min(bound, round(self.max_ms)) if bound is not None else round(self.max_ms)
+
+        return round(self.max_ms)
+
+    def as_response(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count) if self.count else None,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "max_ms": round(self.max_ms),
+        }
+
+
+@dataclass
+class PendingRequest:
+    request_id: str
+    tablet_session: str
+    teacher_id: int
+    created_at: float = field(default_factory=time.monotonic)
+    via_sse: bool = False
+    via_fcm: bool = False
+    pushed_at: float | None = None
+    answered_ms: float | None = None
+
+    @property
+    def path(self) -> str:
+        if self.via_sse and self.via_fcm:
+            return "sse+fcm"
+        return "sse" if self.via_sse else "fcm"
+
+    def elapsed_ms(self) -> float:
+        return (time.monotonic() - self.created_at) * 1000
+
+
+class RoundTrips:
+    def __init__(self):
+        self.by_pair: Dict[Tuple[str, int], str] = {}
+        self.answered: Dict[str, LatencyStats] = {}
+        self.pushed = LatencyStats()
+        self.unanswered: Dict[str, int] = {}
+
+    def open(self, tablet_session: str, teacher_id: int) -> PendingRequest:
+        request = PendingRequest(new_request_id(), tablet_session, teacher_id)
+        globals.PENDING_REQUESTS[request.request_id] = request
+        self.by_pair[(tablet_session, teacher_id)] = request.request_id
+
+        return request
+
+    def current(self, tablet_session: str, teacher_id: int) -> PendingRequest | None:
+        request_id = self.by_pair.get((tablet_session, teacher_id))
+        return globals.PENDING_REQUESTS.get(request_id) if request_id else None
+
+    def discard(self, request: PendingRequest):
+        """Drops a request that never reached the teacher."""
+        self._close(request)
+
+    def _close(self, request: PendingRequest):
+        globals.PENDING_REQUESTS.pop(request.request_id, None)
+
+        if self.by_pair.get((request.tablet_session, request.teacher_id)) == request.request_id:
+            del self.by_pair[(request.tablet_session, request.teacher_id)]
+
+    def answer(self, tablet_session: str, teacher_id: int, request_id: str | None) -> PendingRequest | None:
+        """Closes the request being answered; without an id, the kiosk's latest one to this teacher."""
+        request = globals.PENDING_REQUESTS.get(request_id) if request_id else self.current(tablet_session, teacher_id)
+
+        if request is None or request.tablet_session != tablet_session or request.teacher_id != teacher_id:
+            return None
+
+        self._close(request)
+
+        waited = request.elapsed_ms()
+        request.answered_ms = waited
+        self.answered.setdefault(request.path, LatencyStats()).add(waited)
+        history.record_response(teacher_id, int(waited))
+
+        return request
+
+    def mark_pushed(self, request_id: str):
+        """Called by the outbox once FCM accepted the push for a request."""
+        request = globals.PENDING_REQUESTS.get(request_id)
+
+        if request is not None and request.pushed_at is None:
+            request.pushed_at = time.monotonic()
+            self.pushed.add(request.elapsed_ms())
+
+    def expire(self) -> int:
+        deadline = time.monotonic() - ANSWER_TIMEOUT
+        expired = [request for request in globals.PENDING_REQUESTS.values() if request.created_at < deadline]
+
+        for request in expired:
+            self._close(request)
+            self.unanswered[request.path] = self.unanswered.get(request.path, 0) + 1
+
+            sse.publish_tablet(request.tablet_session, {
+                "event": "noAnswer",
+                "request_id": request.request_id,
+                "teacher_id": request.teacher_id,
+            })
+
+        return len(expired)
+
+    def metrics(self) -> dict:
+        paths = sorted(set(self.answered) | set(self.unanswered))
+
+        return {
+            "pending": len(globals.PENDING_REQUESTS),
+            "answer_timeout": ANSWER_TIMEOUT,
+            "push_accepted": self.pushed.as_response(),
+            "paths": {
+                path: {
+                    "answered": self.answered.get(path, LatencyStats()).as_response(),
+                    "unanswered": self.unanswered.get(path, 0),
+                }
+                for path in paths
+            },
+        }
+
+
+async def expire_loop(interval: float = EXPIRE_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+
+        try:
+            round_trips.expire()
+        except Exception as e:
+            print(f"Round trip expiry failed: {e}")
+
+
+round_trips = TenantLocal(RoundTrips)
@@ -1,6 +1,7 @@
 import datetime
-from typing import Any, Dict, Optional
-from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from typing_extensions import TypedDict
 
 from .enums import WeekDays, Availability
 
@@ -16,10 +17,11 @@ class ImageModelBaseSchema(BaseModel):
     mimetype: str
     filename: str
 
-    class Config:
-        orm_mode = True
-        allow_population_by_field_name = True
-        arbitrary_types_allowed = True
+    model_config = ConfigDict(
+        from_attributes=True,
+        populate_by_name=True,
+        arbitrary_types_allowed=True,
+    )
 
 class SchoolClassBaseSchema(BaseModel):
     id: int | None = None
@@ -27,10 +29,11 @@ class SchoolClassBaseSchema(BaseModel):
     name: str
     grade: int
 
-    class Config:
-        orm_mode = True
-        allow_population_by_field_name = True
-        arbitrary_types_allowed = True
+    model_config = ConfigDict(
+        from_attributes=True,
+        populate_by_name=True,
+        arbitrary_types_allowed=True,
+    )
 
 class TeacherBaseSchema(BaseModel):
     full_name: str | None = None
@@ -42,13 +45,16 @@ class TeacherBaseSchema(BaseModel):
 
     availability: Availability | None = None
 
-    class Config:
-        orm_mode = True
-        allow_population_by_field_name = True
-        arbitrary_types_allowed = True
+    model_config = ConfigDict(
+        from_attributes=True,
+        populate_by_name=True,
+        arbitrary_types_allowed=True,
+    )
 
 class TeacherResponse(TeacherBaseSchema):
     id: int
+    # Has a stream open on some device; otherwise a notify only arrives as a push
+    online: bool = False
 
 class TeacherUpdate(TeacherBaseSchema):
     email_address: str | None = None
@@ -74,10 +80,11 @@ class ScheduleBaseSchema(BaseModel):
 
     is_break: bool
 
-    class Config:
-        orm_mode = True
-        allow_population_by_field_name = True
-        arbitrary_types_allowed = True
+    model_config = ConfigDict(
+        from_attributes=True,
+        populate_by_name=True,
+        arbitrary_types_allowed=True,
+    )
 
 class ScheduleResponse(ScheduleBaseSchema):
     id: int
@@ -92,10 +99,20 @@ class ScheduleCreate(BaseModel):
 
     is_break: bool = False
 
-    class Config:
-        orm_mode = True
-        allow_population_by_field_name = True
-        arbitrary_types_allowed = True
+    model_config = ConfigDict(
+        from_attributes=True,
+        populate_by_name=True,
+        arbitrary_types_allowed=True,
+    )
+
+    @model_validator(mode='after')
+    def check_times(self):
+        if self.time_out <= self.time_in:
+            raise ValueError("time_out must be after time_in")
+        return self
+
+class ScheduleImport(ScheduleCreate):
+    teacher_id: int
 
 class ScheduleUpdate(BaseModel):
     id: int
@@ -109,7 +126,105 @@ class ScheduleUpdate(BaseModel):
 
     is_break: bool = False
 
-    class Config:
-        orm_mode = True
-        allow_population_by_field_name = True
-        arbitrary_types_allowed = True
+    model_config = ConfigDict(
+        from_attributes=True,
+        populate_by_name=True,
+        arbitrary_types_allowed=True,
+    )
+
+    @model_validator(mode='after')
+    def check_times(self):
+        if self.time_out <= self.time_in:
+            raise ValueError("time_out must be after time_in")
+        return self
+
+class TabletRegister(BaseModel):
+    tablet_session: str | None = None
+
+    label: str | None = None
+    location: str | None = None
+
+class TabletResponse(BaseModel):
+    tablet_session: str
+
+    label: str | None = None
+    location: str | None = None
+
+    created_at: datetime.datetime
+    last_seen: datetime.datetime
+    connected: bool = False
+
+class AnnouncementCreate(BaseModel):
+    title: str
+    body: str
+
+    teacher_ids: List[int] | None = None
+    availability: List[Availability] | None = None
+    subject: str | None = None
+
+class AnnouncementResult(BaseModel):
+    teacher_id: int
+    sse: bool
+    push: str | None = None
+    error: str | None = None
+
+class AnnouncementStatus(BaseModel):
+    job_id: str
+    status: str
+
+    total: int
+    processed: int
+    sse_delivered: int
+    push_sent: int
+    push_failed: int
+
+    created_at: datetime.datetime
+    finished_at: datetime.datetime | None = None
+
+    results: List[AnnouncementResult] = []
+
+# Row shapes for the ORM-free read path (app.readpath). Field order matches
+# the response models above so both paths emit identical JSON. Not total,
+# since `fields=` projections leave columns out.
+
+class TeacherRow(TypedDict, total=False):
+    full_name: str | None
+    postfix: str | None
+    prefix: str | None
+    main_subject: str | None
+    availability: Availability | None
+    id: int
+    online: bool
+
+class ScheduleRow(TypedDict, total=False):
+    class_id: int | None
+    teacher_id: int
+    subject: str
+    weekday: WeekDays
+    time_in: datetime.time
+    time_out: datetime.time
+    is_break: bool
+    id: int
+
+class SlotRow(TypedDict):
+    id: int
+    class_id: int | None
+    subject: str
+    weekday: WeekDays
+    time_in: datetime.time
+    time_out: datetime.time
+    is_break: bool
+
+class TeacherNowRow(TypedDict):
+    teacher_id: int
+    at: datetime.datetime
+    current: SlotRow | None
+    busy_until: datetime.datetime | None
+    next: SlotRow | None
+    next_starts_at: datetime.datetime | None
+    free_until: datetime.datetime | None
+
+class SchoolClassRow(TypedDict, total=False):
+    id: int | None
+    name: str
+    grade: int
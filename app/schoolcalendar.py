@@ -0,0 +1,159 @@
+"""
+The school calendar: which dates are school days, and whose timetable they
+follow, in the school's own timezone.
+
+Weekdays follow their own timetable and weekends are off unless a
+`CalendarException` says otherwise. Exceptions are expanded once into a
+per-date table, and each school day's slots are grouped by start and end
+minute, so the scheduler tick is a couple of dict lookups.
+
+Set SCHOOL_TIMEZONE (an IANA name such as "Asia/Manila"); without it the
+server's local timezone is used, as before.
+"""
+import os
+
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta, tzinfo
+from typing import Dict, List
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .enums import DayKind, WeekDays
+from .tenancy import TenantLocal
+from .timetable import Slot, timetable
+
+SCHOOL_TIMEZONE = os.environ.get("SCHOOL_TIMEZONE")
+SCHOOL_TZ: tzinfo = ZoneInfo(SCHOOL_TIMEZONE) if SCHOOL_TIMEZONE else datetime.now().astimezone().tzinfo  # type: ignore
+
+# Compiled occurrence tables kept around; the scheduler only needs today's
+MAX_COMPILED_DAYS = 8
+
+
+def school_now() -> datetime:
+    """Naive wall-clock time at the school, which is what the Time columns hold."""
+    return datetime.now(SCHOOL_TZ).replace(tzinfo=None)
+
+
+def school_moment(at: datetime | None) -> datetime:
+    if at is None:
+        return school_now()
+
+    if at.tzinfo is not None:
+        return at.astimezone(SCHOOL_TZ).replace(tzinfo=None)
+
+    return at
+
+
+def regular_weekday(day: date) -> WeekDays | None:
+    try:
+        return WeekDays(day.weekday())
+    except ValueError:
+        return None
+
+
+@dataclass
+class DayOccurrences:
+    day: date
+    weekday: WeekDays
+    starts: Dict[time, List[Slot]] = field(default_factory=dict)
+    ends: Dict[time, List[Slot]] = field(default_factory=dict)
+
+
+@dataclass
+class DayInfo:
+    day: date
+    weekday: WeekDays | None
+    name: str | None = None
+    kind: DayKind | None = None
+
+    def as_response(self) -> dict:
+        return {
+            "date": self.day.isoformat(),
+            "school_day": self.weekday is not None,
+            "weekday": self.weekday.value if self.weekday is not None else None,
+            "name": self.name,
+            "kind": self.kind.value if self.kind is not None else None,
+        }
+
+
+class SchoolCalendar:
+    def __init__(self):
+        self.loaded = False
+        self.overrides: Dict[date, DayInfo] = {}
+        self._compiled: Dict[date, DayOccurrences | None] = {}
+        self._compiled_version = -1
+
+    def invalidate(self):
+        self.loaded = False
+        self.overrides = {}
+        self._compiled = {}
+
+    async def ensure_loaded(self, db: AsyncSession):
+        if self.loaded:
+            return
+
+        exceptions = (await db.scalars(
+            select(models.CalendarException).order_by(models.CalendarException.start_date)
+        )).all()
+
+        overrides: Dict[date, DayInfo] = {}
+
+        # Closures win over alternate days when ranges overlap
+        for exception in sorted(exceptions, key=lambda e: e.kind != DayKind.Alternate):
+            weekday = exception.follows if exception.kind == DayKind.Alternate else None
+            day = exception.start_date
+
+            while day <= exception.end_date:
+                overrides[day] = DayInfo(day, weekday, exception.name, exception.kind)
+                day += timedelta(days=1)
+
+        self.overrides = overrides
+        self._compiled = {}
+        self.loaded = True
+
+    def day_info(self, day: date) -> DayInfo:
+        return self.overrides.get(day) or DayInfo(day, regular_weekday(day))
+
+    def weekday_for(self, day: date) -> WeekDays | None:
+        """The timetable `day` follows, or None when there is no school."""
+        info = self.overrides.get(day)
+        return info.weekday if info is not None else regular_weekday(day)
+
+    def occurrences(self, day: date) -> DayOccurrences | None:
+        """Slots starting and ending on `day`, grouped by minute. None on days off."""
+        if self._compiled_version != timetable.version:
+            self._compiled = {}
+            self._compiled_version = timetable.version
+
+        if day in self._compiled:
+            return self._compiled[day]
+
+        weekday = self.weekday_for(day)
+        compiled = None
+
+        if weekday is not None:
+            compiled = DayOccurrences(day, weekday)
+
+            for slot in timetable.slots.values():
+                if slot.weekday == weekday:
+                    compiled.starts.setdefault(_minute(slot.time_in), []).append(slot)
+                    compiled.ends.setdefault(_minute(slot.time_out), []).append(slot)
+
+        if len(self._compiled) >= MAX_COMPILED_DAYS:
+            self._compiled.pop(min(self._compiled))
+
+        self._compiled[day] = compiled
+        return compiled
+
+    def days(self, start: date, count: int) -> List[DayInfo]:
+        return [self.day_info(start + timedelta(days=offset)) for offset in range(count)]
+
+
+def _minute(value: time) -> time:
+    return value.replace(second=0, microsecond=0)
+
+
+school_calendar = TenantLocal(SchoolCalendar)
@@ -0,0 +1,118 @@
+"""
+Precompressed snapshots of the collections every kiosk polls.
+
+`/teacherList`, `/allSchedules` and `/classesList` without parameters
+return the whole table, and every kiosk asks for it again after each
+reload. Each worker keeps the serialized body of the last version together
+with its gzip (and brotli) encodings, so a burst of kiosks costs one query
+and one compression instead of one each, and a kiosk that already has the
+current version gets a 304 from its ETag.
+
+`app.changes` invalidates a snapshot when a commit touches its table, on
+this worker or another. The teacher list also carries `online`, which
+changes without a commit going through `app.changes`, so it is rebuilt at
+least every TEACHER_MAX_AGE seconds.
+"""
+import asyncio
+import time
+
+from dataclasses import dataclass, field
+from hashlib import blake2b
+from typing import Awaitable, Callable, Dict
+
+from fastapi import Request, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import compression, readpath
+from .tenancy import TenantLocal
+
+TEACHER_MAX_AGE = 5
+
+
+@dataclass
+class Snapshot:
+    body: bytes
+    # Weak: the gzip and brotli bodies differ byte for byte but carry the same data
+    etag: str
+    encoded: Dict[str, bytes]
+    built_at: float = field(default_factory=time.monotonic)
+
+
+async def encode(body: bytes, compress: bool = True) -> Snapshot:
+    encoded = await asyncio.to_thread(compression.encode_all, body) if compress else {}
+    return Snapshot(body, f'W/"{blake2b(body, digest_size=16).hexdigest()}"', encoded)
+
+
+def respond(
+    request: Request,
+    snapshot: Snapshot,
+    media_type: str = "application/json",
+    cache_control: str = "no-cache",
+) -> Response:
+    headers = {"ETag": snapshot.etag, "Vary": "Accept-Encoding", "Cache-Control": cache_control}
+
+    if snapshot.etag in {tag.strip() for tag in request.headers.get("if-none-match", "").split(",")}:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    coding = compression.negotiate(request.headers.get("accept-encoding"), snapshot.encoded)
+    if coding is None:
+        return Response(snapshot.body, media_type=media_type, headers=headers)
+
+    headers["Content-Encoding"] = coding
+    return Response(snapshot.encoded[coding], media_type=media_type, headers=headers)
+
+
+class SnapshotCache:
+    def __init__(self, build: Callable[[AsyncSession], Awaitable[bytes]], max_age: float | None = None):
+        self.build = build
+        self.max_age = max_age
+        self.version = 0
+        self._snapshot: Snapshot | None = None
+        self._snapshot_version = -1
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.version += 1
+
+    def _current(self) -> Snapshot | None:
+        snapshot = self._snapshot
+
+        if snapshot is None or self._snapshot_version != self.version:
+            return None
+
+        if self.max_age is not None and time.monotonic() - snapshot.built_at > self.max_age:
+            return None
+
+        return snapshot
+
+    async def get(self, db: AsyncSession) -> Snapshot:
+        snapshot = self._current()
+        if snapshot is not None:
+            return snapshot
+
+        # Kiosks reload together; the first one builds, the rest wait for it
+        async with self._lock:
+            snapshot = self._current()
+            if snapshot is not None:
+                return snapshot
+
+            # An invalidation while building leaves the result already stale
+            version = self.version
+            snapshot = await encode(await self.build(db))
+            self._snapshot, self._snapshot_version = snapshot, version
+
+        return snapshot
+
+    async def respond(self, request: Request, db: AsyncSession) -> Response:
+        return respond(request, await self.get(db))
+
+
+teachers = TenantLocal(lambda: SnapshotCache(readpath.teacher_list_json, max_age=TEACHER_MAX_AGE))
+schedules = TenantLocal(lambda: SnapshotCache(readpath.schedule_list_json))
+school_classes = TenantLocal(lambda: SnapshotCache(readpath.school_class_list_json))
+
+
+def invalidate_all():
+    teachers.invalidate()
+    schedules.invalidate()
+    school_classes.invalidate()
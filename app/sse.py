@@ -0,0 +1,124 @@
+import asyncio
+import json
+from typing import Any, Dict, Iterable, Set
+
+import anyio
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from . import globals
+
+HEARTBEAT_INTERVAL = 20
+HEARTBEAT = b": heartbeat\n\n"
+# Queued last on a stream that has to end: the generator returns, the socket closes
+CLOSE = b""
+
+
+def encode_event(payload: Dict[str, Any], retry_ms: int | None = None) -> bytes:
+    """Encodes a payload into a complete SSE frame, once, for every subscriber."""
+    frame = f"data: {json.dumps(payload)}\n\n"
+
+    if retry_ms is not None:
+        # EventSource waits this long before reconnecting once the stream ends
+        frame = f"retry: {retry_ms}\n" + frame
+
+    return frame.encode('utf-8')
+
+
+def frame_data(frame: bytes) -> str:
+    """JSON body of an encoded frame, for transports that do not speak SSE."""
+    return frame[frame.index(b"data: ") + len(b"data: "):-2].decode('utf-8')
+
+
+def publish_tablet(tablet_session: str, payload: Dict[str, Any]) -> bool:
+    queue = globals.SSE_TABLET_CONNECTIONS.get(tablet_session)
+
+    if queue is None:
+        return False
+
+    queue.put_nowait(encode_event(payload))
+    return True
+
+
+def publish_tablets(payload: Dict[str, Any]):
+    frame = encode_event(payload)
+
+    for queue in globals.SSE_TABLET_CONNECTIONS.values():
+        queue.put_nowait(frame)
+
+
+def publish_teacher(teacher_id: int, payload: Dict[str, Any]) -> bool:
+    """Sends to every device the teacher has open; False when there is none."""
+    devices = globals.SSE_TEACHER_CONNECTIONS.get(teacher_id)
+
+    if not devices:
+        return False
+
+    frame = encode_event(payload)
+
+    for device in devices.values():
+        device.queue.put_nowait(frame)
+
+    return True
+
+
+def publish_teachers(teacher_ids: Iterable[int], payload: Dict[str, Any]) -> Set[int]:
+    """Encodes once and fans out; returns the teachers that had an open stream."""
+    frame = encode_event(payload)
+    delivered = set()
+
+    for teacher_id in teacher_ids:
+        devices = globals.SSE_TEACHER_CONNECTIONS.get(teacher_id)
+
+        if devices:
+            for device in devices.values():
+                device.queue.put_nowait(frame)
+
+            delivered.add(teacher_id)
+
+    return delivered
+
+
+async def heartbeat_loop(interval: float = HEARTBEAT_INTERVAL):
+    """
+    Single timer for every open stream. Queues that already have pending
+    frames are skipped, the next real event keeps the connection alive anyway.
+    """
+    while True:
+        await asyncio.sleep(interval)
+
+        for queue in list(globals.SSE_TABLET_CONNECTIONS.values()):
+            if queue.empty():
+                queue.put_nowait(HEARTBEAT)
+
+        for devices in list(globals.SSE_TEACHER_CONNECTIONS.values()):
+            for device in list(devices.values()):
+                if device.queue.empty():
+                    device.queue.put_nowait(HEARTBEAT)
+
+
+class EventStreamResponse(StreamingResponse):
+    """
+    StreamingResponse that always listens for the ASGI `http.disconnect`
+    message and cancels the body iterator as soon as it arrives, so the
+    generator's `finally` releases its registry slot immediately.
+    """
+    media_type = "text/event-stream"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        async with anyio.create_task_group() as task_group:
+            async def watch_disconnect():
+                while True:
+                    message = await receive()
+                    if message["type"] == "http.disconnect":
+                        break
+                task_group.cancel_scope.cancel()
+
+            task_group.start_soon(watch_disconnect)
+
+            try:
+                await self.stream_response(send)
+            except OSError:
+                pass
+
+            task_group.cancel_scope.cancel()
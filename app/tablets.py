@@ -0,0 +1,183 @@
+import secrets
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import globals, models
+from .database import AsyncSessionLocal
+
+SESSION_PREFIX = "TABSESS_"
+
+# Ephemeral sessions nobody has streamed on for this long are forgotten
+EPHEMERAL_IDLE = timedelta(minutes=10)
+
+
+@dataclass
+class TabletSession:
+    session: str
+    label: str | None
+    location: str | None
+    created_at: datetime
+    last_seen: datetime
+    ephemeral: bool = False
+
+    @property
+    def connected(self) -> bool:
+        return self.session in globals.SSE_TABLET_CONNECTIONS
+
+    @classmethod
+    def from_model(cls, tablet: models.Tablet) -> "TabletSession":
+        return cls(
+            session=tablet.session,
+            label=tablet.label,
+            location=tablet.location,
+            created_at=tablet.created_at,
+            last_seen=tablet.last_seen,
+        )
+
+    def as_response(self) -> dict:
+        return {
+            "tablet_session": self.session,
+            "label": self.label,
+            "location": self.location,
+            "created_at": self.created_at,
+            "last_seen": self.last_seen,
+            "connected": self.connected,
+        }
+
+
+def new_session_id() -> str:
+    return SESSION_PREFIX + secrets.token_hex(16)
+
+
+async def register(db: AsyncSession, label: str | None = None, location: str | None = None) -> TabletSession:
+    now = datetime.now()
+    tablet = models.Tablet(
+        session=new_session_id(),
+        label=label,
+        location=location,
+        created_at=now,
+        last_seen=now,
+    )
+
+    db.add(tablet)
+    await db.commit()
+
+    entry = TabletSession.from_model(tablet)
+    globals.TABLET_SESSIONS[entry.session] = entry
+    return entry
+
+
+def register_ephemeral(label: str | None = None, location: str | None = None) -> TabletSession:
+    """Session for kiosks an admin has not registered; kept in memory only."""
+    now = datetime.now()
+    entry = TabletSession(
+        session=new_session_id(),
+        label=label,
+        location=location,
+        created_at=now,
+        last_seen=now,
+        ephemeral=True,
+    )
+
+    globals.TABLET_SESSIONS[entry.session] = entry
+    return entry
+
+
+async def resume(db: AsyncSession, session: str) -> TabletSession | None:
+    """
+    Looks a session up in the in-memory registry first; sessions issued by
+    another worker or before a restart are loaded from the database once.
+    """
+    entry = globals.TABLET_SESSIONS.get(session)
+
+    if entry is not None:
+        return entry
+
+    tablet = (await db.scalars(
+        select(models.Tablet).where(models.Tablet.session == session)
+    )).first()
+
+    if not tablet:
+        return None
+
+    entry = TabletSession.from_model(tablet)
+    globals.TABLET_SESSIONS[entry.session] = entry
+    return entry
+
+
+async def update_metadata(db: AsyncSession, entry: TabletSession, label: str | None, location: str | None):
+    entry.label = label or entry.label
+    entry.location = location or entry.location
+
+    await db.execute(
+        update(models.Tablet)
+        .where(models.Tablet.session == entry.session)
+        .values(label=entry.label, location=entry.location)
+    )
+    await db.commit()
+
+
+def touch(session: str):
+    entry = globals.TABLET_SESSIONS.get(session)
+
+    if entry is not None:
+        entry.last_seen = datetime.now()
+        globals.TABLET_TOUCHED.add(session)
+
+
+def release(session: str):
+    """Called when a kiosk stream closes; ephemeral sessions cannot be resumed, so drop them."""
+    entry = globals.TABLET_SESSIONS.get(session)
+
+    if entry is not None and entry.ephemeral:
+        del globals.TABLET_SESSIONS[session]
+        globals.TABLET_TOUCHED.discard(session)
+    else:
+        touch(session)
+
+
+def _expire_ephemeral():
+    cutoff = datetime.now() - EPHEMERAL_IDLE
+
+    for session, entry in list(globals.TABLET_SESSIONS.items()):
+        if entry.ephemeral and not entry.connected and entry.last_seen < cutoff:
+            del globals.TABLET_SESSIONS[session]
+            globals.TABLET_TOUCHED.discard(session)
+
+
+async def flush_last_seen():
+    """
+    Persists `last_seen` for connected and recently touched kiosks in one
+    batch, and forgets idle ephemeral sessions, e.g. registered and never used.
+    """
+    for session in globals.SSE_TABLET_CONNECTIONS:
+        touch(session)
+
+    _expire_ephemeral()
+
+    if not globals.TABLET_TOUCHED:
+        return
+
+    rows = [
+        {"b_session": session, "b_last_seen": globals.TABLET_SESSIONS[session].last_seen}
+        for session in globals.TABLET_TOUCHED
+        if session in globals.TABLET_SESSIONS and not globals.TABLET_SESSIONS[session].ephemeral
+    ]
+    globals.TABLET_TOUCHED.clear()
+
+    if not rows:
+        return
+
+    table = models.Tablet.__table__
+    stmt = (
+        update(table)
+        .where(table.c.session == bindparam("b_session"))
+        .values(last_seen=bindparam("b_last_seen"))
+    )
+
+    async with AsyncSessionLocal() as db:
+        await (await db.connection()).execute(stmt, rows)
+        await db.commit()
@@ -0,0 +1,351 @@
+"""
+Several schools served from one deployment.
+
+Each school (tenant) has its own SQLite file, blob directory and backup
+directory, so one school's morning rush queues on its own write lock and
+connection pool and not on everyone's. Tenants are listed in TENANTS as `name=host` pairs,
+for example `TENANTS=north=north.tns.example,south=south.tns.example`;
+a name can be listed once per host. A request is routed by its
+X-Tenant header, or by its Host header if it has none. Each tenant's
+files live under TENANT_DIR/<name>/.
+
+Without TENANTS there is one tenant, `default`, on ./db.sqlite3,
+BLOB_DIR and BACKUP_DIR, exactly as before.
+
+The tenant of the running request or task is kept in a ContextVar, set by
+`TenantMiddleware` and by `use()` for background work. Per-school state
+that used to be a module global (stream registries, the timetable,
+snapshots...) is a `TenantLocal` proxy or one of the container proxies
+below. Call sites do not change, and each tenant gets its own instance on
+first use.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+
+from collections.abc import MutableMapping, MutableSequence, MutableSet
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import update_wrapper
+from typing import Any, Callable, Dict, List
+
+TENANT_HEADER = "x-tenant"
+TENANT_DIR = os.environ.get("TENANT_DIR", "tenants")
+
+DEFAULT_TENANT = "default"
+
+_NAME = re.compile(r"^[a-z0-9][a-z0-9_-]*$")
+
+
+@dataclass
+class TenantMetrics:
+    requests: int = 0
+    errors: int = 0
+    # Includes open event streams and sockets
+    in_flight: int = 0
+    # Time to the first response byte, so open event streams do not skew it
+    response_ms_total: float = 0
+    response_ms_max: float = 0
+
+    def record(self, status_code: int, elapsed_ms: float):
+        self.requests += 1
+        self.response_ms_total += elapsed_ms
+        self.response_ms_max = max(self.response_ms_max, elapsed_ms)
+
+        if status_code >= 500:
+            self.errors += 1
+
+    def as_response(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "response_ms_avg": round(self.response_ms_total / self.requests, 1) if self.requests else None,
+            "response_ms_max": round(self.response_ms_max, 1),
+        }
+
+
+@dataclass(eq=False)
+class Tenant:
+    name: str
+    database_path: str
+    blob_dir: str
+    backup_dir: str
+    metrics: TenantMetrics = field(default_factory=TenantMetrics)
+    _locals: Dict[int, Any] = field(default_factory=dict)
+
+    @property
+    def database_url(self) -> str:
+        return f"sqlite+aiosqlite:///{self.database_path}"
+
+    def local(self, key: object, factory: Callable[[], Any]) -> Any:
+        try:
+            return self._locals[id(key)]
+        except KeyError:
+            value = self._locals[id(key)] = factory()
+            return value
+
+
+def _configure(spec: str | None) -> tuple[Dict[str, Tenant], Dict[str, Tenant]]:
+    if not spec:
+        tenant = Tenant(
+            DEFAULT_TENANT, "./db.sqlite3", os.environ.get("BLOB_DIR", "blobs"), os.environ.get("BACKUP_DIR", "backups")
+        )
+        return {tenant.name: tenant}, {}
+
+    tenants: Dict[str, Tenant] = {}
+    hosts: Dict[str, Tenant] = {}
+
+    for item in spec.split(","):
+        name, _, host = item.strip().partition("=")
+        name = name.strip().lower()
+
+        if not _NAME.match(name):
+            raise ValueError(f"Invalid tenant name in TENANTS: {name!r}")
+
+        if name not in tenants:
+            directory = os.path.join(TENANT_DIR, name)
+            tenants[name] = Tenant(
+                name,
+                os.path.join(directory, "db.sqlite3"),
+                os.path.join(directory, "blobs"),
+                os.path.join(directory, "backups"),
+            )
+
+        if host.strip():
+            hosts[host.strip().lower()] = tenants[name]
+
+    return tenants, hosts
+
+
+TENANTS, HOSTS = _configure(os.environ.get("TENANTS"))
+MULTI_TENANT = bool(os.environ.get("TENANTS"))
+
+_current: ContextVar[Tenant] = ContextVar("tenant")
+
+
+def current() -> Tenant:
+    try:
+        return _current.get()
+    except LookupError:
+        if not MULTI_TENANT:
+            return TENANTS[DEFAULT_TENANT]
+
+        raise RuntimeError("No tenant selected; run this under tenancy.use()") from None
+
+
+def all_tenants() -> List[Tenant]:
+    return list(TENANTS.values())
+
+
+def get(name: str) -> Tenant | None:
+    return TENANTS.get(name.lower())
+
+
+@contextmanager
+def use(tenant: Tenant):
+    token = _current.set(tenant)
+
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
+
+
+def resolve(headers: Dict[str, str]) -> Tenant | None:
+    if not MULTI_TENANT:
+        return TENANTS[DEFAULT_TENANT]
+
+    name = headers.get(TENANT_HEADER)
+    if name:
+        return get(name)
+
+    host = headers.get("host", "").rsplit(":", 1)[0].lower()
+    return HOSTS.get(host)
+
+
+def each(func: Callable) -> Callable:
+    """Wraps a scheduler job so it runs for every tenant, side by side."""
+    async def run(tenant: Tenant):
+        with use(tenant):
+            try:
+                await func()
+            except Exception as e:
+                print(f"{func.__name__} failed for tenant {tenant.name}: {e}")
+
+    async def run_all():
+        await asyncio.gather(*(run(tenant) for tenant in all_tenants()))
+
+    return update_wrapper(run_all, func)
+
+
+class TenantMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        tenant = resolve(headers)
+
+        if tenant is None:
+            await _unknown_tenant(scope, send)
+            return
+
+        metrics = tenant.metrics
+        start = time.perf_counter()
+        recorded = False
+
+        async def send_with_metrics(message):
+            nonlocal recorded
+
+            if message["type"] == "http.response.start" and not recorded:
+                recorded = True
+                metrics.record(message["status"], (time.perf_counter() - start) * 1000)
+
+            await send(message)
+
+        metrics.in_flight += 1
+
+        try:
+            with use(tenant):
+                await self.app(scope, receive, send_with_metrics if scope["type"] == "http" else send)
+        except Exception:
+            if scope["type"] == "http" and not recorded:
+                metrics.record(500, (time.perf_counter() - start) * 1000)
+            raise
+        finally:
+            metrics.in_flight -= 1
+
+
+async def _unknown_tenant(scope, send):
+    if scope["type"] == "websocket":
+        await send({"type": "websocket.close", "code": 1008})
+        return
+
+    body = json.dumps({"detail": "Unknown school"}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 404,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class TenantLocal:
+    """Attribute proxy to a per-tenant instance that `factory` builds on first use."""
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+
+    def _instance(self) -> Any:
+        return current().local(self, self._factory)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._instance(), name)
+
+
+class TenantDict(TenantLocal, MutableMapping):
+    def __init__(self):
+        super().__init__(dict)
+
+    def __getitem__(self, key):
+        return self._instance()[key]
+
+    def __setitem__(self, key, value):
+        self._instance()[key] = value
+
+    def __delitem__(self, key):
+        del self._instance()[key]
+
+    def __iter__(self):
+        return iter(self._instance())
+
+    def __len__(self):
+        return len(self._instance())
+
+    def __contains__(self, key):
+        return key in self._instance()
+
+    def __repr__(self):
+        return repr(self._instance())
+
+    # Skips MutableMapping's generic versions, these are on the hot path
+    def get(self, key, default=None):
+        return self._instance().get(key, default)
+
+    def values(self):
+        return self._instance().values()
+
+    def items(self):
+        return self._instance().items()
+
+    def keys(self):
+        return self._instance().keys()
+
+    def setdefault(self, key, default=None):
+        return self._instance().setdefault(key, default)
+
+    def pop(self, key, *default):
+        return self._instance().pop(key, *default)
+
+
+class TenantList(TenantLocal, MutableSequence):
+    def __init__(self):
+        super().__init__(list)
+
+    def __getitem__(self, index):
+        return self._instance()[index]
+
+    def __setitem__(self, index, value):
+        self._instance()[index] = value
+
+    def __delitem__(self, index):
+        del self._instance()[index]
+
+    def __len__(self):
+        return len(self._instance())
+
+    def __iter__(self):
+        return iter(self._instance())
+
+    def insert(self, index, value):
+        self._instance().insert(index, value)
+
+    def append(self, value):
+        self._instance().append(value)
+
+    def extend(self, values):
+        self._instance().extend(values)
+
+    def clear(self):
+        self._instance().clear()
+
+
+class TenantSet(TenantLocal, MutableSet):
+    def __init__(self):
+        super().__init__(set)
+
+    def __contains__(self, value):
+        return value in self._instance()
+
+    def __iter__(self):
+        return iter(self._instance())
+
+    def __len__(self):
+        return len(self._instance())
+
+    def add(self, value):
+        self._instance().add(value)
+
+    def discard(self, value):
+        self._instance().discard(value)
+
+    def clear(self):
+        self._instance().clear()
@@ -0,0 +1,315 @@
+"""
+In-memory copy of `teacher_schedule`, indexed per (teacher, weekday) and
+per (class, weekday) so schedule writes can be checked for double-booking
+without scanning the table, and "where is this teacher now / next" can be
+answered by binary search without touching the database.
+"""
+import asyncio
+
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Callable, Dict, Hashable, List, Tuple
+
+from fastapi import HTTPException, status
+from pydantic import TypeAdapter
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, readpath, schemas
+from .enums import WeekDays
+from .intervals import Interval, IntervalIndex, find_conflicts
+from .tenancy import TenantLocal
+
+Key = Tuple[str, int, WeekDays]
+
+TEACHER_NOW = TypeAdapter(schemas.TeacherNowRow)
+TEACHERS_NOW = TypeAdapter(List[schemas.TeacherNowRow])
+
+
+@dataclass(frozen=True)
+class Slot:
+    id: int | None
+    teacher_id: int
+    class_id: int | None
+    subject: str
+    weekday: WeekDays
+    time_in: time
+    time_out: time
+    is_break: bool
+
+    def keys(self) -> List[Key]:
+        keys: List[Key] = [("teacher", self.teacher_id, self.weekday)]
+
+        if self.class_id is not None and not self.is_break:
+            keys.append(("class", self.class_id, self.weekday))
+
+        return keys
+
+    def as_row(self) -> schemas.SlotRow:
+        return {
+            "id": self.id,  # type: ignore
+            "class_id": self.class_id,
+            "subject": self.subject,
+            "weekday": self.weekday,
+            "time_in": self.time_in,
+            "time_out": self.time_out,
+            "is_break": self.is_break,
+        }
+
+    def as_response(self) -> dict:
+        return {
+            "id": self.id,
+            "teacher_id": self.teacher_id,
+            "class_id": self.class_id,
+            "subject": self.subject,
+            "weekday": self.weekday.value,
+            "time_in": self.time_in.isoformat(),
+            "time_out": self.time_out.isoformat(),
+        }
+
+
+class Timetable:
+    def __init__(self):
+        self.loaded = False
+        self.slots: Dict[int, Slot] = {}
+        self.indexes: Dict[Key, IntervalIndex] = {}
+        # Bumped on every change, keys the cached /teachers/now body
+        self.version = 0
+        self._now_cache: Tuple[Tuple[int, datetime], bytes] | None = None
+        # Held by API writes from the conflict check until the index is updated
+        self.lock = asyncio.Lock()
+
+    def invalidate(self):
+        """Drops the cache; the next access reloads it from the database."""
+        self.loaded = False
+        self.slots = {}
+        self.indexes = {}
+        self.version += 1
+
+    async def ensure_loaded(self, db: AsyncSession):
+        if self.loaded:
+            return
+
+        rows = await db.execute(select(*readpath.SCHEDULE_COLUMNS))
+        slots = {row.id: Slot(**row._asdict()) for row in rows}
+
+        indexes: Dict[Key, List[Interval]] = {}
+        for slot in slots.values():
+            for key in slot.keys():
+                indexes.setdefault(key, []).append(Interval(slot.time_in, slot.time_out, slot.id))
+
+        self.slots = slots
+        self.indexes = {key: IntervalIndex(intervals) for key, intervals in indexes.items()}
+        self.loaded = True
+        self.version += 1
+
+    def conflicts(self, candidate: Slot) -> List[Slot]:
+        """Stored slots that overlap `candidate` for its teacher or its class, ignoring itself."""
+        found: Dict[int, Slot] = {}
+
+        for key in candidate.keys():
+            index = self.indexes.get(key)
+
+            if index is None:
+                continue
+
+            for interval in index.overlapping(candidate.time_in, candidate.time_out, ignore=candidate.id):
+                found[interval.ident] = self.slots[interval.ident]
+
+        return list(found.values())
+
+    def check(self, candidate: Slot):
+        if candidate.time_out <= candidate.time_in:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="time_out must be after time_in",
+            )
+
+        _raise_conflicts(self.conflicts(candidate))
+
+    async def check_stored(self, db: AsyncSession, candidate: Slot):
+        """
+        `check` against the table instead of the cache. Call it after
+        flushing the write, so the transaction holds SQLite's write lock
+        and a slot another worker committed, but whose change_log entry
+        has not reached this one yet, is still seen.
+        """
+        schedule = models.Schedule
+        same_owner = [schedule.teacher_id == candidate.teacher_id]
+
+        if candidate.class_id is not None and not candidate.is_break:
+            same_owner.append(and_(schedule.class_id == candidate.class_id, schedule.is_break.is_(False)))
+
+        query = select(*readpath.SCHEDULE_COLUMNS).where(
+            schedule.weekday == candidate.weekday,
+            schedule.time_in < candidate.time_out,
+            schedule.time_out > candidate.time_in,
+            or_(*same_owner),
+        )
+
+        if candidate.id is not None:
+            query = query.where(schedule.id != candidate.id)
+
+        _raise_conflicts([Slot(**row._asdict()) for row in await db.execute(query)])
+
+    def remove(self, schedule_id: int):
+        slot = self.slots.pop(schedule_id, None)
+
+        if slot is None:
+            return
+
+        self.version += 1
+
+        for key in slot.keys():
+            index = self.indexes.get(key)
+
+            if index is not None:
+                index.remove(schedule_id)
+
+    def upsert(self, slot: Slot):
+        if not self.loaded:
+            return
+
+        self.remove(slot.id)
+        self.slots[slot.id] = slot
+        self.version += 1
+
+        for key in slot.keys():
+            self.indexes.setdefault(key, IntervalIndex()).add(Interval(slot.time_in, slot.time_out, slot.id))
+
+    async def refresh(self, db: AsyncSession, schedule_id: int):
+        """Re-reads one row, for changes committed by another worker."""
+        if not self.loaded:
+            return
+
+        row = (await db.execute(
+            select(*readpath.SCHEDULE_COLUMNS).where(models.Schedule.id == schedule_id)
+        )).first()
+
+        if row is None:
+            self.remove(schedule_id)
+        else:
+            self.upsert(Slot(**row._asdict()))
+
+    def resolve(
+        self,
+        teacher_id: int,
+        moment: datetime,
+        weekday_for: Callable[[date], WeekDays | None] = None,  # type: ignore
+    ) -> schemas.TeacherNowRow:
+        """
+        The slot `teacher_id` is in at `moment`, and the next one to start
+        within a week. `weekday_for` maps a date to the timetable it follows
+        (None for days off); plain weekdays by default.
+        """
+        weekday_for = weekday_for or _weekday
+        current = None
+        weekday = weekday_for(moment.date())
+        index = self.indexes.get(("teacher", teacher_id, weekday)) if weekday is not None else None
+
+        if index:
+            # Latest-starting slot wins if legacy rows overlap
+            hits = index.containing(moment.time())
+            current = self.slots[hits[0].ident] if hits else None
+
+        upcoming = None
+        starts_at = None
+
+        # Offset 7 is the same weekday next week, from the start of the day
+        for offset in range(8):
+            day = moment + timedelta(days=offset)
+            weekday = weekday_for(day.date())
+            index = self.indexes.get(("teacher", teacher_id, weekday)) if weekday is not None else None
+
+            if not index:
+                continue
+
+            item = index.first_after(moment.time() if offset == 0 else None)
+
+            if item is not None:
+                upcoming = self.slots[item.ident]
+                starts_at = datetime.combine(day.date(), item.start, tzinfo=moment.tzinfo)
+                break
+
+        return {
+            "teacher_id": teacher_id,
+            "at": moment,
+            "current": current.as_row() if current else None,
+            "busy_until": datetime.combine(moment.date(), current.time_out, tzinfo=moment.tzinfo) if current else None,
+            "next": upcoming.as_row() if upcoming else None,
+            "next_starts_at": starts_at,
+            "free_until": starts_at if current is None else None,
+        }
+
+    def teacher_ids(self) -> List[int]:
+        return sorted({key_id for kind, key_id, _ in self.indexes if kind == "teacher"})
+
+    def resolve_all_json(self, moment: datetime, weekday_for: Callable[[date], WeekDays | None] = None) -> bytes:  # type: ignore
+        """Every scheduled teacher at once; kiosks poll this, so the body is reused within a second."""
+        key = (self.version, moment.replace(microsecond=0))
+
+        if self._now_cache is not None and self._now_cache[0] == key:
+            return self._now_cache[1]
+
+        body = TEACHERS_NOW.dump_json([self.resolve(teacher_id, key[1], weekday_for) for teacher_id in self.teacher_ids()])
+        self._now_cache = (key, body)
+
+        return body
+
+    def report(self) -> List[Dict]:
+        """Every overlapping pair currently stored, e.g. from before writes were checked."""
+        keyed: List[Tuple[Hashable, Interval]] = [
+            (key, interval)
+            for key, index in self.indexes.items()
+            for interval in index.items
+        ]
+
+        return [
+            {
+                kind: key_id,
+                "weekday": weekday.value,
+                "first": self.slots[first.ident].as_response(),
+                "second": self.slots[second.ident].as_response(),
+            }
+            for (kind, key_id, weekday), first, second in find_conflicts(keyed)
+        ]
+
+
+def _raise_conflicts(conflicts: List[Slot]):
+    if conflicts:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "msg": "Schedule overlaps existing slots",
+                "conflicts": [slot.as_response() for slot in conflicts],
+            }
+        )
+
+
+def _weekday(day: date) -> WeekDays | None:
+    try:
+        return WeekDays(day.weekday())
+    except ValueError:
+        return None
+
+
+def slot_from_model(schedule: models.Schedule) -> Slot:
+    weekday = schedule.weekday
+
+    # Admin forms assign the enum by name; it is only converted when the row is read back
+    if isinstance(weekday, str):
+        weekday = WeekDays[weekday]
+
+    return Slot(
+        id=schedule.id,
+        teacher_id=schedule.teacher_id,
+        class_id=schedule.class_id,
+        subject=schedule.subject,
+        weekday=weekday,
+        time_in=schedule.time_in,
+        time_out=schedule.time_out,
+        is_break=bool(schedule.is_break),
+    )
+
+
+timetable = TenantLocal(Timetable)
@@ -1,8 +1,22 @@
 
-from firebase_admin import messaging
+import asyncio
+from typing import TYPE_CHECKING, Coroutine, Dict
+
+from . import globals
+from .push import PushUnavailable, get_messaging
+
+if TYPE_CHECKING:
+    from firebase_admin import messaging
 
 
 async def verify_fcm_token(token: str):
+    try:
+        messaging = get_messaging()
+    except PushUnavailable as e:
+        # Kept unverified so pushes work once the key is installed
+        print(e)
+        return True
+
     message = messaging.Message(
         token=token,
     )
@@ -21,3 +35,66 @@ async def verify_fcm_token(token: str):
     except Exception as e:
         print(f"Validation failed: {e}")
         return False
+
+
+def spawn(coro: Coroutine) -> asyncio.Task:
+    """Runs a coroutine in the background, keeping a reference until it finishes."""
+    task = asyncio.create_task(coro)
+    globals.BACKGROUND_TASKS.add(task)
+    task.add_done_callback(globals.BACKGROUND_TASKS.discard)
+    return task
+
+
+def _critical_alert_configs(title: str, body: str):
+    messaging = get_messaging()
+
+    android = messaging.AndroidConfig(
+        priority="high",
+        notification=messaging.AndroidNotification(
+            title=title,
+            body=body,
+            channel_id="critical_alerts",
+            sound="alert_sound",
+        ),
+    )
+
+    apns = messaging.APNSConfig(
+        payload=messaging.APNSPayload(
+            aps=messaging.Aps(
+                sound=messaging.CriticalSound(
+                    name="alert_sound.caf",
+                    critical=True,
+                    volume=1.0
+                ),
+                category="RESPOND_CATEGORY",
+            ),
+        ),
+    )
+
+    return android, apns
+
+
+def build_alert_message(title: str, body: str, token: str, data: Dict[str, str] | None = None) -> "messaging.Message":
+    messaging = get_messaging()
+    android, apns = _critical_alert_configs(title, body)
+
+    return messaging.Message(
+        notification=messaging.Notification(title=title, body=body),
+        data=data,
+        token=token,
+        android=android,
+        apns=apns,
+    )
+
+
+def build_alert_multicast(title: str, body: str, tokens: list[str], data: Dict[str, str] | None = None) -> "messaging.MulticastMessage":
+    messaging = get_messaging()
+    android, apns = _critical_alert_configs(title, body)
+
+    return messaging.MulticastMessage(
+        notification=messaging.Notification(title=title, body=body),
+        data=data,
+        tokens=tokens,
+        android=android,
+        apns=apns,
+    )
@@ -0,0 +1,136 @@
+"""
+SQL statements and time per admin page against a large timetable.
+
+    uv run python -m benchmarks.admin_queries [schedules]
+
+Seeds a throwaway database (in a temporary directory, the live database is
+never touched), logs in to /admin and requests the heavy pages, counting
+the statements each one sends. Exits non-zero when a page goes over its
+budget, which is what a relationship falling back to lazy loading looks
+like.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import time as dtime
+
+SCHEDULES = 10_000
+TEACHERS = 200
+CLASSES = 60
+
+# (statements, ORM instances loaded) per request. Statements catch lazy
+# loading, instances catch a page that pulls in a whole table at once.
+BUDGETS = {
+    "/admin/schedule/list": (4, 150),
+    "/admin/schedule/list?pageSize=200&page=40": (4, 460),
+    "/admin/schedule/list?search=Teacher 7": (4, 150),
+    "/admin/schedule/list?search=monday": (4, 150),
+    "/admin/schedule/list?search=42": (4, 150),
+    "/admin/schedule/details/5000": (3, 3),
+    "/admin/schedule/edit/5000": (5, TEACHERS + CLASSES + 3),
+    "/admin/teacher/list": (2, 50),
+    "/admin/teacher/list?search=bench": (2, 50),
+    "/admin/teacher/details/7": (1, 1),
+    "/admin/teacher/edit/7": (1, 1),
+    "/admin/school-class/list": (2, 50),
+    "/admin/school-class/details/7": (1, 1),
+    "/admin/school-class/edit/7": (1, 1),
+}
+
+
+async def seed(rows: int):
+    from sqlalchemy import insert
+
+    from app import models
+    from app.database import AsyncSessionLocal
+    from app.enums import WeekDays
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(models.Teacher), [
+            {"full_name": f"Teacher {i}", "token": "x", "email_address": f"{i}@bench"}
+            for i in range(TEACHERS)
+        ])
+        await db.execute(insert(models.SchoolClass), [
+            {"name": f"Class {i}", "grade": 7 + i % 6}
+            for i in range(CLASSES)
+        ])
+        await db.execute(insert(models.ImageModel), [
+            {"teacher_id": i + 1, "data": os.urandom(256 * 1024), "mimetype": "image/png", "filename": str(i + 1)}
+            for i in range(TEACHERS)
+        ])
+        await db.execute(insert(models.Schedule), [
+            {
+                "teacher_id": 1 + i % TEACHERS,
+                "class_id": 1 + i % CLASSES,
+                "subject": "Math",
+                "weekday": WeekDays(i % 5),
+                "time_in": dtime(7 + i % 9, 0),
+                "time_out": dtime(8 + i % 9, 0),
+                "is_break": False,
+            }
+            for i in range(rows)
+        ])
+        await db.commit()
+
+
+async def run(rows: int) -> int:
+    import httpx
+    from sqlalchemy import event
+
+    from app.admin_auth import ADMIN_PASSWORD, ADMIN_USERNAME
+    from app.database import Base, engine, init_db
+    from app.main import app
+
+    await init_db()
+    await seed(rows)
+
+    statements = []
+    loaded = []
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    event.listen(Base, "load", lambda target, context: loaded.append(type(target).__name__), propagate=True)
+
+    failed = False
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        await client.post("/admin/login", data={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD})
+
+        for path, (max_statements, max_loaded) in BUDGETS.items():
+            statements.clear()
+            loaded.clear()
+            start = time.perf_counter()
+            response = await client.get(path)
+            elapsed = (time.perf_counter() - start) * 1000
+
+            over = len(statements) > max_statements or len(loaded) > max_loaded or response.status_code != 200
+            failed = failed or over
+
+            print(
+                f"{'FAIL' if over else 'ok  '}  {len(statements):3d}/{max_statements:<3d} queries"
+                f"  {len(loaded):5d}/{max_loaded:<5d} rows  {elapsed:7.1f} ms  {response.status_code}  {path}"
+            )
+
+            if over and "-v" in sys.argv:
+                for statement in statements:
+                    print("        " + " ".join(statement.split())[:160])
+
+    # aiosqlite's connection threads would otherwise keep the interpreter alive
+    await engine.dispose()
+
+    return 1 if failed else 0
+
+
+def main(rows: int = SCHEDULES) -> int:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, root)
+
+    with tempfile.TemporaryDirectory() as cwd:
+        # app.database opens ./db.sqlite3 relative to the working directory
+        os.chdir(cwd)
+        return asyncio.run(run(rows))
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "-v"]
+    sys.exit(main(int(args[0]) if args else SCHEDULES))
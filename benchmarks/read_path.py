@@ -0,0 +1,109 @@
+"""
+Compares the ORM + response_model path against app.readpath for /allSchedules.
+
+    uv run python -m benchmarks.read_path [rows]
+
+Runs against a throwaway SQLite file, never the live database.
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import time as dtime
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app import models, readpath, schemas
+from app.database import Base
+from app.enums import WeekDays
+
+ROUNDS = 5
+
+LEGACY_ADAPTER = TypeAdapter(List[schemas.ScheduleResponse])
+
+
+async def seed(session: AsyncSession, rows: int):
+    teachers = max(1, rows // 100)
+
+    await session.execute(insert(models.Teacher), [
+        {"full_name": f"Teacher {i}", "token": "x", "email_address": f"{i}@bench"}
+        for i in range(teachers)
+    ])
+    await session.execute(insert(models.SchoolClass), [
+        {"name": f"Class {i}", "grade": 7 + i % 6}
+        for i in range(50)
+    ])
+    await session.execute(insert(models.Schedule), [
+        {
+            "teacher_id": 1 + i % teachers,
+            "class_id": 1 + i % 50,
+            "subject": "Math",
+            "weekday": WeekDays(i % 5),
+            "time_in": dtime(7 + i % 9, 0),
+            "time_out": dtime(8 + i % 9, 0),
+            "is_break": False,
+        }
+        for i in range(rows)
+    ])
+    await session.commit()
+
+
+async def legacy(session: AsyncSession) -> bytes:
+    # What FastAPI does with response_model: validate from attributes, serialize, json.dumps
+    schedules = (await session.scalars(select(models.Schedule))).all()
+    validated = LEGACY_ADAPTER.validate_python(schedules, from_attributes=True)
+    body = json.dumps(LEGACY_ADAPTER.dump_python(validated, mode="json"), separators=(",", ":"))
+    session.expunge_all()
+    return body.encode("utf-8")
+
+
+async def fast(session: AsyncSession) -> bytes:
+    return await readpath.schedule_list_json(session)
+
+
+async def measure(name: str, func, factory, rows: int):
+    async with factory() as session:
+        await func(session)
+
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            await func(session)
+        elapsed = (time.perf_counter() - start) / ROUNDS
+
+        tracemalloc.start()
+        await func(session)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    print(f"{name:>8}: {elapsed * 1000:8.1f} ms  {rows / elapsed:12,.0f} rows/s  peak {peak / 1024:10,.0f} KiB")
+
+
+async def main(rows: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.sqlite3')}")
+        factory = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        async with factory() as session:
+            await seed(session, rows)
+
+        async with factory() as session:
+            assert json.loads(await legacy(session)) == json.loads(await fast(session))
+
+        print(f"/allSchedules, {rows:,} rows, mean of {ROUNDS} rounds")
+        await measure("orm", legacy, factory, rows)
+        await measure("readpath", fast, factory, rows)
+
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000))
@@ -0,0 +1,132 @@
+"""
+Cold start of one API worker: `python -X importtime` for `import app.main`,
+plus the time until the first API request is answered.
+
+    uv run python -m benchmarks.startup [runs]
+
+Each run is a fresh interpreter in a throwaway directory, so there is no
+.firebaseServiceKey.json and the live database is never touched. Exits
+non-zero when the median import goes over IMPORT_BUDGET_MS or when a
+lazily loaded subsystem (Firebase, the admin UI) was imported anyway.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROUNDS = 5
+
+# Median `import app.main`; was ~430 ms with eager Firebase and sqladmin
+IMPORT_BUDGET_MS = 330
+
+# Must not be imported until a push is sent or /admin is opened
+LAZY_MODULES = ("firebase_admin", "sqladmin", "wtforms", "jinja2")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+READY = """
+import asyncio, json, os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+import app.main
+imported = time.perf_counter()
+
+import httpx
+
+async def main():
+    async with app.main.app.router.lifespan_context(app.main.app):
+        transport = httpx.ASGITransport(app=app.main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.get("/api/classesList")
+            assert response.status_code == 200, response.status_code
+        ready = time.perf_counter()
+        print(json.dumps({{
+            "import_ms": (imported - start) * 1000,
+            "ready_ms": (ready - start) * 1000,
+            "lazy_loaded": [m for m in {lazy!r} if m in sys.modules],
+        }}))
+    # The scheduler and aiosqlite threads are not worth a clean shutdown here
+    os._exit(0)
+
+asyncio.run(main())
+"""
+
+
+def importtime(cwd: str) -> tuple[float, list[tuple[int, str]]]:
+    """Cumulative ms for app.main and the heaviest self-times, from -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {ROOT!r}); import app.main"],
+        cwd=cwd, capture_output=True, text=True, check=True,
+    )
+
+    total = 0.0
+    heaviest = []
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        self_us, cumulative_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+
+        if not self_us.isdigit():
+            continue
+
+        heaviest.append((int(self_us), name))
+
+        if name == "app.main":
+            total = int(cumulative_us) / 1000
+
+    heaviest.sort(reverse=True)
+    return total, heaviest[:10]
+
+
+def ready(cwd: str) -> dict:
+    script = READY.format(root=ROOT, lazy=LAZY_MODULES)
+    result = subprocess.run([sys.executable, "-c", script], cwd=cwd, capture_output=True, text=True, check=True)
+
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(rounds: int = ROUNDS) -> int:
+    imports = []
+    readies = []
+    lazy_loaded = set()
+    heaviest = []
+
+    with tempfile.TemporaryDirectory() as cwd:
+        # Creating a fresh database is a one-off; workers restart against an existing one
+        ready(cwd)
+
+        for _ in range(rounds):
+            total, heaviest = importtime(cwd)
+            imports.append(total)
+
+            run = ready(cwd)
+            readies.append(run["ready_ms"])
+            lazy_loaded.update(run["lazy_loaded"])
+
+    median_import = statistics.median(imports)
+
+    print(f"import app.main   median {median_import:7.1f} ms  (budget {IMPORT_BUDGET_MS} ms)")
+    print(f"first API answer  median {statistics.median(readies):7.1f} ms")
+    print("heaviest imports (self time):")
+    for self_us, name in heaviest:
+        print(f"  {self_us / 1000:7.1f} ms  {name}")
+
+    failed = False
+
+    if median_import > IMPORT_BUDGET_MS:
+        print(f"FAIL: import over budget by {median_import - IMPORT_BUDGET_MS:.1f} ms")
+        failed = True
+
+    if lazy_loaded:
+        print(f"FAIL: imported during startup: {', '.join(sorted(lazy_loaded))}")
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else ROUNDS))
@@ -7,6 +7,12 @@ source .env
 : "${HOST:=127.0.0.1}"
 : "${PORT:=8000}"
 
+# Per-worker rate limits are derived from this
+export WORKERS
+
+# IANA timezone the timetable is written in, e.g. Asia/Manila (defaults to the server's)
+export SCHOOL_TIMEZONE
+
 SESSION="app"
 
 # Create tmux session (detached)
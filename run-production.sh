@@ -14,6 +14,16 @@ if [ -z "${PORT+x}" ]; then
   PORT=8000 
 fi
 
+# Per-worker rate limits are derived from this
+export WORKERS
+
+# IANA timezone the timetable is written in, e.g. Asia/Manila (defaults to the server's)
+export SCHOOL_TIMEZONE
+
+# Several schools from one deployment as name=host pairs, e.g. north=north.example.org,south=south.example.org
+# (unset: one school on ./db.sqlite3); each gets TENANT_DIR/<name>/db.sqlite3
+export TENANTS TENANT_DIR
+
 if [ -z "${CLOUDFLARE_TOKEN+x}" ]; then
   echo "WARNING: CLOUDFLARE_TOKEN not set, will not be using cloudflare."
 else
@@ -24,3 +34,4 @@ uv run uvicorn app.main:app \
   --host $HOST \
   --port $PORT \
   --workers $WORKERS \
+  --timeout-graceful-shutdown 30
@@ -0,0 +1,51 @@
+"""
+Runs the suite in a throwaway working directory: the default tenant's
+./db.sqlite3, blobs and backups are created there and removed before each
+test. Tests drive coroutines through `run()`, which disposes the engines
+before its event loop closes.
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+
+import pytest
+
+WORKDIR = tempfile.mkdtemp(prefix="tns-tests-")
+os.chdir(WORKDIR)
+os.environ["BLOB_DIR"] = os.path.join(WORKDIR, "blobs")
+os.environ["BACKUP_DIR"] = os.path.join(WORKDIR, "backups")
+
+from app import database, tenancy  # noqa: E402
+
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            # aiosqlite connections belong to the loop that opened them
+            await database.dispose_engines()
+
+    return asyncio.run(main())
+
+
+def reset_tenants():
+    """Empty databases and blob stores, and no per-tenant state left from before."""
+    for tenant in tenancy.all_tenants():
+        tenant._locals.clear()
+
+        if os.path.exists(tenant.database_path):
+            os.remove(tenant.database_path)
+
+        shutil.rmtree(tenant.blob_dir, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def fresh_tenants():
+    reset_tenants()
+    yield
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(WORKDIR, ignore_errors=True)
@@ -0,0 +1,89 @@
+"""Admin list pages send a fixed number of statements however many rows there are."""
+from datetime import time
+
+import httpx
+
+from sqlalchemy import event, insert
+
+from app import models
+from app.admin_auth import ADMIN_PASSWORD, ADMIN_USERNAME
+from app.database import AsyncSessionLocal, engine, init_db
+from app.enums import WeekDays
+from app.main import app
+
+from .conftest import reset_tenants, run
+
+TEACHERS = 50
+CLASSES = 20
+
+PAGES = (
+    "/admin/schedule/list",
+    "/admin/schedule/list?search=Teacher 7",
+    "/admin/schedule/list?search=monday",
+)
+MAX_STATEMENTS = 4
+
+
+async def _seed(schedules: int):
+    await init_db()
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(models.Teacher), [
+            {"full_name": f"Teacher {i}", "token": f"token-{i}", "email_address": f"{i}@test"}
+            for i in range(TEACHERS)
+        ])
+        await db.execute(insert(models.SchoolClass), [
+            {"name": f"Class {i}", "grade": 7 + i % 6}
+            for i in range(CLASSES)
+        ])
+        await db.execute(insert(models.Schedule), [
+            {
+                "teacher_id": 1 + i % TEACHERS,
+                "class_id": 1 + i % CLASSES,
+                "subject": "Math",
+                "weekday": WeekDays(i % 5),
+                "time_in": time(7 + i % 9, 0),
+                "time_out": time(8 + i % 9, 0),
+                "is_break": False,
+            }
+            for i in range(schedules)
+        ])
+        await db.commit()
+
+
+async def _count_statements(schedules: int) -> dict:
+    await _seed(schedules)
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    sync_engine = engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", count)
+    counts = {}
+
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            await client.post("/admin/login", data={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD})
+
+            for path in PAGES:
+                statements.clear()
+                response = await client.get(path)
+
+                assert response.status_code == 200, path
+                counts[path] = len(statements)
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", count)
+
+    return counts
+
+
+def test_schedule_pages_do_not_grow_with_rows():
+    small = run(_count_statements(100))
+    reset_tenants()
+    large = run(_count_statements(400))
+
+    for path in PAGES:
+        assert small[path] <= MAX_STATEMENTS, (path, small[path])
+        assert large[path] == small[path], (path, small[path], large[path])
@@ -0,0 +1,40 @@
+"""Online copies of the database, and where they give up."""
+import sqlite3
+import time
+
+import pytest
+
+from app.backup import BACKUP_PAGES, BackupAborted, BackupProgress, copy_database
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = str(tmp_path / "source.sqlite3")
+
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE filler (data BLOB)")
+        # Several steps' worth of pages
+        conn.executemany("INSERT INTO filler VALUES (?)", [(b"x" * 4096,) for _ in range(BACKUP_PAGES * 4)])
+
+    return path
+
+
+def test_copy_is_complete(source, tmp_path):
+    target = str(tmp_path / "copy.sqlite3")
+    progress = BackupProgress()
+
+    copy_database(source, target, progress)
+
+    assert progress.pages_done == progress.pages_total > BACKUP_PAGES
+
+    with sqlite3.connect(target) as conn:
+        assert conn.execute("SELECT count(*) FROM filler").fetchone()[0] == BACKUP_PAGES * 4
+
+
+def test_copy_gives_up_at_its_deadline(source, tmp_path):
+    progress = BackupProgress()
+
+    with pytest.raises(BackupAborted):
+        copy_database(source, str(tmp_path / "copy.sqlite3"), progress, deadline=time.monotonic())
+
+    assert progress.pages_done < progress.pages_total
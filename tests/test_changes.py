@@ -0,0 +1,144 @@
+"""Committed changes are applied once, rolled back ones never, other workers' ones from the log."""
+import asyncio
+
+from datetime import time
+
+import pytest
+
+from sqlalchemy import func, insert, select
+
+from app import changes, models
+from app.changes import ChangeSet
+from app.database import AsyncSessionLocal, init_db
+from app.enums import WeekDays
+from app.timetable import timetable
+
+from .conftest import run
+
+
+@pytest.fixture
+def published(monkeypatch):
+    calls = []
+    monkeypatch.setattr(changes, "publish", calls.append)
+    return calls
+
+
+async def _seed():
+    await init_db()
+
+    async with AsyncSessionLocal() as db:
+        teacher = models.Teacher(full_name="Teacher 1", token="token-1", email_address="1@test")
+        school_class = models.SchoolClass(name="Class 1", grade=7)
+        db.add_all([teacher, school_class])
+        await db.commit()
+
+        await timetable.ensure_loaded(db)
+
+        return teacher, school_class
+
+
+def _schedule(teacher, school_class, time_in=time(8), time_out=time(9)) -> models.Schedule:
+    # Related objects rather than ids, the way the admin's forms assign them
+    return models.Schedule(
+        teacher=teacher,
+        school_class=school_class,
+        subject="Math",
+        weekday=WeekDays(0),
+        time_in=time_in,
+        time_out=time_out,
+        is_break=False,
+    )
+
+
+async def _log_count() -> int:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count()).select_from(models.ChangeLog))
+
+
+def test_commit_publishes_once_and_patches_the_timetable(published):
+    async def scenario():
+        teacher, school_class = await _seed()
+        published.clear()
+
+        async with AsyncSessionLocal() as db:
+            schedule = _schedule(await db.merge(teacher), await db.merge(school_class))
+            db.add(schedule)
+            await db.flush()
+
+            schedule.time_out = time(9, 30)
+            await db.flush()
+            await db.commit()
+
+        return teacher, schedule
+
+    teacher, schedule = run(scenario())
+
+    assert len(published) == 1
+    assert published[0].teachers == {teacher.id}
+    assert published[0].schedules == {schedule.id}
+    assert timetable.slots[schedule.id].time_out == time(9, 30)
+
+
+def test_rollback_publishes_nothing(published):
+    async def scenario():
+        teacher, school_class = await _seed()
+        published.clear()
+        logged = await _log_count()
+
+        async with AsyncSessionLocal() as db:
+            db.add(_schedule(await db.merge(teacher), await db.merge(school_class)))
+            await db.flush()
+            await db.rollback()
+
+        return logged, await _log_count()
+
+    logged_before, logged_after = run(scenario())
+
+    assert published == []
+    assert timetable.slots == {}
+    assert logged_after == logged_before
+
+
+def test_poll_loop_applies_other_workers_changes(published):
+    async def scenario():
+        teacher, school_class = await _seed()
+        published.clear()
+
+        async with AsyncSessionLocal() as db:
+            since = await changes.latest_id(db)
+
+            # Written by another worker: the row and its log entry, nothing published here
+            schedule_id = (await db.execute(
+                insert(models.Schedule).values(
+                    teacher_id=teacher.id,
+                    class_id=school_class.id,
+                    subject="Math",
+                    weekday=WeekDays(0),
+                    time_in=time(10),
+                    time_out=time(11),
+                    is_break=False,
+                )
+            )).inserted_primary_key[0]  # type: ignore
+            remote = ChangeSet(teachers={teacher.id}, schedules={schedule_id})
+            await db.execute(insert(models.ChangeLog).values(origin=changes.ORIGIN + 1, data=remote.as_json()))
+            # Our own entries were applied when they committed and are skipped
+            await db.execute(insert(models.ChangeLog).values(origin=changes.ORIGIN, data=ChangeSet(teachers={999}).as_json()))
+            await db.commit()
+
+        poll = asyncio.create_task(changes.poll_loop(since, interval=0.01))
+
+        try:
+            for _ in range(200):
+                if schedule_id in timetable.slots:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            poll.cancel()
+
+        return teacher, schedule_id
+
+    teacher, schedule_id = run(scenario())
+
+    assert timetable.slots[schedule_id].time_in == time(10)
+    assert len(published) == 1
+    assert published[0].teachers == {teacher.id}
@@ -0,0 +1,71 @@
+"""A notify that reached nobody must not coalesce the kiosk's retry."""
+import asyncio
+
+from types import SimpleNamespace
+
+from app import globals
+from app.events import notify_teacher
+from app.ratelimit import notify_limiter
+
+TABLET = "TABSESS_test"
+TEACHER_ID = 1
+
+
+class FakeSession:
+    def __init__(self, teacher):
+        self.teacher = teacher
+
+    async def get(self, model, pk):
+        return self.teacher
+
+    async def commit(self):
+        pass
+
+
+def _notify(teacher):
+    return asyncio.run(notify_teacher(FakeSession(teacher), TEACHER_ID, TABLET))
+
+
+def setup_function():
+    globals.SSE_TABLET_CONNECTIONS[TABLET] = asyncio.Queue()
+
+
+def teardown_function():
+    globals.SSE_TABLET_CONNECTIONS.pop(TABLET, None)
+    globals.SSE_TEACHER_CONNECTIONS.pop(TEACHER_ID, None)
+    notify_limiter.forget(TABLET, TEACHER_ID)
+
+
+def test_failed_notify_does_not_coalesce_retry():
+    # No open stream and no push token: nothing can be delivered
+    teacher = SimpleNamespace(id=TEACHER_ID, firebase_token=None)
+
+    assert _notify(teacher)["status"] == "failed"
+    assert _notify(teacher)["status"] == "failed"
+
+
+def test_retry_after_failure_reaches_teacher():
+    teacher = SimpleNamespace(id=TEACHER_ID, firebase_token=None)
+    assert _notify(teacher)["status"] == "failed"
+
+    # The teacher's app connects, then the kiosk retries within the window
+    queue = asyncio.Queue()
+    globals.SSE_TEACHER_CONNECTIONS[TEACHER_ID] = {"phone": SimpleNamespace(queue=queue)}
+
+    result = _notify(teacher)
+
+    assert result["status"] == "success"
+    assert result["request_id"] is not None
+    assert queue.qsize() == 1
+
+
+def test_delivered_notify_still_coalesces():
+    teacher = SimpleNamespace(id=TEACHER_ID, firebase_token=None)
+    globals.SSE_TEACHER_CONNECTIONS[TEACHER_ID] = {"phone": SimpleNamespace(queue=asyncio.Queue())}
+
+    first = _notify(teacher)
+    second = _notify(teacher)
+
+    assert first["status"] == "success"
+    assert second["status"] == "coalesced"
+    assert second["request_id"] == first["request_id"]
@@ -0,0 +1,76 @@
+"""Only the admin's kiosk registrations are stored, and re-registering never adds a row."""
+from datetime import datetime
+
+import httpx
+
+from sqlalchemy import func, select
+
+from app import globals, models, tablets
+from app.admin_auth import SESSION_KEY
+from app.database import AsyncSessionLocal, init_db
+from app.main import app
+
+from .conftest import run
+
+
+async def _tablet_rows() -> int:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count()).select_from(models.Tablet))
+
+
+async def _register(client: httpx.AsyncClient, body: dict, admin: bool = False) -> httpx.Response:
+    headers = {"Authorization": SESSION_KEY} if admin else {}
+    return await client.post("/api/registerTablet", json=body, headers=headers)
+
+
+def test_reregistering_does_not_duplicate():
+    async def scenario():
+        await init_db()
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            first = await _register(client, {"label": "Lobby"}, admin=True)
+            session = first.json()["tablet_session"]
+
+            again = [
+                await _register(client, {"tablet_session": session}),
+                await _register(client, {"tablet_session": session, "label": "Lobby"}),
+                await _register(client, {"tablet_session": session, "location": "Hall"}, admin=True),
+            ]
+
+        globals.TABLET_SESSIONS.clear()
+        async with AsyncSessionLocal() as db:
+            # Loaded back from its row, as another worker would
+            resumed = await tablets.resume(db, session)
+
+        return session, again, resumed, await _tablet_rows()
+
+    session, again, resumed, rows = run(scenario())
+
+    assert [response.status_code for response in again] == [200, 200, 200]
+    assert {response.json()["tablet_session"] for response in again} == {session}
+    assert resumed is not None and (resumed.label, resumed.location) == ("Lobby", "Hall")
+    assert rows == 1
+
+
+def test_anonymous_registration_stays_in_memory():
+    async def scenario():
+        await init_db()
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            registered = [await _register(client, {"label": "Kiosk"}) for _ in range(3)]
+
+        entries = [globals.TABLET_SESSIONS[response.json()["tablet_session"]] for response in registered]
+
+        # Never connected: forgotten once idle
+        for entry in entries:
+            entry.last_seen = datetime.now() - tablets.EPHEMERAL_IDLE * 2
+
+        await tablets.flush_last_seen()
+
+        return entries, await _tablet_rows(), len(globals.TABLET_SESSIONS)
+
+    entries, rows, remembered = run(scenario())
+
+    assert all(entry.ephemeral and entry.label == "Kiosk" for entry in entries)
+    assert rows == 0
+    assert remembered == 0
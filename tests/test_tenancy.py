@@ -0,0 +1,76 @@
+"""One school's data, event streams and caches are invisible to another."""
+import asyncio
+import os
+
+import httpx
+import pytest
+
+from app import database, globals, models, sse, tenancy
+from app.database import AsyncSessionLocal, init_db
+from app.main import app
+from app.timetable import timetable
+
+from .conftest import run
+
+TABLET = "TABSESS_north"
+
+
+@pytest.fixture
+def schools(tmp_path, monkeypatch):
+    north, south = (
+        tenancy.Tenant(name, str(tmp_path / name / "db.sqlite3"), str(tmp_path / name / "blobs"), str(tmp_path / name / "backups"))
+        for name in ("north", "south")
+    )
+
+    monkeypatch.setattr(tenancy, "TENANTS", {"north": north, "south": south})
+    monkeypatch.setattr(tenancy, "HOSTS", {})
+    monkeypatch.setattr(tenancy, "MULTI_TENANT", True)
+    monkeypatch.setattr(database, "MAX_OPEN_ENGINES", 2)
+
+    return north, south
+
+
+async def _teacher_names(client: httpx.AsyncClient, tenant: tenancy.Tenant):
+    response = await client.get("/api/teacherList", headers={tenancy.TENANT_HEADER: tenant.name})
+    assert response.status_code == 200
+    return [teacher["full_name"] for teacher in response.json()]
+
+
+def test_tenants_do_not_see_each_other(schools):
+    north, south = schools
+
+    async def scenario():
+        for tenant in schools:
+            with tenancy.use(tenant):
+                await init_db()
+
+        with tenancy.use(north):
+            async with AsyncSessionLocal() as db:
+                db.add(models.Teacher(full_name="North teacher", token="token-north", email_address="north@test"))
+                await db.commit()
+                await timetable.ensure_loaded(db)
+
+            queue = globals.SSE_TABLET_CONNECTIONS[TABLET] = asyncio.Queue()
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            # North's list is cached first, south must still get its own
+            north_names = await _teacher_names(client, north)
+            south_names = await _teacher_names(client, south)
+
+        with tenancy.use(south):
+            south_view = {
+                "tablets": dict(globals.SSE_TABLET_CONNECTIONS),
+                "timetable_loaded": timetable.loaded,
+            }
+            sse.publish_tablets({"event": "reload", "teacher_id": 1})
+
+        return north_names, south_names, south_view, queue.qsize()
+
+    north_names, south_names, south_view, north_frames = run(scenario())
+
+    assert north_names == ["North teacher"]
+    assert south_names == []
+    assert south_view == {"tablets": {}, "timetable_loaded": False}
+    assert north_frames == 0
+    assert os.path.exists(north.database_path) and os.path.exists(south.database_path)
+    assert north.database_path != south.database_path
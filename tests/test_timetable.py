@@ -0,0 +1,164 @@
+"""Schedule writes are checked for overlaps, against the cache and against the table."""
+import sqlite3
+
+from datetime import time
+
+import httpx
+import pytest
+
+from fastapi import HTTPException
+from sqlalchemy import insert
+
+from app import models, tenancy
+from app.database import AsyncSessionLocal, init_db
+from app.enums import WeekDays
+from app.main import app
+from app.timetable import Slot, Timetable, timetable
+
+from .conftest import run
+
+TOKEN = "token-1"
+
+
+def _slot(id, time_in, time_out, teacher_id=1, class_id=1, weekday=WeekDays(0), is_break=False) -> Slot:
+    return Slot(
+        id=id,
+        teacher_id=teacher_id,
+        class_id=class_id,
+        subject="Math",
+        weekday=weekday,
+        time_in=time_in,
+        time_out=time_out,
+        is_break=is_break,
+    )
+
+
+def _timetable(*slots: Slot) -> Timetable:
+    table = Timetable()
+    table.loaded = True
+
+    for slot in slots:
+        table.upsert(slot)
+
+    return table
+
+
+def test_overlap_is_a_conflict():
+    table = _timetable(_slot(1, time(8), time(9)))
+
+    with pytest.raises(HTTPException) as raised:
+        table.check(_slot(None, time(8, 30), time(9, 30)))
+
+    assert raised.value.status_code == 409
+    assert [conflict["id"] for conflict in raised.value.detail["conflicts"]] == [1]  # type: ignore
+
+
+def test_overlap_through_the_class_is_a_conflict():
+    table = _timetable(_slot(1, time(8), time(9)))
+
+    with pytest.raises(HTTPException) as raised:
+        table.check(_slot(None, time(8), time(9), teacher_id=2))
+
+    assert raised.value.status_code == 409
+
+
+def test_adjacent_slots_and_breaks_are_accepted():
+    table = _timetable(_slot(1, time(8), time(9)))
+
+    table.check(_slot(None, time(9), time(10)))
+    table.check(_slot(None, time(8), time(9), teacher_id=2, is_break=True))
+    table.check(_slot(None, time(8), time(9), weekday=WeekDays(1)))
+
+
+def test_inverted_times_are_unprocessable():
+    table = _timetable()
+
+    for time_in, time_out in ((time(9), time(8)), (time(9), time(9))):
+        with pytest.raises(HTTPException) as raised:
+            table.check(_slot(None, time_in, time_out))
+
+        assert raised.value.status_code == 422
+
+
+def test_edit_does_not_conflict_with_itself():
+    table = _timetable(_slot(1, time(8), time(9)), _slot(2, time(10), time(11)))
+
+    table.check(_slot(1, time(8, 15), time(9, 15)))
+
+    with pytest.raises(HTTPException):
+        table.check(_slot(1, time(9, 30), time(10, 30)))
+
+
+async def _seed():
+    await init_db()
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(models.Teacher), [{"full_name": "Teacher 1", "token": TOKEN, "email_address": "1@test"}])
+        await db.execute(insert(models.SchoolClass), [{"name": "Class 1", "grade": 7}])
+        await db.commit()
+
+        await timetable.ensure_loaded(db)
+
+
+def _commit_from_another_worker(time_in: str, time_out: str):
+    """A row this worker's cache has not heard about yet."""
+    with sqlite3.connect(tenancy.current().database_path) as conn:
+        conn.execute(
+            "INSERT INTO teacher_schedule (teacher_id, class_id, subject, weekday, time_in, time_out, is_break)"
+            " VALUES (1, 1, 'Math', ?, ?, ?, 0)",
+            (WeekDays(0).name, time_in, time_out),
+        )
+
+
+async def _schedule(method: str, body: dict) -> httpx.Response:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.request(method, "/api/schedule", json=body, headers={"Authorization": TOKEN})
+
+
+def test_writes_recheck_the_database():
+    async def scenario():
+        await _seed()
+        _commit_from_another_worker("08:00:00.000000", "09:00:00.000000")
+
+        body = {"class_id": 1, "subject": "Math", "weekday": 0, "time_in": "08:30", "time_out": "09:30"}
+        created = await _schedule("POST", body)
+        accepted = await _schedule("POST", {**body, "time_in": "09:00", "time_out": "10:00"})
+        moved = await _schedule("OPTIONS", {**body, "id": accepted.json()["id"], "time_in": "07:30", "time_out": "08:30"})
+        kept = await _schedule("OPTIONS", {**body, "id": accepted.json()["id"], "time_in": "09:15", "time_out": "10:15"})
+
+        async with AsyncSessionLocal() as db:
+            rows = (await db.scalars(models.Schedule.__table__.select())).all()
+
+        return created, accepted, moved, kept, rows
+
+    created, accepted, moved, kept, rows = run(scenario())
+
+    assert created.status_code == 409
+    assert accepted.status_code == 200
+    assert moved.status_code == 409
+    assert kept.status_code == 200
+    assert len(rows) == 2
+
+
+def test_teacher_now():
+    async def scenario():
+        await _seed()
+        _commit_from_another_worker("08:00:00.000000", "09:00:00.000000")
+        timetable.invalidate()
+
+        at = {"at": "2026-10-19T08:30:00.250000"}
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return (
+                await client.get("/api/teacher/1/now", params=at),
+                await client.get("/api/teachers/now", params=at),
+                await client.get("/api/teacher/2/now", params=at),
+            )
+
+    one, every, unknown = run(scenario())
+
+    assert one.status_code == 200
+    assert one.json()["current"]["subject"] == "Math"
+    assert one.json() == every.json()[0]
+    assert one.json()["at"] == "2026-10-19T08:30:00"
+    assert unknown.status_code == 404